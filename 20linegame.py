@@ -1,33 +1,79 @@
 # a simple game
-def game():
-    print("Welcome to the game! You are in a dark cave")
-    choice = input("Do you want to go left or right? ")
+import sys
+
+
+def game(ask=input, say=print):
+    say("Welcome to the game! You are in a dark cave")
+    choice = ask("Do you want to go left or right? ")
     if choice == "left":
-        print("You are in a room with a table and a chair")
-        choice = input("Do you want to sit down or stand up? ")
+        say("You are in a room with a table and a chair")
+        choice = ask("Do you want to sit down or stand up? ")
         if choice == "sit down":
-            print("You are sitting down")
-            print("You need to find the magic stone")
+            say("You are sitting down")
+            say("You need to find the magic stone")
         else:
-            print("You are standing up")
-            print("You need to find the magic stone")
+            say("You are standing up")
+            say("You need to find the magic stone")
+        won = False
     else:
-        print("You are in a room with a table and a chair")
-        choice = input("Do you want to sit down or stand up? ")
+        say("You are in a room with a table and a chair")
+        choice = ask("Do you want to sit down or stand up? ")
         if choice == "sit down":
-            print("You are sitting down")
-            print("You need to find the magic stone")
+            say("You are sitting down")
+            say("You need to find the magic stone")
+            won = False
         else:
-            print("You are standing up")
-            print("You did it! You are a wizard!")
-    print("Game over")
-    
-game()
+            say("You are standing up")
+            say("You did it! You are a wizard!")
+            won = True
+    say("Game over")
+    return won
 
 
+def main(argv=None):
+    """无界面模式：退出码 0 表示成为魔法师，1 表示没有找到魔法石，2 表示输入不够"""
+    # 命令行解析只在直接运行时需要，导入这个模块（例如 cave_solver）时不加载
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(description='洞穴探险（20行版本）')
+    parser.add_argument('--choices', help="用逗号分隔的选择，例如 'right,stand up'")
+    parser.add_argument('--script', metavar='FILE', help="按行从文件读取选择，'-' 表示标准输入")
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument('--quiet', action='store_true', help='不输出游戏过程')
+    output.add_argument('--jsonl', action='store_true', help='输出一行JSON结果')
+    args = parser.parse_args(argv)
 
+    if args.choices is None and args.script is None and not (args.quiet or args.jsonl):
+        game()
+        return 0
+
+    if args.choices is not None:
+        answers = iter(args.choices.split(','))
+    elif args.script is not None and args.script != '-':
+        with open(args.script, encoding='utf-8') as f:
+            answers = iter(f.read().splitlines())
+    else:
+        answers = (line.rstrip('\n') for line in sys.stdin)
 
+    taken = []
 
+    def ask(prompt=''):
+        answer = next(answers, None)
+        if answer is None:
+            raise EOFError('not enough choices')
+        taken.append(answer)
+        return answer
 
+    say = print if not (args.quiet or args.jsonl) else (lambda *a: None)
+    try:
+        won = game(ask, say)
+    except EOFError as e:
+        print(e, file=sys.stderr)
+        return 2
+    if args.jsonl:
+        print(json.dumps({'choices': taken, 'wizard': won}))
+    return 0 if won else 1
 
 
+if __name__ == '__main__':
+    sys.exit(main())
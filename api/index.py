@@ -4,7 +4,14 @@ Vercel serverless function for the web games
 import json
 import random
 import os
-from datetime import datetime
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import character_store
+import idempotency
+import rate_limit
 
 # RPG战斗游戏类定义
 class Character:
@@ -134,14 +141,387 @@ class CaveGame:
 
 # 全局游戏状态存储（在serverless环境中使用内存存储）
 games = {}
-characters = {}
+# 角色按玩家ID分命名空间保存：玩家ID -> 角色名 -> (职业, HP)
+characters = character_store.CharacterStore()
+
+# 状态持久化（设置 GAME_STATE_DIR 环境变量后启用，例如 /tmp/kbpygames）
+journal = None
+
+
+def restore_character(name, character_class, hp):
+    """根据职业和HP重建角色字典"""
+    character = Warrior(name) if character_class == '战士' else Mage(name)
+    if hp <= 0:
+        character.take_damage(character.hp)
+    else:
+        character.hp = hp
+    return character.to_dict()
+
+
+def restore_cave_game(state, previous_choice):
+    """按原来的选择重新走一遍，恢复洞穴游戏的状态和提示信息"""
+    game = CaveGame()
+    if state != 'start':
+        game.make_choice(previous_choice)
+        if state == 'sitting':
+            game.make_choice('sit down')
+        elif state == 'standing':
+            game.make_choice('stand up')
+    return game
+
+
+def _on_restored_character(key, character_class, hp):
+    owner, name = character_store.split_key(key)
+    characters.put(owner, name, character_class, max(hp, 0))
+
+
+def _on_restored_hp(key, hp):
+    owner, name = character_store.split_key(key)
+    if characters.get(owner, name) is not None:
+        characters.set_hp(owner, name, max(hp, 0))
+
+
+def _on_restored_cave(game_id, state, previous_choice):
+    games[game_id] = restore_cave_game(state, previous_choice)
+
+
+def snapshot_state():
+    """生成快照用的紧凑状态副本"""
+    character_state = {character_store.qualify(owner, name): (character_class, hp)
+                       for owner, name, character_class, hp in characters.items()}
+    game_state = {game_id: (game.state, game.previous_choice)
+                  for game_id, game in list(games.items())}
+    return character_state, game_state
+
+
+def setup_persistence():
+    """第一次处理请求时调用：导入模块时不读写磁盘，冷启动只付出必要的导入时间"""
+    global journal
+    state_dir = os.environ.get('GAME_STATE_DIR')
+    if not state_dir or journal is not None:
+        return
+    import persistence
+    journal = persistence.Journal(state_dir)
+    journal.recover(_on_restored_character, _on_restored_hp, _on_restored_cave)
+    journal.start(snapshot_state)
+
+
+# 浏览器离线战斗的校验结果缓存和一次性种子，第一次用到时才创建
+# （多个实例之间要认可彼此发的种子，需要设置 REPLAY_SECRET 环境变量）
+replay_cache = None
+seed_issuer = None
+
+
+def get_seed_issuer():
+    global seed_issuer
+    import offline_battle
+    if seed_issuer is None:
+        seed_issuer = offline_battle.SeedIssuer()
+    return seed_issuer
+
+
+def get_replay_cache():
+    global replay_cache
+    import offline_battle
+    if replay_cache is None:
+        replay_cache = offline_battle.VerificationCache()
+    return replay_cache
+
+
+def settle_offline_battle(pair, result):
+    """按服务器算出的结果结算离线战斗：双方都是本实例保存的角色、HP还是开战时的数值时写回最终HP"""
+    (key1, class1, hp1), (key2, class2, hp2) = pair
+    owner1, name1 = character_store.split_key(key1)
+    owner2, name2 = character_store.split_key(key2)
+    with characters.locked((owner1, name1), (owner2, name2)):
+        if (characters.get(owner1, name1) != (class1, hp1)
+                or characters.get(owner2, name2) != (class2, hp2)):
+            return
+        characters.set_hp(owner1, name1, result['hp'][0])
+        characters.set_hp(owner2, name2, result['hp'][1])
+        if journal is not None:
+            journal.record_character_hp(key1, result['hp'][0])
+            journal.record_character_hp(key2, result['hp'][1])
+
+
+def issue_seed(data, owner):
+    import offline_battle
+    offline_battle.settle_expired(get_replay_cache(), get_seed_issuer(), settle_offline_battle)
+    pair = offline_battle.fighters(data, owner, lambda name: characters.get(owner, name))
+    issued = get_seed_issuer().issue(pair)
+    issued.update(offline_battle.fighters_json(pair))
+    return issued
+
+
+def verify_replay(claim, owner):
+    import offline_battle
+    offline_battle.settle_expired(get_replay_cache(), get_seed_issuer(), settle_offline_battle)
+    return offline_battle.verify_claim(claim, get_replay_cache(), get_seed_issuer(), owner, settle_offline_battle)
+
+# 限流和准入控制（同一个实例处理的请求共享）
+limiter = rate_limit.TokenBucketLimiter()
+admission = rate_limit.AdmissionController(lambda: len(characters) + len(games))
+
+# 会新增游戏状态的接口，状态过多或内存不足时优先拒绝
+ALLOCATING_PATHS = ('/api/rpg/create_character', '/api/cave/init')
+
+# 支持 Idempotency-Key 的接口
+IDEMPOTENT_PATHS = ('/api/rpg/battle', '/api/cave/make_choice')
+idempotent_results = idempotency.IdempotencyCache(ttl=rate_limit.env_number('IDEMPOTENCY_TTL', 300))
+
+
+def route(request, path, method, data, query, owner, headers):
+    """按路径分发API请求，返回 Vercel 格式的响应"""
+    # 处理RPG游戏API
+    if path == '/api/rpg/create_character' and method == 'POST':
+        data = request.get('json', {})
+        try:
+            name = character_store.normalize_name(data.get('name'))
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': str(e)})
+            }
+        char_class = data.get('class')
+        
+        if char_class == 'warrior':
+            character = Warrior(name)
+        elif char_class == 'mage':
+            character = Mage(name)
+        else:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': 'Invalid character class'})
+            }
+        
+        characters.put(owner, name, character.character_class, character.hp)
+        if journal is not None:
+            journal.record_character_created(character_store.qualify(owner, name),
+                                             character.character_class, character.hp)
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': json.dumps(character.to_dict(), ensure_ascii=False)
+        }
+    
+    elif path == '/api/rpg/battle' and method == 'POST':
+        data = request.get('json', {})
+        player1_name = data.get('player1')
+        player2_name = data.get('player2')
+        
+        record1 = characters.get(owner, player1_name)
+        record2 = characters.get(owner, player2_name)
+        if record1 is None or record2 is None:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': 'Character not found'})
+            }
+        
+        # 重新创建角色对象
+        p1_data = restore_character(player1_name, *record1)
+        p2_data = restore_character(player2_name, *record2)
+        
+        if p1_data['character_class'] == '战士':
+            player1 = Warrior(p1_data['name'])
+        else:
+            player1 = Mage(p1_data['name'])
+        
+        if p2_data['character_class'] == '战士':
+            player2 = Warrior(p2_data['name'])
+        else:
+            player2 = Mage(p2_data['name'])
+        
+        # 恢复HP状态
+        player1.hp = p1_data['hp']
+        player1.is_alive = p1_data['is_alive']
+        player2.hp = p2_data['hp']
+        player2.is_alive = p2_data['is_alive']
+        
+        # 随机决定攻击顺序
+        if random.random() < 0.5:
+            attacker, defender = player1, player2
+            first_attacker = player1_name
+        else:
+            attacker, defender = player2, player1
+            first_attacker = player2_name
+        
+        battle_log = []
+        
+        # 第一轮攻击
+        if attacker.is_alive and defender.is_alive:
+            result = attacker.attack(defender)
+            if isinstance(result, tuple):
+                damage, is_special = result
+                if is_special:
+                    if attacker.character_class == '战士':
+                        battle_log.append(f"💥 {attacker.name} 发动暴击！造成 {damage} 点伤害！")
+                    else:
+                        battle_log.append(f"🔥 {attacker.name} 施放强力法术！造成 {damage} 点伤害！")
+                else:
+                    battle_log.append(f"{attacker.name} 攻击 {defender.name}，造成 {damage} 点伤害！")
+            else:
+                battle_log.append(f"{attacker.name} 攻击 {defender.name}，造成 {result} 点伤害！")
+        
+        # 第二轮攻击（如果双方都还活着）
+        if attacker.is_alive and defender.is_alive:
+            result = defender.attack(attacker)
+            if isinstance(result, tuple):
+                damage, is_special = result
+                if is_special:
+                    if defender.character_class == '战士':
+                        battle_log.append(f"💥 {defender.name} 发动暴击！造成 {damage} 点伤害！")
+                    else:
+                        battle_log.append(f"🔥 {defender.name} 施放强力法术！造成 {damage} 点伤害！")
+                else:
+                    battle_log.append(f"{defender.name} 反击 {attacker.name}，造成 {damage} 点伤害！")
+            else:
+                battle_log.append(f"{defender.name} 反击 {attacker.name}，造成 {result} 点伤害！")
+        
+        # 更新角色状态
+        characters.set_hp(owner, player1_name, player1.hp)
+        characters.set_hp(owner, player2_name, player2.hp)
+        if journal is not None:
+            journal.record_character_hp(character_store.qualify(owner, player1_name), player1.hp)
+            journal.record_character_hp(character_store.qualify(owner, player2_name), player2.hp)
+        
+        # 检查胜负
+        winner = None
+        if not player1.is_alive:
+            winner = player2_name
+        elif not player2.is_alive:
+            winner = player1_name
+        
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': json.dumps({
+                'battle_log': battle_log,
+                'player1': player1.to_dict(),
+                'player2': player2.to_dict(),
+                'first_attacker': first_attacker,
+                'winner': winner
+            }, ensure_ascii=False)
+        }
+    
+    elif path == '/api/rpg/seed' and method == 'POST':
+        # 离线战斗用的一次性种子，绑定两个参战角色，校验时必须带上票据
+        try:
+            issued = issue_seed(data, owner)
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': str(e)})
+            }
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': json.dumps(issued, ensure_ascii=False)
+        }
+    
+    elif path == '/api/rpg/verify' and method == 'POST':
+        # 校验浏览器离线打完的战斗：只上传服务器发的种子、参战职业和结果，服务器重算比较
+        try:
+            result = verify_replay(data, owner)
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': str(e)})
+            }
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': json.dumps(result)
+        }
+    
+    elif path == '/api/rpg/roster' and method == 'GET':
+        # 列出玩家自己的角色：?start=0&count=50 翻页
+        try:
+            start = max(int(query.get('start', ['0'])[0]), 0)
+            count = min(max(int(query.get('count', ['50'])[0]), 0), 200)
+        except ValueError:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': 'Invalid query'})
+            }
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': json.dumps({
+                'owner': owner,
+                'total': characters.roster_size(owner),
+                'start': start,
+                'characters': [restore_character(name, character_class, hp)
+                               for name, character_class, hp in characters.roster(owner, start, count)]
+            }, ensure_ascii=False)
+        }
+    
+    # 处理洞穴游戏API
+    elif path == '/api/cave/init' and method == 'POST':
+        game = CaveGame()
+        game_id = str(time.time())
+        games[game_id] = game
+        if journal is not None:
+            journal.record_cave_state(game_id, game.state, game.previous_choice)
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': json.dumps({
+                'state': game.state,
+                'message': game.message,
+                'choices': game.choices,
+                'previous_choice': game.previous_choice,
+                'game_id': game_id
+            }, ensure_ascii=False)
+        }
+    
+    elif path == '/api/cave/make_choice' and method == 'POST':
+        data = request.get('json', {})
+        game_id = data.get('game_id')
+        choice = data.get('choice')
+        
+        if game_id not in games:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': 'Game not found'})
+            }
+        
+        game = games[game_id]
+        game.make_choice(choice)
+        if journal is not None:
+            journal.record_cave_state(game_id, game.state, game.previous_choice)
+        
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': json.dumps({
+                'state': game.state,
+                'message': game.message,
+                'choices': game.choices,
+                'previous_choice': game.previous_choice
+            }, ensure_ascii=False)
+        }
+    
+    else:
+        return {
+            'statusCode': 404,
+            'headers': headers,
+            'body': json.dumps({'error': 'Not found'})
+        }
 
 
 def handler(request):
     """Vercel serverless function handler"""
-    from http.server import BaseHTTPRequestHandler
     from urllib.parse import urlparse, parse_qs
     
+    setup_persistence()
+    
     # 解析请求
     parsed_url = urlparse(request.get('url', ''))
     path = parsed_url.path
@@ -152,9 +532,10 @@ def handler(request):
         'Content-Type': 'application/json',
         'Access-Control-Allow-Origin': '*',
         'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-        'Access-Control-Allow-Headers': 'Content-Type'
+        'Access-Control-Allow-Headers': 'Content-Type, X-Player-Id, Idempotency-Key'
     }
     
+    admitted = False
     try:
         if method == 'OPTIONS':
             return {
@@ -163,174 +544,57 @@ def handler(request):
                 'body': ''
             }
         
-        # 处理RPG游戏API
-        if path == '/api/rpg/create_character' and method == 'POST':
-            data = request.get('json', {})
-            name = data.get('name')
-            char_class = data.get('class')
-            
-            if char_class == 'warrior':
-                character = Warrior(name)
-            elif char_class == 'mage':
-                character = Mage(name)
-            else:
-                return {
-                    'statusCode': 400,
-                    'headers': headers,
-                    'body': json.dumps({'error': 'Invalid character class'})
-                }
-            
-            characters[name] = character.to_dict()
+        # 限流：函数拿不到连接的地址，按 x-forwarded-for 里可信代理追加的地址识别客户端
+        # （Vercel 上默认信任1层，即 Vercel 自己写入的客户端IP；客户端伪造的地址只会出现在前面）
+        request_headers = {k.lower(): v for k, v in (request.get('headers') or {}).items()}
+        client = rate_limit.client_key(None, request_headers.get('x-forwarded-for'))
+        allowed, retry_after = limiter.allow(client)
+        if not allowed:
             return {
-                'statusCode': 200,
-                'headers': headers,
-                'body': json.dumps(character.to_dict(), ensure_ascii=False)
+                'statusCode': 429,
+                'headers': dict(headers, **{'Retry-After': str(int(retry_after) + 1)}),
+                'body': json.dumps({'error': 'Too many requests'})
             }
-        
-        elif path == '/api/rpg/battle' and method == 'POST':
-            data = request.get('json', {})
-            player1_name = data.get('player1')
-            player2_name = data.get('player2')
-            
-            if player1_name not in characters or player2_name not in characters:
-                return {
-                    'statusCode': 400,
-                    'headers': headers,
-                    'body': json.dumps({'error': 'Character not found'})
-                }
-            
-            # 重新创建角色对象
-            p1_data = characters[player1_name]
-            p2_data = characters[player2_name]
-            
-            if p1_data['character_class'] == '战士':
-                player1 = Warrior(p1_data['name'])
-            else:
-                player1 = Mage(p1_data['name'])
-            
-            if p2_data['character_class'] == '战士':
-                player2 = Warrior(p2_data['name'])
-            else:
-                player2 = Mage(p2_data['name'])
-            
-            # 恢复HP状态
-            player1.hp = p1_data['hp']
-            player1.is_alive = p1_data['is_alive']
-            player2.hp = p2_data['hp']
-            player2.is_alive = p2_data['is_alive']
-            
-            # 随机决定攻击顺序
-            if random.random() < 0.5:
-                attacker, defender = player1, player2
-                first_attacker = player1_name
-            else:
-                attacker, defender = player2, player1
-                first_attacker = player2_name
-            
-            battle_log = []
-            
-            # 第一轮攻击
-            if attacker.is_alive and defender.is_alive:
-                result = attacker.attack(defender)
-                if isinstance(result, tuple):
-                    damage, is_special = result
-                    if is_special:
-                        if attacker.character_class == '战士':
-                            battle_log.append(f"💥 {attacker.name} 发动暴击！造成 {damage} 点伤害！")
-                        else:
-                            battle_log.append(f"🔥 {attacker.name} 施放强力法术！造成 {damage} 点伤害！")
-                    else:
-                        battle_log.append(f"{attacker.name} 攻击 {defender.name}，造成 {damage} 点伤害！")
-                else:
-                    battle_log.append(f"{attacker.name} 攻击 {defender.name}，造成 {result} 点伤害！")
-            
-            # 第二轮攻击（如果双方都还活着）
-            if attacker.is_alive and defender.is_alive:
-                result = defender.attack(attacker)
-                if isinstance(result, tuple):
-                    damage, is_special = result
-                    if is_special:
-                        if defender.character_class == '战士':
-                            battle_log.append(f"💥 {defender.name} 发动暴击！造成 {damage} 点伤害！")
-                        else:
-                            battle_log.append(f"🔥 {defender.name} 施放强力法术！造成 {damage} 点伤害！")
-                    else:
-                        battle_log.append(f"{defender.name} 反击 {attacker.name}，造成 {damage} 点伤害！")
-                else:
-                    battle_log.append(f"{defender.name} 反击 {attacker.name}，造成 {result} 点伤害！")
-            
-            # 更新角色状态
-            characters[player1_name] = player1.to_dict()
-            characters[player2_name] = player2.to_dict()
-            
-            # 检查胜负
-            winner = None
-            if not player1.is_alive:
-                winner = player2_name
-            elif not player2.is_alive:
-                winner = player1_name
-            
+        reason = admission.enter(path in ALLOCATING_PATHS)
+        if reason is not None:
             return {
-                'statusCode': 200,
-                'headers': headers,
-                'body': json.dumps({
-                    'battle_log': battle_log,
-                    'player1': player1.to_dict(),
-                    'player2': player2.to_dict(),
-                    'first_attacker': first_attacker,
-                    'winner': winner
-                }, ensure_ascii=False)
+                'statusCode': 503,
+                'headers': dict(headers, **{'Retry-After': '1'}),
+                'body': json.dumps({'error': reason})
             }
+        admitted = True
         
-        # 处理洞穴游戏API
-        elif path == '/api/cave/init' and method == 'POST':
-            game = CaveGame()
-            game_id = str(datetime.now().timestamp())
-            games[game_id] = game
+        # 玩家ID：请求体里的 owner 字段或 X-Player-Id 头，都没有时为 public
+        data = request.get('json') or {}
+        query = parse_qs(parsed_url.query)
+        try:
+            owner = character_store.normalize_owner(
+                data.get('owner') or query.get('owner', [None])[0] or request_headers.get('x-player-id'))
+        except ValueError as e:
             return {
-                'statusCode': 200,
+                'statusCode': 400,
                 'headers': headers,
-                'body': json.dumps({
-                    'state': game.state,
-                    'message': game.message,
-                    'choices': game.choices,
-                    'previous_choice': game.previous_choice,
-                    'game_id': game_id
-                }, ensure_ascii=False)
+                'body': json.dumps({'error': str(e)})
             }
         
-        elif path == '/api/cave/make_choice' and method == 'POST':
-            data = request.get('json', {})
-            game_id = data.get('game_id')
-            choice = data.get('choice')
-            
-            if game_id not in games:
-                return {
-                    'statusCode': 400,
-                    'headers': headers,
-                    'body': json.dumps({'error': 'Game not found'})
-                }
-            
-            game = games[game_id]
-            game.make_choice(choice)
-            
-            return {
-                'statusCode': 200,
-                'headers': headers,
-                'body': json.dumps({
-                    'state': game.state,
-                    'message': game.message,
-                    'choices': game.choices,
-                    'previous_choice': game.previous_choice
-                }, ensure_ascii=False)
-            }
+        key = idempotency.validate_key(request_headers.get('idempotency-key'))
+        if key is None or method != 'POST' or path not in IDEMPOTENT_PATHS:
+            return route(request, path, method, data, query, owner, headers)
         
-        else:
-            return {
-                'statusCode': 404,
-                'headers': headers,
-                'body': json.dumps({'error': 'Not found'})
-            }
+        # 带幂等键的重试返回第一次的结果（同一个实例内有效）
+        try:
+            response, replayed = idempotent_results.run(
+                (owner, path, key),
+                idempotency.fingerprint(path, json.dumps(data, sort_keys=True)),
+                lambda: route(request, path, method, data, query, owner, headers))
+        except idempotency.KeyReused as e:
+            return {'statusCode': 422, 'headers': headers, 'body': json.dumps({'error': str(e)})}
+        except idempotency.StillRunning as e:
+            return {'statusCode': 409, 'headers': dict(headers, **{'Retry-After': '1'}),
+                    'body': json.dumps({'error': str(e)})}
+        if replayed:
+            response = dict(response, headers=dict(response['headers'], **{idempotency.REPLAYED_HEADER: 'true'}))
+        return response
     
     except Exception as e:
         return {
@@ -338,3 +602,6 @@ def handler(request):
             'headers': headers,
             'body': json.dumps({'error': str(e)})
         }
+    finally:
+        if admitted:
+            admission.leave()
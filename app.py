@@ -1,10 +1,19 @@
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, Response, render_template, request, jsonify, session, g
+import math
 import random
-import uuid
+import threading
+
+import character_store
+import rate_limit
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'
 
+# 限流和准入控制（游戏状态保存在session里，不需要限制服务端状态数量）
+limiter = rate_limit.TokenBucketLimiter()
+admission = rate_limit.AdmissionController()
+ALLOCATING_PATHS = ('/api/rpg/create_character', '/api/cave/init')
+
 # RPG战斗游戏类定义
 class Character:
     """角色基类 - 所有角色的通用属性和方法"""
@@ -131,6 +140,32 @@ class CaveGame:
         self.previous_choice = choice
 
 
+@app.before_request
+def admit_request():
+    """API请求和WebSocket握手先经过限流和准入检查"""
+    if not request.path.startswith(('/api/', '/ws/')):
+        return None
+    client = rate_limit.client_key(request.remote_addr, request.headers.get('X-Forwarded-For'))
+    allowed, retry_after = limiter.allow(client)
+    if not allowed:
+        response = jsonify({'error': 'Too many requests'})
+        response.headers['Retry-After'] = str(math.ceil(retry_after))
+        return response, 429
+    reason = admission.enter(request.path in ALLOCATING_PATHS)
+    if reason is not None:
+        response = jsonify({'error': reason})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    g.admitted = True
+    return None
+
+
+@app.teardown_request
+def release_request(exc):
+    if g.pop('admitted', False):
+        admission.leave()
+
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -149,7 +184,10 @@ def cave_game():
 @app.route('/api/rpg/create_character', methods=['POST'])
 def create_character():
     data = request.json
-    name = data.get('name')
+    try:
+        name = character_store.normalize_name(data.get('name'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     character_class = data.get('class')
     
     if character_class == 'warrior':
@@ -301,5 +339,67 @@ def make_cave_choice():
     return jsonify(session['cave_game'])
 
 
+def duel_exchange(fighters):
+    """WebSocket对战的一回合，规则和 simple_web_games.duel_exchange 相同"""
+    players = []
+    for name, character_class, hp in fighters:
+        player = Warrior(name) if character_class == '战士' else Mage(name)
+        player.hp = hp
+        players.append(player)
+    first = 0 if random.random() < 0.5 else 1
+    events = []
+    for index in (first, 1 - first):
+        result = players[index].attack(players[1 - index])
+        if isinstance(result, tuple):
+            damage, is_special = result
+            events.append([index + 1, damage, is_special])
+    return first + 1, events, [players[0].hp, players[1].hp]
+
+
+# 第一次有人连接 /ws/duel 时才创建（导入 app.py 时不开线程、不建socket）
+_duel_hub = None
+_duel_hub_lock = threading.Lock()
+
+
+def duel_hub():
+    global _duel_hub
+    with _duel_hub_lock:
+        if _duel_hub is None:
+            import duel_ws
+            _duel_hub = duel_ws.DuelHub(duel_exchange)
+        return _duel_hub
+
+
+class DuelUpgradeResponse(Response):
+    """握手已经直接写到socket上，连接也交给了 duel_hub：
+
+    这里抛出 ConnectionError，让 werkzeug 当作客户端断开处理，不再写任何响应。
+    """
+
+    def __call__(self, environ, start_response):
+        raise ConnectionError('WebSocket handed over to duel hub')
+
+
+@app.route('/ws/duel')
+def duel_socket():
+    """WebSocket对战；只支持 werkzeug 开发服务器（需要 environ['werkzeug.socket']）
+
+    生产环境请使用 simple_web_games.py，见 DEPLOYMENT.md
+    """
+    import duel_ws
+    sock = request.environ.get('werkzeug.socket')
+    headers = duel_ws.handshake_headers(request.headers)
+    if sock is None or headers is None:
+        return jsonify({'error': 'WebSocket upgrade required'}), 400
+    hub = duel_hub()
+    if len(hub) >= duel_ws.MAX_ROOMS:
+        return jsonify({'error': 'Too many duel rooms'}), 503
+    lines = ['HTTP/1.1 101 Switching Protocols'] + [f'{key}: {value}' for key, value in headers.items()]
+    sock.sendall(('\r\n'.join(lines) + '\r\n\r\n').encode('ascii'))
+    room, name, character_class = duel_ws.duel_params(request.query_string.decode('utf-8', 'replace'))
+    hub.adopt(duel_ws.detach_socket(sock), room, name, character_class)
+    return DuelUpgradeResponse()
+
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
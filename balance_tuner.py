@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+职业平衡调参 - 自动搜索战士和法师的属性，让胜率和战斗回合数接近目标
+
+    python balance_tuner.py --target-win 0.5 --target-rounds 4 --trials 300
+    python balance_tuner.py --search grid --tune mage --out balance.json
+
+每个职业可以调整三个属性：HP、基础伤害、暴击（强力法术）概率。
+伤害范围相对基础伤害的偏移保持和现在的 Warrior/Mage 一样
+（战士普通攻击 ±5、暴击 +10~+20；法师普通攻击 -3~+7、强力法术 +15~+25）。
+
+评估一个候选方案 = 用 offline_battle 的规则打若干场战斗：
+    - 所有候选方案使用同一组种子（公共随机数），方案之间的差异不会被随机波动淹没
+    - 战斗分批进行，每批之后按置信区间估计"最好情况下的得分"，
+      已经不可能超过当前最优方案时提前停止（明显不好的方案只打一两批）
+    - 候选方案分发到多个进程并行评估
+    - grid/random 粗搜之后，从最优方案出发逐个属性微调（爬山），直到没有更好的相邻方案
+
+输出 ATTACK_PROFILES 格式的职业配置（可以直接替换 battle_oracle.py 里的定义）和一份报告，
+报告里的胜率和预期回合数由 battle_oracle 精确计算，不受抽样误差影响。
+"""
+
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import time
+from multiprocessing import Pool
+
+from battle_oracle import ATTACK_PROFILES, OddsTable, normalize_class
+from offline_battle import Mulberry32, fight
+
+CLASSES = ('战士', '法师')
+
+# Warrior/Mage 构造函数里的基础伤害，ATTACK_PROFILES 的伤害范围都是它加上固定偏移
+BASE_DAMAGE = {'战士': 25, '法师': 35}
+
+# 默认搜索范围：(最小值, 最大值, 步长)
+SEARCH_SPACE = {
+    'hp': (60, 160, 5),
+    'damage': (15, 45, 1),
+    'special_chance': (0.05, 0.5, 0.05),
+}
+
+BATCH_SIZE = 200
+CONFIDENCE_Z = 3.0
+
+
+def class_stats(character_class, profile=None):
+    """ATTACK_PROFILES 里的一项 -> {'hp', 'damage', 'special_chance'}"""
+    base = ATTACK_PROFILES[character_class]
+    profile = profile or base
+    return {
+        'hp': profile['hp'],
+        'damage': BASE_DAMAGE[character_class] + profile['normal'][1] - base['normal'][1],
+        'special_chance': profile['special_chance'],
+    }
+
+
+def make_profile(character_class, hp, damage, special_chance):
+    """按职业的伤害偏移生成 ATTACK_PROFILES 格式的配置"""
+    base = ATTACK_PROFILES[character_class]
+    shift = damage - BASE_DAMAGE[character_class]
+    return {
+        'hp': int(hp),
+        'special_chance': round(special_chance, 4),
+        'normal': (max(1, base['normal'][0] + shift), max(1, base['normal'][1] + shift)),
+        'special': (max(1, base['special'][0] + shift), max(1, base['special'][1] + shift)),
+    }
+
+
+def grid_values(low, high, step):
+    count = int(round((high - low) / step))
+    return [round(low + i * step, 4) for i in range(count + 1)]
+
+
+class Objective:
+    """得分 = 胜率偏差和回合数偏差按容差归一化后的平方和，越小越好"""
+
+    def __init__(self, target_win=0.5, target_rounds=4.0, win_tolerance=0.02, rounds_tolerance=0.5):
+        self.target_win = target_win
+        self.target_rounds = target_rounds
+        self.win_tolerance = win_tolerance
+        self.rounds_tolerance = rounds_tolerance
+
+    def score(self, win, rounds):
+        return (((win - self.target_win) / self.win_tolerance) ** 2
+                + ((rounds - self.target_rounds) / self.rounds_tolerance) ** 2)
+
+    def optimistic(self, win, win_error, rounds, rounds_error):
+        """置信区间内离目标最近的点的得分，用来判断能不能提前停止"""
+        win = min(max(self.target_win, win - win_error), win + win_error)
+        rounds = min(max(self.target_rounds, rounds - rounds_error), rounds + rounds_error)
+        return self.score(win, rounds)
+
+
+def evaluate(task):
+    """打 fights 场战斗评估一个方案（在工作进程中运行）
+
+    task = (编号, {职业: 配置}, 场数, 目标, 当前最优得分)
+    """
+    index, profiles, fights, objective, best = task
+    pair = (profiles['战士'], profiles['法师'])
+    wins = rounds_sum = rounds_sq = played = 0
+    pruned = False
+    # 种子就是场次编号：所有方案的第 n 场使用同一串随机数
+    while played < fights:
+        for seed in range(played, min(played + BATCH_SIZE, fights)):
+            winner, rounds = fight(Mulberry32(seed), pair, [pair[0]['hp'], pair[1]['hp']])
+            wins += winner == 1
+            rounds_sum += rounds
+            rounds_sq += rounds * rounds
+        played = min(played + BATCH_SIZE, fights)
+
+        win = wins / played
+        rounds = rounds_sum / played
+        if played < fights and best is not None:
+            win_error = CONFIDENCE_Z * math.sqrt(max(win * (1 - win), 0.25 / played) / played)
+            variance = max(rounds_sq / played - rounds * rounds, 0.0)
+            rounds_error = CONFIDENCE_Z * math.sqrt(max(variance, 0.25) / played)
+            if objective.optimistic(win, win_error, rounds, rounds_error) > best:
+                pruned = True
+                break
+
+    return {
+        'index': index,
+        'profiles': profiles,
+        'fights': played,
+        'warrior_win': win,
+        'rounds': rounds,
+        'score': objective.score(win, rounds),
+        'pruned': pruned,
+    }
+
+
+def candidate_space(tune, space=SEARCH_SPACE):
+    """每个要调整的职业的 [(hp, damage, special_chance), ...] 取值"""
+    values = [grid_values(*space[key]) for key in ('hp', 'damage', 'special_chance')]
+    result = {}
+    for character_class in CLASSES:
+        if character_class in tune:
+            result[character_class] = list(itertools.product(*values))
+        else:
+            stats = class_stats(character_class)
+            result[character_class] = [(stats['hp'], stats['damage'], stats['special_chance'])]
+    return result
+
+
+def generate_candidates(search, tune, trials, rng):
+    """grid 按顺序遍历全部组合（超过 trials 时均匀抽样），random 随机抽取 trials 个"""
+    space = candidate_space(tune)
+    total = math.prod(len(options) for options in space.values())
+    if search == 'grid' and total <= trials:
+        combos = itertools.product(*(space[c] for c in CLASSES))
+    elif search == 'grid':
+        stride = total / trials
+        combos = (_nth_combo(space, int(i * stride)) for i in range(trials))
+    else:
+        combos = (tuple(rng.choice(space[c]) for c in CLASSES) for _ in range(trials))
+    for combo in combos:
+        yield {c: make_profile(c, *stats) for c, stats in zip(CLASSES, combo)}
+
+
+def neighbours(profiles, tune, space=SEARCH_SPACE):
+    """在要调整的职业上，每个属性各加减一个步长得到的相邻方案"""
+    keys = ('hp', 'damage', 'special_chance')
+    for character_class in CLASSES:
+        if character_class not in tune:
+            continue
+        stats = class_stats(character_class, profiles[character_class])
+        for key in keys:
+            low, high, step = space[key]
+            for delta in (-step, step):
+                value = round(stats[key] + delta, 4)
+                if low <= value <= high:
+                    changed = dict(stats, **{key: value})
+                    candidate = dict(profiles)
+                    candidate[character_class] = make_profile(character_class, *(changed[k] for k in keys))
+                    yield candidate
+
+
+def _nth_combo(space, n):
+    combo = []
+    for character_class in reversed(CLASSES):
+        options = space[character_class]
+        n, i = divmod(n, len(options))
+        combo.append(options[i])
+    return tuple(reversed(combo))
+
+
+def exact_odds(profiles):
+    """battle_oracle 精确计算满血时战士的胜率和预期回合数（位置先后不影响结果）"""
+    warrior, mage = profiles['战士'], profiles['法师']
+    return OddsTable(warrior, mage).lookup(warrior['hp'], mage['hp'])
+
+
+def tune(objective, search='random', classes=CLASSES, trials=300, fights=2000,
+         workers=None, seed=0, top=5, refine=20, progress=None):
+    """搜索并返回报告字典；baseline 是当前 ATTACK_PROFILES 的结果
+
+    先用 grid/random 在整个范围里找到较好的区域，再从最优方案出发爬山：
+    每一步评估所有相邻方案，有更好的就移过去，最多 refine 步。
+    """
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    baseline = evaluate((-1, {c: ATTACK_PROFILES[c] for c in CLASSES}, fights, objective, None))
+    best = None
+    results = []
+    workers = workers or os.cpu_count() or 1
+    wave = max(workers * 4, 8)
+
+    seen = set()
+    with Pool(workers) as pool:
+
+        def run(candidates):
+            nonlocal best
+            index = len(results)
+            while True:
+                # 分批派发：每一批都带上最新的最优得分，后面的方案能更早被剪枝。
+                # 一批全是重复方案时继续取下一批，候选方案取完才结束
+                batch = list(itertools.islice(candidates, wave))
+                if not batch:
+                    return
+                tasks = []
+                for profiles in batch:
+                    key = json.dumps(profiles, sort_keys=True)
+                    if key not in seen:
+                        seen.add(key)
+                        tasks.append((index + len(tasks), profiles, fights, objective, best))
+                if not tasks:
+                    continue
+                index += len(tasks)
+                for result in pool.imap_unordered(evaluate, tasks):
+                    results.append(result)
+                    if not result['pruned'] and (best is None or result['score'] < best):
+                        best = result['score']
+                if progress is not None:
+                    progress(index, best)
+
+        run(generate_candidates(search, set(classes), trials, rng))
+        for _ in range(refine):
+            current = min((r for r in results if not r['pruned']), key=lambda r: r['score'])
+            run(neighbours(current['profiles'], set(classes)))
+            if best >= current['score']:
+                break
+
+    finished = sorted((r for r in results if not r['pruned']), key=lambda r: r['score'])
+    for result in finished[:top] + [baseline]:
+        result['exact_warrior_win'], result['exact_rounds'] = exact_odds(result['profiles'])
+    return {
+        'search': search,
+        'targets': {'warrior_win': objective.target_win, 'rounds': objective.target_rounds},
+        'evaluated': len(results),
+        'pruned': len(results) - len(finished),
+        'fights': sum(r['fights'] for r in results),
+        'seconds': time.perf_counter() - started,
+        'baseline': baseline,
+        'top': finished[:top],
+    }
+
+
+def format_profiles(profiles):
+    """ATTACK_PROFILES 的 Python 源码，可以直接粘贴到 battle_oracle.py"""
+    lines = ['ATTACK_PROFILES = {']
+    for character_class in CLASSES:
+        p = profiles[character_class]
+        lines.append(f"    '{character_class}': {{'hp': {p['hp']}, 'special_chance': {p['special_chance']}, "
+                     f"'normal': {tuple(p['normal'])}, 'special': {tuple(p['special'])}}},")
+    lines.append('}')
+    return '\n'.join(lines)
+
+
+def format_result(label, result):
+    stats = '  '.join(
+        f"{c} HP {p['hp']} 伤害 {p['normal'][0]}-{p['normal'][1]}/{p['special'][0]}-{p['special'][1]} "
+        f"暴击 {p['special_chance']:.0%}" for c, p in result['profiles'].items())
+    return (f"{label:<6} 得分 {result['score']:8.2f}  战士胜率 {result['exact_warrior_win']:.2%}  "
+            f"回合 {result['exact_rounds']:.2f}  |  {stats}")
+
+
+def print_report(report):
+    print(f"🎯 目标：战士胜率 {report['targets']['warrior_win']:.0%}，平均 {report['targets']['rounds']} 回合")
+    print(f"🔍 {report['search']} 搜索 {report['evaluated']} 个方案，提前淘汰 {report['pruned']} 个，"
+          f"共模拟 {report['fights']} 场战斗，用时 {report['seconds']:.1f} 秒")
+    print(format_result('当前', report['baseline']))
+    for rank, result in enumerate(report['top'], 1):
+        print(format_result(f'#{rank}', result))
+    if report['top']:
+        print()
+        print(format_profiles(report['top'][0]['profiles']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='自动搜索职业属性，让战斗胜率和回合数接近目标')
+    parser.add_argument('--target-win', type=float, default=0.5, help='满血战士对满血法师的目标胜率')
+    parser.add_argument('--target-rounds', type=float, default=4.0, help='目标平均回合数')
+    parser.add_argument('--win-tolerance', type=float, default=0.02, help='胜率容差（得分的单位）')
+    parser.add_argument('--rounds-tolerance', type=float, default=0.5, help='回合数容差（得分的单位）')
+    parser.add_argument('--search', choices=['random', 'grid'], default='random', help='搜索方式')
+    parser.add_argument('--tune', default='warrior,mage', help='要调整的职业，逗号分隔，其余职业保持不变')
+    parser.add_argument('--trials', type=int, default=300, help='评估的方案数')
+    parser.add_argument('--fights', type=int, default=2000, help='每个方案最多模拟的战斗场数')
+    parser.add_argument('--workers', type=int, default=None, help='并行进程数，默认等于CPU核心数')
+    parser.add_argument('--seed', type=int, default=0, help='随机搜索的种子')
+    parser.add_argument('--refine', type=int, default=20, help='从最优方案出发爬山的最大步数，0 表示不做')
+    parser.add_argument('--top', type=int, default=5, help='报告中列出的方案数')
+    parser.add_argument('--out', help='把最优配置和报告写入JSON文件')
+    args = parser.parse_args(argv)
+
+    try:
+        classes = [normalize_class(c.strip()) for c in args.tune.split(',') if c.strip()]
+    except ValueError as e:
+        parser.error(str(e))
+    objective = Objective(args.target_win, args.target_rounds, args.win_tolerance, args.rounds_tolerance)
+
+    def progress(done, best):
+        print(f"\r⏳ {done} 个方案，当前最优得分 {best:.2f}" if best is not None else f"\r⏳ {done} 个方案",
+              end='', file=sys.stderr, flush=True)
+
+    report = tune(objective, args.search, classes, args.trials, args.fights,
+                  args.workers, args.seed, args.top, args.refine, progress)
+    print(file=sys.stderr)
+    print_report(report)
+
+    if args.out and report['top']:
+        best = report['top'][0]['profiles']
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump({
+                'ATTACK_PROFILES': best,
+                'class_stats': {c: class_stats(c, best[c]) for c in CLASSES},
+                'report': report,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"💾 已写入 {args.out}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+战斗数据分析 - 记录每一次攻击，按天写成压缩的列式文件，并提供简单的统计查询
+
+服务器（设置 ANALYTICS_DIR 环境变量后启用）：
+    请求线程只把本回合的攻击记录放进固定大小的环形缓冲区，
+    缓冲区满时直接丢弃并计数，不会阻塞请求；
+    后台线程攒够一批（或每隔几秒）后写成一个文件：
+        <目录>/date=2024-05-01/exchanges-<时间>-<进程>-<序号>.parquet
+    安装了 pyarrow 时写 Parquet，否则安装了 numpy 时写 .npz，都没有时写 .json.gz。
+
+查询：
+    python battle_analytics.py stats --dir ./analytics --days 7
+    python battle_analytics.py stats --dir ./analytics --since 2024-05-01 --json
+
+每条记录（一行）是一次攻击：
+    ts            时间戳（秒）
+    source        来源：battle（/api/rpg/battle 和匹配战斗）或 duel（WebSocket对战）
+    attacker      攻击方角色名
+    attacker_class
+    defender      防守方角色名
+    defender_class
+    damage        伤害
+    special       是否暴击/强力法术
+    first         攻击方是否是本回合的先攻方
+    winner        本回合分出胜负时的胜者角色名，否则为空字符串
+"""
+
+import argparse
+import datetime
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+COLUMNS = ('ts', 'source', 'attacker', 'attacker_class', 'defender', 'defender_class',
+           'damage', 'special', 'first', 'winner')
+FILE_PREFIX = 'exchanges-'
+EXTENSIONS = ('.parquet', '.npz', '.json.gz')
+
+
+def default_format():
+    if pyarrow is not None:
+        return 'parquet'
+    if numpy is not None:
+        return 'npz'
+    return 'json.gz'
+
+
+def write_chunk(path, rows, file_format):
+    """把若干行写成一个列式文件（先写临时文件再改名，查询时不会读到半个文件）"""
+    columns = {name: [row[i] for row in rows] for i, name in enumerate(COLUMNS)}
+    tmp = path + '.tmp'
+    if file_format == 'parquet':
+        table = pyarrow.table({
+            name: pyarrow.array(values, type=_arrow_type(name)) for name, values in columns.items()})
+        pyarrow.parquet.write_table(table, tmp, compression='zstd')
+    elif file_format == 'npz':
+        with open(tmp, 'wb') as f:
+            numpy.savez_compressed(f, **{
+                name: numpy.array(values, dtype=_numpy_type(name)) for name, values in columns.items()})
+    else:
+        with gzip.open(tmp, 'wt', encoding='utf-8') as f:
+            json.dump(columns, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+def _arrow_type(name):
+    if name == 'ts':
+        return pyarrow.float64()
+    if name == 'damage':
+        return pyarrow.int32()
+    if name in ('special', 'first'):
+        return pyarrow.bool_()
+    return pyarrow.string()
+
+
+def _numpy_type(name):
+    if name == 'ts':
+        return numpy.float64
+    if name == 'damage':
+        return numpy.int32
+    if name in ('special', 'first'):
+        return numpy.bool_
+    return numpy.str_
+
+
+def read_chunk(path):
+    """读取一个文件，返回 {列名: [值, ...]}"""
+    if path.endswith('.parquet'):
+        if pyarrow is None:
+            raise RuntimeError(f'读取 {path} 需要安装 pyarrow')
+        return pyarrow.parquet.read_table(path).to_pydict()
+    if path.endswith('.npz'):
+        if numpy is None:
+            raise RuntimeError(f'读取 {path} 需要安装 numpy')
+        with numpy.load(path) as data:
+            return {name: data[name].tolist() for name in COLUMNS}
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class AnalyticsSink:
+    """有界的环形缓冲区 + 后台写文件的线程
+
+    record_round() 是请求线程唯一需要调用的方法：加锁、把几行放进预先分配好的槽位。
+    缓冲区满时丢弃新记录并增加 dropped 计数；写文件失败时整批丢弃并增加 failed_batches。
+    """
+
+    def __init__(self, directory, capacity=65536, batch_size=8192, flush_interval=5.0, file_format=None):
+        self.directory = directory
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.file_format = file_format or default_format()
+        self.recorded = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed_batches = 0
+        self.files = 0
+        self._slots = [None] * capacity
+        self._head = 0
+        self._size = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._sequence = 0
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='analytics-writer', daemon=True)
+        self._thread.start()
+
+    def record_round(self, source, exchanges, winner):
+        """记录一个回合：exchanges 为 [(攻击方, 攻击方职业, 防守方, 防守方职业, 伤害, 是否暴击, 是否先攻), ...]
+
+        是否先攻和胜者由调用方按出手顺序和双方位置给出，不按名字比较（双方可能同名）。
+        """
+        now = time.time()
+        winner = winner or ''
+        with self._cond:
+            for attacker, attacker_class, defender, defender_class, damage, special, first in exchanges:
+                if self._size >= self.capacity:
+                    self.dropped += 1
+                    continue
+                self._slots[(self._head + self._size) % self.capacity] = (
+                    now, source, attacker, attacker_class, defender, defender_class,
+                    damage, special, first, winner)
+                self._size += 1
+                self.recorded += 1
+            if self._size >= self.batch_size:
+                self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'format': self.file_format,
+                'buffered': self._size,
+                'recorded': self.recorded,
+                'dropped': self.dropped,
+                'written': self.written,
+                'failed_batches': self.failed_batches,
+                'files': self.files,
+            }
+
+    def close(self):
+        """写完缓冲区里剩下的记录再返回"""
+        if self._thread is None:
+            return
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self._thread = None
+
+    def _take(self):
+        """取出缓冲区里的全部记录（调用时持有锁）"""
+        end = self._head + self._size
+        if end <= self.capacity:
+            rows = self._slots[self._head:end]
+            self._slots[self._head:end] = [None] * self._size
+        else:
+            end -= self.capacity
+            rows = self._slots[self._head:] + self._slots[:end]
+            self._slots[self._head:] = [None] * (self.capacity - self._head)
+            self._slots[:end] = [None] * end
+        self._head = end % self.capacity
+        self._size = 0
+        return rows
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._size < self.batch_size and not self._closed:
+                    self._cond.wait(self.flush_interval)
+                rows = self._take() if self._size else []
+                closed = self._closed
+            if rows:
+                self._flush(rows)
+            if closed:
+                return
+
+    def _flush(self, rows):
+        # 按UTC日期分区，跨过零点的一批会拆成两个文件
+        days = {}
+        for row in rows:
+            day = datetime.datetime.fromtimestamp(row[0], datetime.timezone.utc).strftime('%Y-%m-%d')
+            days.setdefault(day, []).append(row)
+        for day, day_rows in days.items():
+            self._sequence += 1
+            directory = os.path.join(self.directory, f'date={day}')
+            name = (f'{FILE_PREFIX}{time.strftime("%H%M%S", time.gmtime(day_rows[0][0]))}'
+                    f'-{os.getpid()}-{self._sequence}.{self.file_format}')
+            try:
+                os.makedirs(directory, exist_ok=True)
+                write_chunk(os.path.join(directory, name), day_rows, self.file_format)
+            except Exception as e:
+                with self._cond:
+                    self.failed_batches += 1
+                print(f"⚠️  分析数据写入失败，丢弃 {len(day_rows)} 条记录: {e}", file=sys.stderr)
+                continue
+            with self._cond:
+                self.written += len(day_rows)
+                self.files += 1
+
+
+def chunk_paths(directory, since=None, until=None):
+    """按日期分区列出数据文件，since/until 为 'YYYY-MM-DD'（包含两端）"""
+    try:
+        partitions = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        return []
+    paths = []
+    for partition in partitions:
+        if not partition.startswith('date='):
+            continue
+        day = partition[5:]
+        if (since and day < since) or (until and day > until):
+            continue
+        folder = os.path.join(directory, partition)
+        for name in sorted(os.listdir(folder)):
+            if name.startswith(FILE_PREFIX) and name.endswith(EXTENSIONS):
+                paths.append(os.path.join(folder, name))
+    return paths
+
+
+def class_stats(paths, source=None):
+    """按攻击方职业统计：攻击次数、总伤害、平均伤害、暴击率、暴击平均伤害、最大伤害、击杀数"""
+    totals = {}
+    for path in paths:
+        columns = read_chunk(path)
+        rows = zip(columns['source'], columns['attacker'], columns['attacker_class'],
+                   columns['damage'], columns['special'], columns['winner'])
+        for row_source, attacker, attacker_class, damage, special, winner in rows:
+            if source and row_source != source:
+                continue
+            entry = totals.get(attacker_class)
+            if entry is None:
+                entry = totals[attacker_class] = {
+                    'attacks': 0, 'damage': 0, 'specials': 0, 'special_damage': 0, 'max_damage': 0, 'kills': 0}
+            entry['attacks'] += 1
+            entry['damage'] += damage
+            entry['max_damage'] = max(entry['max_damage'], damage)
+            if special:
+                entry['specials'] += 1
+                entry['special_damage'] += damage
+            if winner and winner == attacker:
+                entry['kills'] += 1
+    for entry in totals.values():
+        entry['mean_damage'] = entry['damage'] / entry['attacks']
+        entry['special_rate'] = entry['specials'] / entry['attacks']
+        entry['mean_special_damage'] = entry['special_damage'] / entry['specials'] if entry['specials'] else 0.0
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='战斗数据统计')
+    sub = parser.add_subparsers(dest='command', required=True)
+    stats = sub.add_parser('stats', help='按职业统计伤害和暴击')
+    stats.add_argument('--dir', default=os.environ.get('ANALYTICS_DIR', 'analytics'), help='数据目录')
+    stats.add_argument('--days', type=int, help='只统计最近几天（UTC）')
+    stats.add_argument('--since', help='起始日期 YYYY-MM-DD')
+    stats.add_argument('--until', help='结束日期 YYYY-MM-DD')
+    stats.add_argument('--source', choices=['battle', 'duel'], help='只统计某个来源')
+    stats.add_argument('--json', action='store_true', help='输出JSON')
+    args = parser.parse_args(argv)
+
+    since = args.since
+    if args.days:
+        today = datetime.datetime.now(datetime.timezone.utc).date()
+        since = max(since or '', (today - datetime.timedelta(days=args.days - 1)).isoformat())
+    paths = chunk_paths(args.dir, since, args.until)
+    try:
+        totals = class_stats(paths, args.source)
+    except RuntimeError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+
+    if args.json:
+        print(json.dumps({'files': len(paths), 'classes': totals}, ensure_ascii=False, indent=2))
+        return 0
+    print(f"📊 {len(paths)} 个文件")
+    print(f"{'职业':<6}{'攻击次数':>10}{'平均伤害':>10}{'暴击率':>9}{'暴击伤害':>10}{'最大伤害':>10}{'击杀':>8}")
+    for character_class, entry in sorted(totals.items()):
+        print(f"{character_class:<6}{entry['attacks']:>12}{entry['mean_damage']:>12.2f}"
+              f"{entry['special_rate']:>10.1%}{entry['mean_special_damage']:>12.2f}"
+              f"{entry['max_damage']:>12}{entry['kills']:>10}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
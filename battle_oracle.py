@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+战斗胜率预测 - 用动态规划精确计算胜率和预期回合数
+
+一个回合就是 /api/rpg/battle 的一次调用：50%概率决定谁先攻，
+先攻方攻击，对方存活则反击。战斗一直进行到有一方HP归零。
+
+把回合内的两次攻击合起来看，只有"双方都能一击致命"时才需要看先攻顺序：
+    - 只有A能击杀B：A胜（A先攻直接击杀；B先攻杀不死A，A反击击杀）
+    - 只有B能击杀A：B胜
+    - 双方都能击杀对方：先攻方胜，各占50%
+    - 都杀不死：进入 (a - dB, b - dA) 状态继续
+"""
+
+import sys
+from array import array
+from functools import lru_cache
+
+# 和 Warrior.attack / Mage.attack 一致的伤害规则
+ATTACK_PROFILES = {
+    '战士': {'hp': 120, 'special_chance': 0.3, 'normal': (20, 30), 'special': (35, 45)},
+    '法师': {'hp': 80, 'special_chance': 0.2, 'normal': (32, 42), 'special': (50, 60)},
+}
+
+CLASS_NAMES = {'warrior': '战士', 'mage': '法师'}
+
+
+def normalize_class(character_class):
+    """接受 'warrior'/'mage' 或 '战士'/'法师'"""
+    character_class = CLASS_NAMES.get(character_class, character_class)
+    if character_class not in ATTACK_PROFILES:
+        raise ValueError(f'Invalid character class: {character_class}')
+    return character_class
+
+
+def damage_distribution(profile):
+    """一次攻击的伤害分布：[(伤害, 概率), ...]，按伤害从小到大排列"""
+    probs = {}
+    chance = profile['special_chance']
+    for (low, high), weight in ((profile['normal'], 1 - chance), (profile['special'], chance)):
+        share = weight / (high - low + 1)
+        for damage in range(low, high + 1):
+            probs[damage] = probs.get(damage, 0.0) + share
+    return sorted(probs.items())
+
+
+class OddsTable:
+    """A、B两个职业在所有HP组合下的胜率和预期回合数"""
+
+    def __init__(self, profile_a, profile_b):
+        self.max_a = profile_a['hp']
+        self.max_b = profile_b['hp']
+        self.width = self.max_b + 1
+        self.win = array('d', bytes(8 * (self.max_a + 1) * self.width))
+        self.rounds = array('d', bytes(8 * (self.max_a + 1) * self.width))
+        self._build(damage_distribution(profile_a), damage_distribution(profile_b))
+
+    def _build(self, dist_a, dist_b):
+        width, win, rounds = self.width, self.win, self.rounds
+
+        # kill_a[b]: A一次攻击打出 >= b 伤害的概率；kill_b[a] 同理
+        kill_a = [sum(p for d, p in dist_a if d >= b) for b in range(self.max_b + 1)]
+        kill_b = [sum(p for d, p in dist_b if d >= a) for a in range(self.max_a + 1)]
+
+        for b in range(1, self.max_b + 1):
+            win[b] = 0.0
+        for a in range(1, self.max_a + 1):
+            win[a * width] = 1.0
+
+            # B这次反击后A还活着时的后续：g[b'] = Σ_{dB<a} pB(dB) * P(a - dB, b')
+            g_win = [0.0] * width
+            g_rounds = [0.0] * width
+            for d_b, p_b in dist_b:
+                if d_b >= a:
+                    break
+                row = (a - d_b) * width
+                for b in range(1, width):
+                    g_win[b] += p_b * win[row + b]
+                    g_rounds[b] += p_b * rounds[row + b]
+
+            row = a * width
+            for b in range(1, width):
+                p = kill_a[b] * (1.0 - 0.5 * kill_b[a])
+                e = 1.0
+                for d_a, p_a in dist_a:
+                    if d_a >= b:
+                        break
+                    p += p_a * g_win[b - d_a]
+                    e += p_a * g_rounds[b - d_a]
+                win[row + b] = p
+                rounds[row + b] = e
+
+    def lookup(self, hp_a, hp_b):
+        """返回 (A的胜率, 预期回合数)"""
+        if hp_a > self.max_a or hp_b > self.max_b:
+            raise ValueError('HP exceeds class maximum')
+        # 和 battle() 一样，玩家1阵亡时判玩家2获胜
+        hp_a = max(hp_a, 0)
+        hp_b = max(hp_b, 0)
+        index = hp_a * self.width + hp_b
+        return self.win[index], self.rounds[index]
+
+
+@lru_cache(maxsize=16)
+def table_for(class_a, class_b):
+    """按职业组合缓存的胜率表"""
+    return OddsTable(ATTACK_PROFILES[class_a], ATTACK_PROFILES[class_b])
+
+
+def precompute():
+    """提前生成所有职业组合的胜率表"""
+    for class_a in ATTACK_PROFILES:
+        for class_b in ATTACK_PROFILES:
+            table_for(class_a, class_b)
+
+
+def odds(class_a, hp_a, class_b, hp_b):
+    """A对B的胜率和预期回合数"""
+    class_a = normalize_class(class_a)
+    class_b = normalize_class(class_b)
+    win, rounds = table_for(class_a, class_b).lookup(int(hp_a), int(hp_b))
+    return {
+        'player1_win': win,
+        'player2_win': 1.0 - win,
+        'expected_rounds': rounds,
+    }
+
+
+def main():
+    if len(sys.argv) != 5:
+        print("用法: python battle_oracle.py <职业A> <HP A> <职业B> <HP B>")
+        print("例如: python battle_oracle.py warrior 37 mage 52")
+        sys.exit(2)
+    result = odds(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4])
+    print(f"玩家1胜率: {result['player1_win']:.2%}")
+    print(f"玩家2胜率: {result['player2_win']:.2%}")
+    print(f"预期回合数: {result['expected_rounds']:.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+静态页面构建 - 把 simple_web_games.py 的页面预先处理成可以直接发送的文件
+
+    python build_static.py [--out build/static]
+
+每个页面：
+    - 去掉注释和每行首尾的空白
+    - 按内容哈希命名，例如 rpg.3f2a9c81d0.html
+    - 生成 .gz（以及安装了 brotli 时的 .br）预压缩版本
+最后写出 manifest.json，记录路由和文件的对应关系。服务器启动时读取 manifest，
+找不到时仍然按原来的方式读取 templates/ 下的页面。
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+
+from static_files import MANIFEST_NAME
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# 页面 -> 访问路径
+PAGES = {
+    'templates/simple_index.html': ('/', '/index.html'),
+    'templates/simple_rpg.html': ('/rpg', '/rpg.html'),
+    'templates/simple_cave.html': ('/cave', '/cave.html'),
+}
+
+HTML_COMMENT = re.compile(r'<!--(?!\[if).*?-->', re.S)
+CSS_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+STYLE_BLOCK = re.compile(r'(<style[^>]*>)(.*?)(</style>)', re.S | re.I)
+
+
+def minify_html(text):
+    """保守的压缩：只去掉注释、空行和每行首尾的空白，不合并行（保证脚本的自动分号仍然成立）"""
+    text = HTML_COMMENT.sub('', text)
+    text = STYLE_BLOCK.sub(lambda m: m.group(1) + CSS_COMMENT.sub('', m.group(2)) + m.group(3), text)
+    lines = (line.strip() for line in text.splitlines())
+    return '\n'.join(line for line in lines if line) + '\n'
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:10]
+
+
+def write_file(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def build(out_dir, pages=PAGES):
+    """构建全部页面，返回 manifest"""
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = {'routes': {}, 'files': {}}
+    for source, routes in pages.items():
+        with open(os.path.join(ROOT, source), encoding='utf-8') as f:
+            data = minify_html(f.read()).encode('utf-8')
+        digest = content_hash(data)
+        stem, ext = os.path.splitext(os.path.basename(source))
+        name = f'{stem.replace("simple_", "")}.{digest}{ext}'
+
+        write_file(os.path.join(out_dir, name), data)
+        encodings = ['gzip']
+        write_file(os.path.join(out_dir, name + '.gz'), gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            write_file(os.path.join(out_dir, name + '.br'), brotli.compress(data, quality=11))
+            encodings.insert(0, 'br')
+
+        manifest['files'][name] = {
+            'source': source,
+            'hash': digest,
+            'size': len(data),
+            'content_type': 'text/html; charset=utf-8',
+            'encodings': encodings,
+        }
+        for route in routes:
+            manifest['routes'][route] = name
+    return manifest
+
+
+def remove_stale(out_dir, old_manifest, manifest):
+    """删除上一次构建留下、这次没有用到的文件"""
+    for name in set(old_manifest.get('files', {})) - set(manifest['files']):
+        for suffix in ('', '.gz', '.br'):
+            path = os.path.join(out_dir, name + suffix)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='构建预压缩的静态页面')
+    parser.add_argument('--out', default=os.path.join(ROOT, 'build', 'static'), help='输出目录')
+    parser.add_argument('--keep-old', action='store_true',
+                        help='保留旧版本的文件（已经打开页面的客户端还能访问旧地址）')
+    args = parser.parse_args(argv)
+
+    manifest_path = os.path.join(args.out, MANIFEST_NAME)
+    try:
+        with open(manifest_path, encoding='utf-8') as f:
+            old_manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        old_manifest = {}
+
+    manifest = build(args.out)
+    # manifest 最后写入：服务器读到新 manifest 时，它引用的文件都已经存在
+    write_file(manifest_path, json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8'))
+    if not args.keep_old:
+        remove_stale(args.out, old_manifest, manifest)
+
+    for name, entry in manifest['files'].items():
+        sizes = [f"{entry['size']}B"]
+        for coding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if coding in entry['encodings']:
+                sizes.append(f"{coding} {os.path.getsize(os.path.join(args.out, name + suffix))}B")
+        print(f"📦 {entry['source']} -> {name} ({', '.join(sizes)})")
+    if brotli is None:
+        print("ℹ️  未安装 brotli，只生成了 .gz 版本", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
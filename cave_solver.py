@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+洞穴探险求解器 - 穷举 CaveGame 的所有状态
+
+直接调用 CaveGame.make_choice 作为状态转移，游戏对象的全部属性（包括隐藏的
+previous_choice）都算作状态的一部分。每个属性值映射成一个小整数，整组属性再
+打包成一个整数作为状态编号，所以访问集合里只需要存整数。
+
+广度优先搜索得到：
+    - 所有可到达的状态和结局
+    - 到达"魔法师"结局的最短选择路径
+    - 不经过 restart 就再也无法获胜的死路状态
+    - 各属性取值组合中从未出现过的状态
+"""
+
+import argparse
+import importlib.util
+import itertools
+import json
+import os
+import sys
+from array import array
+from collections import deque
+
+INVALID_CHOICE = '<invalid>'
+WIN_TEXT = 'You are a wizard!'
+FIELD_BITS = 16
+
+
+class StateCodec:
+    """把对象属性编码成一个整数：每个属性占 FIELD_BITS 位，存的是该属性取值的编号"""
+
+    def __init__(self, fields):
+        self.fields = fields
+        self._codes = [dict() for _ in fields]
+        self._values = [list() for _ in fields]
+
+    def encode(self, obj):
+        key = 0
+        for i, field in enumerate(self.fields):
+            value = getattr(obj, field, None)
+            if isinstance(value, list):
+                value = tuple(value)
+            codes = self._codes[i]
+            code = codes.get(value)
+            if code is None:
+                code = codes[value] = len(self._values[i])
+                if code >= 1 << FIELD_BITS:
+                    raise OverflowError(f'属性 {field} 的取值超过 {1 << FIELD_BITS} 种')
+                self._values[i].append(value)
+            key |= code << (i * FIELD_BITS)
+        return key
+
+    def decode(self, key):
+        mask = (1 << FIELD_BITS) - 1
+        return {
+            field: self._values[i][(key >> (i * FIELD_BITS)) & mask]
+            for i, field in enumerate(self.fields)
+        }
+
+    def restore(self, obj, key):
+        for field, value in self.decode(key).items():
+            setattr(obj, field, list(value) if isinstance(value, tuple) else value)
+
+    def values(self, field):
+        return list(self._values[self.fields.index(field)])
+
+
+def explore(game_class, is_win=None, max_states=None, extra_choices=(INVALID_CHOICE,),
+            hidden_fields=('previous_choice',)):
+    """从初始状态开始广度优先搜索，返回分析报告
+
+    hidden_fields: 初始状态里可能还不存在、但之后会影响转移的属性
+    （app.py 的 CaveGame 直到第一次选择后才有 previous_choice）
+    """
+    is_win = is_win or (lambda state: WIN_TEXT in (state.get('message') or ''))
+    game = game_class()
+    fields = sorted(set(vars(game)) | set(hidden_fields))
+    codec = StateCodec(fields)
+
+    ids = {}              # 状态编码 -> 编号（按BFS顺序）
+    keys = []             # 编号 -> 状态编码
+    parent = array('q')   # BFS树中的父状态
+    via = array('q')      # 从父状态到达时使用的选择编号
+    edge_src, edge_choice, edge_dst = array('q'), array('q'), array('q')
+    alphabet = []
+    alphabet_ids = {}
+
+    def choice_id(choice):
+        if choice not in alphabet_ids:
+            alphabet_ids[choice] = len(alphabet)
+            alphabet.append(choice)
+        return alphabet_ids[choice]
+
+    def visit(key, from_id, choice):
+        if key in ids:
+            return ids[key]
+        ids[key] = len(keys)
+        keys.append(key)
+        parent.append(from_id)
+        via.append(choice)
+        return ids[key]
+
+    visit(codec.encode(game), -1, -1)
+    queue = deque([0])
+    truncated = False
+    while queue:
+        state_id = queue.popleft()
+        codec.restore(game, keys[state_id])
+        for choice in list(game.choices) + list(extra_choices):
+            codec.restore(game, keys[state_id])
+            game.make_choice(choice)
+            key = codec.encode(game)
+            is_new = key not in ids
+            if is_new and max_states is not None and len(keys) >= max_states:
+                truncated = True
+                continue
+            target = visit(key, state_id, choice_id(choice))
+            edge_src.append(state_id)
+            edge_choice.append(alphabet_ids[choice])
+            edge_dst.append(target)
+            if is_new:
+                queue.append(target)
+
+    states = [codec.decode(key) for key in keys]
+
+    def path_to(state_id):
+        path = []
+        while parent[state_id] >= 0:
+            path.append(alphabet[via[state_id]])
+            state_id = parent[state_id]
+        return path[::-1]
+
+    # 结局：只能选择 restart 的状态
+    endings = {}
+    for state_id, state in enumerate(states):
+        if list(state.get('choices') or ()) in (['restart'], []):
+            label = state.get('message')
+            if label not in endings:
+                endings[label] = {'message': label, 'win': is_win(state), 'path': path_to(state_id)}
+
+    wins = [i for i, state in enumerate(states) if is_win(state)]
+    shortest_win = path_to(wins[0]) if wins else None
+
+    # 反向搜索（不走 restart）：能到达获胜状态的集合，其余就是死路
+    restart_id = alphabet_ids.get('restart')
+    reverse = [[] for _ in states]
+    for src, choice, dst in zip(edge_src, edge_choice, edge_dst):
+        if choice != restart_id:
+            reverse[dst].append(src)
+    can_win = bytearray(len(states))
+    queue = deque(wins)
+    for i in wins:
+        can_win[i] = 1
+    while queue:
+        for src in reverse[queue.popleft()]:
+            if not can_win[src]:
+                can_win[src] = 1
+                queue.append(src)
+    dead_ends = [
+        {'state': state.get('state'), 'previous_choice': state.get('previous_choice'),
+         'message': state.get('message'), 'path': path_to(i)}
+        for i, state in enumerate(states) if not can_win[i]
+    ]
+
+    # 从未出现的 (state, previous_choice) 组合
+    unreachable = []
+    if 'state' in fields and 'previous_choice' in fields:
+        seen = {(s['state'], s.get('previous_choice')) for s in states}
+        for combo in itertools.product(codec.values('state'), codec.values('previous_choice')):
+            if combo not in seen:
+                unreachable.append({'state': combo[0], 'previous_choice': combo[1]})
+
+    return {
+        'states': len(states),
+        'transitions': len(edge_src),
+        'truncated': truncated,
+        'endings': list(endings.values()),
+        'shortest_win': shortest_win,
+        'dead_ends': dead_ends,
+        'unreachable': unreachable,
+    }
+
+
+def load_engine(name):
+    """加载各个版本的 CaveGame：simple / api / app（app 需要安装 Flask）"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    path = {
+        'simple': os.path.join(root, 'simple_web_games.py'),
+        'api': os.path.join(root, 'api', 'index.py'),
+        'app': os.path.join(root, 'app.py'),
+    }[name]
+    spec = importlib.util.spec_from_file_location(f'_cave_engine_{name}', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.CaveGame
+
+
+def print_report(engine, report):
+    print(f"🏔️  洞穴探险求解结果（{engine}）")
+    print(f"可到达状态: {report['states']}，状态转移: {report['transitions']}")
+    if report['truncated']:
+        print("⚠️  达到状态数上限，结果不完整")
+    print("\n结局:")
+    for ending in report['endings']:
+        mark = '🧙' if ending['win'] else '  '
+        print(f"  {mark} {ending['message']}  <- {' / '.join(ending['path'])}")
+    if report['shortest_win']:
+        print(f"\n最短获胜路径: {' -> '.join(report['shortest_win'])}")
+    else:
+        print("\n❌ 无法获胜")
+    print(f"\n死路状态（不重新开始就无法获胜）: {len(report['dead_ends'])}")
+    for dead in report['dead_ends']:
+        print(f"  - {dead['state']} (previous_choice={dead['previous_choice']}): {dead['message']}")
+    print(f"\n从未出现的状态组合: {len(report['unreachable'])}")
+    for combo in report['unreachable']:
+        print(f"  - {combo['state']} (previous_choice={combo['previous_choice']})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='洞穴探险求解器')
+    parser.add_argument('--engine', default='simple', choices=['simple', 'api', 'app'],
+                        help='要分析的 CaveGame 版本')
+    parser.add_argument('--max-states', type=int, help='最多探索的状态数')
+    parser.add_argument('--json', action='store_true', help='输出JSON格式的报告')
+    args = parser.parse_args(argv)
+
+    try:
+        game_class = load_engine(args.engine)
+    except ImportError as e:
+        print(f"❌ 无法加载 {args.engine} 版本: {e}", file=sys.stderr)
+        return 2
+    report = explore(game_class, max_states=args.max_states)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(args.engine, report)
+    return 0 if report['shortest_win'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
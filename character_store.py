@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+角色存储 - 按玩家划分命名空间
+
+两级索引：玩家ID -> 角色名 -> (职业, HP)。不同玩家可以使用相同的角色名，
+查找一个角色是两次字典查询，列出某个玩家的角色只需要访问他自己的那一层。
+没有提供玩家ID的请求都归到 "public" 命名空间，和以前的行为一致。
+
+所有角色只保存在当前进程的内存里，多个服务器进程之间不共享，服务器只能单进程运行。
+
+多线程服务器下，修改角色HP的请求先用 StripedLocks 锁住涉及的角色：
+不同角色的战斗通常落在不同的锁上，互不等待。
+
+管理接口按职业、HP、是否存活筛选角色时不遍历全部角色：
+BucketIndex 把角色按 (职业, HP) 分桶，创建角色和修改HP时顺手把角色移到对应的桶里。
+HP 只有一百多种取值，查询只需要检查几百个桶，统计总数是把桶的大小加起来，
+翻页时整桶跳过，只在最后一个桶里逐个跳过。
+"""
+
+import itertools
+import threading
+from contextlib import contextmanager
+
+PUBLIC_OWNER = 'public'
+MAX_OWNER_LENGTH = 64
+MAX_NAME_LENGTH = 64
+
+# 角色的全局key：public 命名空间直接使用角色名（兼容以前的日志和排行榜），
+# 其他玩家的角色是 "玩家ID\0角色名"
+KEY_SEPARATOR = '\0'
+
+
+def normalize_owner(owner):
+    """玩家ID为空时使用 public，过长或包含分隔符时抛出 ValueError"""
+    if owner is None:
+        return PUBLIC_OWNER
+    owner = str(owner).strip()
+    if not owner:
+        return PUBLIC_OWNER
+    if len(owner) > MAX_OWNER_LENGTH or KEY_SEPARATOR in owner:
+        raise ValueError('Invalid player id')
+    return owner
+
+
+def normalize_name(name):
+    """角色名必须是非空字符串，长度有限且不含分隔符，否则抛出 ValueError
+
+    在修改角色存储之前检查：不合法的名字一旦进了存储，持久化日志和快照都无法编码它。
+    """
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError('Invalid character name')
+    if len(name) > MAX_NAME_LENGTH or KEY_SEPARATOR in name:
+        raise ValueError('Invalid character name')
+    return name
+
+
+def qualify(owner, name):
+    """(玩家ID, 角色名) -> 全局key，用于持久化日志、排行榜和匹配队列
+
+    角色名不能包含分隔符，否则 public 的 "alice\\0hero" 会和 alice 的 hero 撞成同一个key
+    """
+    if not isinstance(name, str) or KEY_SEPARATOR in name:
+        raise ValueError('Invalid character name')
+    if owner == PUBLIC_OWNER:
+        return name
+    return f'{owner}{KEY_SEPARATOR}{name}'
+
+
+def split_key(key):
+    """全局key -> (玩家ID, 角色名)"""
+    owner, sep, name = str(key).partition(KEY_SEPARATOR)
+    if not sep:
+        return PUBLIC_OWNER, owner
+    return owner, name
+
+
+class StripedLocks:
+    """分段锁：key 按哈希落到固定数量的锁上，内存占用和角色数量无关
+
+    同时锁多个 key 时按锁的编号从小到大加锁，两个请求锁同一组角色也不会死锁。
+    """
+
+    def __init__(self, stripes=256):
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def stripe_of(self, key):
+        return hash(key) % len(self._locks)
+
+    def hold(self, *keys):
+        return self._hold(sorted({self.stripe_of(key) for key in keys}))
+
+    def hold_all(self):
+        """按编号顺序锁住全部分段，和 hold() 的加锁顺序一致"""
+        return self._hold(range(len(self._locks)))
+
+    @contextmanager
+    def _hold(self, stripes):
+        acquired = []
+        try:
+            for stripe in stripes:
+                self._locks[stripe].acquire()
+                acquired.append(stripe)
+            yield
+        finally:
+            for stripe in reversed(acquired):
+                self._locks[stripe].release()
+
+
+class BucketIndex:
+    """二级索引：每个 key 属于一个桶（可比较、可哈希的值），桶内按加入顺序排列
+
+    调用方负责告诉索引 key 原来在哪个桶里（它本来就知道），索引不再额外保存 key -> 桶。
+    查询用 match(桶) 挑选桶，耗时和桶的数量有关，和 key 的数量无关。
+    """
+
+    def __init__(self):
+        self._buckets = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def add(self, key, bucket):
+        with self._lock:
+            self._insert(key, bucket)
+
+    def move(self, key, old_bucket, new_bucket):
+        if old_bucket == new_bucket:
+            return
+        with self._lock:
+            self._delete(key, old_bucket)
+            self._insert(key, new_bucket)
+
+    def remove(self, key, bucket):
+        with self._lock:
+            self._delete(key, bucket)
+
+    def _insert(self, key, bucket):
+        keys = self._buckets.get(bucket)
+        if keys is None:
+            keys = self._buckets[bucket] = {}
+        if key not in keys:
+            keys[key] = None
+            self._size += 1
+
+    def _delete(self, key, bucket):
+        keys = self._buckets.get(bucket)
+        if keys is None or key not in keys:
+            return
+        del keys[key]
+        self._size -= 1
+        if not keys:
+            del self._buckets[bucket]
+
+    def counts(self):
+        """{桶: key 的数量}"""
+        with self._lock:
+            return {bucket: len(keys) for bucket, keys in self._buckets.items()}
+
+    def count(self, match=None):
+        with self._lock:
+            if match is None:
+                return self._size
+            return sum(len(keys) for bucket, keys in self._buckets.items() if match(bucket))
+
+    def page(self, match=None, start=0, count=50):
+        """按桶从小到大、桶内按加入顺序排列，返回 (总数, [(key, 桶), ...])"""
+        with self._lock:
+            buckets = sorted(bucket for bucket in self._buckets if match is None or match(bucket))
+            total = 0
+            entries = []
+            for bucket in buckets:
+                keys = self._buckets[bucket]
+                size = len(keys)
+                skip = max(start - total, 0)
+                total += size
+                if skip >= size or len(entries) >= count:
+                    continue
+                for key in itertools.islice(keys, skip, skip + count - len(entries)):
+                    entries.append((key, bucket))
+            return total, entries
+
+
+def character_filter(character_class=None, min_hp=None, max_hp=None, alive=None):
+    """把管理接口的筛选条件变成对 (职业, HP) 桶的判断"""
+    def match(bucket):
+        bucket_class, hp = bucket
+        return ((character_class is None or bucket_class == character_class)
+                and (min_hp is None or hp >= min_hp)
+                and (max_hp is None or hp <= max_hp)
+                and (alive is None or (hp > 0) == alive))
+    return match
+
+
+class CharacterStore:
+    """两级字典实现的角色存储，记录只保存 (职业, HP)，其余属性由职业推出
+
+    新建和删除角色会改变字典结构，用一把短暂持有的锁保护；
+    修改已有角色的HP只替换一个元组，由调用方用 locks 锁住对应的角色。
+    index 按 (职业, HP) 索引全部角色的 (玩家ID, 角色名)，随每次修改更新。
+    """
+
+    def __init__(self, stripes=256):
+        self._owners = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        self.index = BucketIndex()
+        self.locks = StripedLocks(stripes)
+
+    def locked(self, *characters):
+        """锁住若干个 (玩家ID, 角色名)，在 with 语句里读取和修改它们"""
+        return self.locks.hold(*characters)
+
+    @contextmanager
+    def frozen(self):
+        """锁住全部角色、字典结构和索引：期间没有任何修改进行到一半（fork 快照时使用）
+
+        加锁顺序和普通请求相同：先分段锁，再存储的锁，最后索引的锁。
+        """
+        index = self.index
+        with self.locks.hold_all(), self._lock, index._lock:
+            yield
+
+    def __len__(self):
+        return self._count
+
+    def get(self, owner, name):
+        """返回 (职业, HP)，不存在时返回 None"""
+        roster = self._owners.get(owner)
+        if roster is None:
+            return None
+        return roster.get(name)
+
+    def put(self, owner, name, character_class, hp):
+        """新建或覆盖角色"""
+        with self._lock:
+            roster = self._owners.get(owner)
+            if roster is None:
+                roster = self._owners[owner] = {}
+            previous = roster.get(name)
+            if previous is None:
+                self._count += 1
+                self.index.add((owner, name), (character_class, hp))
+            else:
+                self.index.move((owner, name), previous, (character_class, hp))
+            roster[name] = (character_class, hp)
+
+    def replace_all(self, records):
+        """用 (玩家ID, 角色名, 职业, HP) 序列整体替换全部角色（回滚到快照）
+
+        新的字典和索引建好之后一次性换上，并发的读请求看到的要么是旧状态要么是新状态。
+        """
+        owners = {}
+        count = 0
+        index = BucketIndex()
+        for owner, name, character_class, hp in records:
+            roster = owners.get(owner)
+            if roster is None:
+                roster = owners[owner] = {}
+            previous = roster.get(name)
+            if previous is None:
+                count += 1
+                index.add((owner, name), (character_class, hp))
+            else:
+                index.move((owner, name), previous, (character_class, hp))
+            roster[name] = (character_class, hp)
+        with self._lock:
+            self._owners = owners
+            self._count = count
+            self.index = index
+
+    def set_hp(self, owner, name, hp):
+        roster = self._owners[owner]
+        character_class, previous_hp = roster[name]
+        roster[name] = (character_class, hp)
+        self.index.move((owner, name), (character_class, previous_hp), (character_class, hp))
+
+    def remove(self, owner, name):
+        with self._lock:
+            roster = self._owners.get(owner)
+            if roster is None or name not in roster:
+                return False
+            self.index.remove((owner, name), roster.pop(name))
+            self._count -= 1
+            if not roster:
+                del self._owners[owner]
+            return True
+
+    def roster_size(self, owner):
+        return len(self._owners.get(owner, ()))
+
+    def roster(self, owner, start=0, count=50):
+        """按创建顺序列出某个玩家的角色，返回 [(角色名, 职业, HP), ...]"""
+        roster = self._owners.get(owner)
+        if roster is None:
+            return []
+        entries = itertools.islice(roster.items(), start, start + count)
+        return [(name, character_class, hp) for name, (character_class, hp) in entries]
+
+    def query(self, character_class=None, min_hp=None, max_hp=None, alive=None, start=0, count=50):
+        """按条件筛选全部玩家的角色（走索引，不遍历），返回 (总数, [(玩家ID, 角色名, 职业, HP), ...])
+
+        按职业、HP从低到高排列，HP相同的按进入这个HP的先后排列。
+        """
+        total, entries = self.index.page(character_filter(character_class, min_hp, max_hp, alive), start, count)
+        return total, [(owner, name, character_class, hp) for (owner, name), (character_class, hp) in entries]
+
+    def owners(self):
+        return list(self._owners)
+
+    def items(self):
+        """遍历全部角色：(玩家ID, 角色名, 职业, HP)"""
+        for owner, roster in list(self._owners.items()):
+            for name, (character_class, hp) in list(roster.items()):
+                yield owner, name, character_class, hp
@@ -0,0 +1,481 @@
+#!/usr/bin/env python3
+"""
+WebSocket实时对战 - 两个玩家进入同一个房间，每回合各自出手，服务器结算后广播
+
+连接地址： ws://host/ws/duel?room=房间名&name=角色名&class=warrior
+
+握手由HTTP服务器完成（simple_web_games.py 的 GameHandler，或者 app.py 在
+werkzeug 开发服务器下的适配），之后socket交给 DuelHub：一个后台线程用
+selectors 同时管理所有连接，每个连接只保存很小的读写缓冲区。
+
+消息都是JSON文本帧：
+    客户端 -> 服务器
+        {"type": "attack"}             本回合出手，双方都出手后结算
+        {"type": "forfeit"}            认输
+    服务器 -> 客户端
+        {"type": "joined", "you": 1, "room": ..., "players": [...]}
+        {"type": "start", "players": [[名字, 职业, HP], ...]}
+        {"type": "waiting"}            已出手，等待对手
+        {"type": "round", "round": n, "first": 1, "events": [[攻击方, 伤害, 是否暴击], ...], "hp": [a, b]}
+        {"type": "end", "winner": 1/2/null, "reason": "ko"/"forfeit"/"left"}
+        {"type": "error", "error": ...}
+
+保护措施：
+    - 每个房间的缓冲区总量超过 ROOM_MEMORY_BUDGET 时断开占用最多的连接
+    - 每 HEARTBEAT_INTERVAL 秒向空闲连接发送 ping，超过 HEARTBEAT_TIMEOUT 没有任何数据就断开
+    - 只有一个人的房间等待超过 WAIT_TIMEOUT 后关闭
+"""
+
+import base64
+import hashlib
+import json
+import selectors
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from urllib.parse import parse_qs
+
+from battle_oracle import ATTACK_PROFILES, normalize_class
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+CLOSE_NORMAL = 1000
+CLOSE_GOING_AWAY = 1001
+CLOSE_PROTOCOL_ERROR = 1002
+CLOSE_UNSUPPORTED = 1003
+CLOSE_POLICY = 1008
+CLOSE_TOO_BIG = 1009
+
+MAX_FRAME_SIZE = 4096
+ROOM_MEMORY_BUDGET = 64 * 1024  # 一个房间两个连接的读写缓冲区总量上限（字节）
+MAX_ROOMS = 10000
+MAX_NAME_LENGTH = 32
+HEARTBEAT_INTERVAL = 15.0
+HEARTBEAT_TIMEOUT = 45.0
+WAIT_TIMEOUT = 300.0
+
+
+def accept_key(key):
+    """根据客户端的 Sec-WebSocket-Key 计算 Sec-WebSocket-Accept"""
+    digest = hashlib.sha1((key.strip() + WEBSOCKET_GUID).encode('ascii')).digest()
+    return base64.b64encode(digest).decode('ascii')
+
+
+def handshake_headers(headers):
+    """检查升级请求，返回101响应需要的头；不是合法的WebSocket请求时返回 None"""
+    if (headers.get('Upgrade') or '').lower() != 'websocket':
+        return None
+    if 'upgrade' not in (headers.get('Connection') or '').lower():
+        return None
+    key = headers.get('Sec-WebSocket-Key')
+    if not key or headers.get('Sec-WebSocket-Version') != '13':
+        return None
+    return {
+        'Upgrade': 'websocket',
+        'Connection': 'Upgrade',
+        'Sec-WebSocket-Accept': accept_key(key),
+    }
+
+
+def encode_frame(opcode, payload=b''):
+    """服务器发出的帧不加掩码"""
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < 1 << 16:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+    return header + payload
+
+
+def encode_message(message):
+    return encode_frame(OP_TEXT, json.dumps(message, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+
+def close_frame(code, reason=''):
+    return encode_frame(OP_CLOSE, struct.pack('!H', code) + reason.encode('utf-8')[:120])
+
+
+class ProtocolError(Exception):
+    def __init__(self, code, reason):
+        super().__init__(reason)
+        self.code = code
+
+
+def parse_frames(buffer):
+    """从缓冲区开头解析完整的帧，返回 ([(opcode, payload), ...], 已消费的字节数)
+
+    客户端的帧必须带掩码；不支持分片，单帧不能超过 MAX_FRAME_SIZE。
+    """
+    frames = []
+    pos = 0
+    size = len(buffer)
+    while size - pos >= 2:
+        first, second = buffer[pos], buffer[pos + 1]
+        fin, opcode = first & 0x80, first & 0x0F
+        masked, length = second & 0x80, second & 0x7F
+        offset = pos + 2
+        if length == 126:
+            if size - offset < 2:
+                break
+            length = struct.unpack_from('!H', buffer, offset)[0]
+            offset += 2
+        elif length == 127:
+            if size - offset < 8:
+                break
+            length = struct.unpack_from('!Q', buffer, offset)[0]
+            offset += 8
+        if not masked:
+            raise ProtocolError(CLOSE_PROTOCOL_ERROR, 'Client frames must be masked')
+        if not fin or opcode == OP_CONTINUATION:
+            raise ProtocolError(CLOSE_UNSUPPORTED, 'Fragmented messages are not supported')
+        if length > MAX_FRAME_SIZE:
+            raise ProtocolError(CLOSE_TOO_BIG, 'Frame too large')
+        if size - offset < 4 + length:
+            break
+        mask = buffer[offset:offset + 4]
+        offset += 4
+        data = bytes(buffer[offset:offset + length])
+        # 用整数异或一次解掉整段掩码，比逐字节循环快得多
+        key = int.from_bytes((mask * (length // 4 + 1))[:length], 'big')
+        payload = (int.from_bytes(data, 'big') ^ key).to_bytes(length, 'big') if length else b''
+        frames.append((opcode, payload))
+        pos = offset + length
+    return frames, pos
+
+
+class Connection:
+    __slots__ = ('sock', 'room', 'seat', 'name', 'character_class', 'inbuf', 'outbuf',
+                 'last_seen', 'closing', 'writing')
+
+    def __init__(self, sock, room, seat, name, character_class, now):
+        self.sock = sock
+        self.room = room
+        self.seat = seat
+        self.name = name
+        self.character_class = character_class
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+        self.last_seen = now
+        self.closing = False
+        self.writing = False
+
+    def buffered(self):
+        return len(self.inbuf) + len(self.outbuf)
+
+
+class Room:
+    __slots__ = ('name', 'seats', 'hp', 'actions', 'round', 'created', 'finished')
+
+    def __init__(self, name, now):
+        self.name = name
+        self.seats = [None, None]
+        self.hp = [0, 0]
+        self.actions = [False, False]
+        self.round = 0
+        self.created = now
+        self.finished = False
+
+    def players(self):
+        return [[c.name, c.character_class, self.hp[i]] if c else None
+                for i, c in enumerate(self.seats)]
+
+
+class DuelHub:
+    """所有对战连接的事件循环
+
+    resolve(fighters) 结算一回合：fighters 为 [(名字, 职业, HP), (名字, 职业, HP)]，
+    返回 (先攻方1/2, [[攻击方, 伤害, 是否暴击], ...], [HP1, HP2])。
+    """
+
+    def __init__(self, resolve):
+        self.resolve = resolve
+        self.rooms = {}
+        self._selector = selectors.DefaultSelector()
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self._last_heartbeat = time.monotonic()
+
+    def __len__(self):
+        return len(self.rooms)
+
+    def adopt(self, sock, room, name, character_class):
+        """接管已经完成握手的socket（调用方不能再使用或关闭它）"""
+        sock.setblocking(False)
+        with self._lock:
+            self._pending.append((sock, room, name, character_class))
+            if self._thread is None:
+                self._selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+                self._thread = threading.Thread(target=self._run, name='duel-hub', daemon=True)
+                self._thread.start()
+        try:
+            self._wakeup_w.send(b'\0')
+        except BlockingIOError:
+            pass  # 唤醒用的缓冲区已满，说明事件循环本来就会醒
+
+    def _run(self):
+        while True:
+            for key, events in self._selector.select(timeout=1.0):
+                if key.data is None:
+                    self._drain_wakeup()
+                    continue
+                conn = key.data
+                if events & selectors.EVENT_READ:
+                    self._on_readable(conn)
+                if events & selectors.EVENT_WRITE and conn.sock.fileno() >= 0:
+                    self._flush(conn)
+            self._adopt_pending()
+            now = time.monotonic()
+            if now - self._last_heartbeat >= 1.0:
+                self._last_heartbeat = now
+                self._heartbeat(now)
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_r.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _adopt_pending(self):
+        while True:
+            with self._lock:
+                if not self._pending:
+                    return
+                sock, room_name, name, character_class = self._pending.popleft()
+            self._join(sock, room_name, name, character_class)
+
+    def _join(self, sock, room_name, name, character_class):
+        now = time.monotonic()
+        try:
+            character_class = normalize_class(character_class)
+        except ValueError as e:
+            self._reject(sock, str(e))
+            return
+        room_name = str(room_name or '')[:64]
+        name = str(name or 'Player')[:MAX_NAME_LENGTH]
+        room = self.rooms.get(room_name)
+        if room is None:
+            if not room_name:
+                self._reject(sock, 'Room name required')
+                return
+            if len(self.rooms) >= MAX_ROOMS:
+                self._reject(sock, 'Too many rooms')
+                return
+            room = self.rooms[room_name] = Room(room_name, now)
+        if None not in room.seats or room.finished:
+            self._reject(sock, 'Room is full')
+            return
+
+        seat = room.seats.index(None)
+        conn = Connection(sock, room, seat, name, character_class, now)
+        room.seats[seat] = conn
+        room.hp[seat] = ATTACK_PROFILES[character_class]['hp']
+        self._selector.register(sock, selectors.EVENT_READ, conn)
+        self._send(conn, {'type': 'joined', 'you': seat + 1, 'room': room_name, 'players': room.players()})
+        if None not in room.seats:
+            self._broadcast(room, {'type': 'start', 'players': room.players()})
+
+    def _reject(self, sock, error):
+        try:
+            sock.send(encode_message({'type': 'error', 'error': error}) + close_frame(CLOSE_POLICY, error))
+        except OSError:
+            pass
+        sock.close()
+
+    def _on_readable(self, conn):
+        try:
+            data = conn.sock.recv(8192)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._drop(conn)
+            return
+        conn.last_seen = time.monotonic()
+        conn.inbuf += data
+        if self._over_budget(conn):
+            return
+        try:
+            frames, consumed = parse_frames(conn.inbuf)
+        except ProtocolError as e:
+            self._close(conn, e.code, str(e))
+            return
+        del conn.inbuf[:consumed]
+        for opcode, payload in frames:
+            if conn.closing:
+                break
+            if opcode == OP_TEXT:
+                self._on_message(conn, payload)
+            elif opcode == OP_PING:
+                self._write(conn, encode_frame(OP_PONG, payload))
+            elif opcode == OP_CLOSE:
+                self._close(conn, CLOSE_NORMAL)
+            elif opcode == OP_BINARY:
+                self._close(conn, CLOSE_UNSUPPORTED, 'Binary frames are not supported')
+
+    def _on_message(self, conn, payload):
+        try:
+            message = json.loads(payload.decode('utf-8'))
+            kind = message.get('type')
+        except (ValueError, AttributeError):
+            self._send(conn, {'type': 'error', 'error': 'Invalid message'})
+            return
+        room = conn.room
+        if kind == 'forfeit':
+            self._finish(room, 2 - conn.seat, 'forfeit')
+        elif kind == 'attack':
+            if room.finished or None in room.seats:
+                self._send(conn, {'type': 'error', 'error': 'Duel has not started'})
+                return
+            room.actions[conn.seat] = True
+            if all(room.actions):
+                self._resolve_round(room)
+            else:
+                self._send(conn, {'type': 'waiting'})
+        else:
+            self._send(conn, {'type': 'error', 'error': 'Unknown message type'})
+
+    def _resolve_round(self, room):
+        room.actions = [False, False]
+        room.round += 1
+        fighters = [(c.name, c.character_class, room.hp[i]) for i, c in enumerate(room.seats)]
+        first, events, hp = self.resolve(fighters)
+        room.hp = list(hp)
+        self._broadcast(room, {'type': 'round', 'round': room.round, 'first': first,
+                               'events': events, 'hp': room.hp})
+        if room.hp[0] <= 0:
+            self._finish(room, 2, 'ko')
+        elif room.hp[1] <= 0:
+            self._finish(room, 1, 'ko')
+
+    def _finish(self, room, winner, reason):
+        if room.finished:
+            return
+        room.finished = True
+        self._broadcast(room, {'type': 'end', 'winner': winner, 'reason': reason})
+        for conn in room.seats:
+            if conn is not None:
+                self._close(conn, CLOSE_NORMAL)
+
+    def _broadcast(self, room, message):
+        frame = encode_message(message)
+        for conn in room.seats:
+            if conn is not None:
+                self._write(conn, frame)
+
+    def _send(self, conn, message):
+        self._write(conn, encode_message(message))
+
+    def _write(self, conn, frame):
+        if conn.closing and not frame.startswith(bytes((0x80 | OP_CLOSE,))):
+            return
+        conn.outbuf += frame
+        if self._over_budget(conn):
+            return
+        self._flush(conn)
+
+    def _flush(self, conn):
+        if conn.outbuf:
+            try:
+                sent = conn.sock.send(conn.outbuf)
+                del conn.outbuf[:sent]
+            except BlockingIOError:
+                pass
+            except OSError:
+                self._drop(conn)
+                return
+        if not conn.outbuf and conn.closing:
+            self._drop(conn)
+            return
+        # 有没发完的数据时才关注可写事件
+        writing = bool(conn.outbuf)
+        if writing != conn.writing:
+            conn.writing = writing
+            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if writing else 0)
+            self._selector.modify(conn.sock, events, conn)
+
+    def _over_budget(self, conn):
+        """房间的缓冲区总量超出预算时，断开占用最多的那个连接"""
+        room = conn.room
+        used = sum(c.buffered() for c in room.seats if c is not None)
+        if used <= ROOM_MEMORY_BUDGET:
+            return False
+        worst = max((c for c in room.seats if c is not None), key=Connection.buffered)
+        worst.inbuf.clear()
+        worst.outbuf.clear()
+        self._drop(worst)
+        return worst is conn
+
+    def _close(self, conn, code, reason=''):
+        """发送关闭帧，发完后断开"""
+        if conn.closing:
+            return
+        conn.closing = True
+        conn.outbuf += close_frame(code, reason)
+        self._flush(conn)
+
+    def _drop(self, conn):
+        """立即断开连接并把它从房间里移除"""
+        if conn.sock.fileno() < 0:
+            return
+        try:
+            self._selector.unregister(conn.sock)
+        except (KeyError, ValueError):
+            pass
+        conn.sock.close()
+        room = conn.room
+        if room.seats[conn.seat] is conn:
+            room.seats[conn.seat] = None
+            opponent = room.seats[1 - conn.seat]
+            if opponent is not None and not room.finished:
+                # 对手中途离开算作认输
+                self._finish(room, opponent.seat + 1, 'left')
+        if room.seats == [None, None] and self.rooms.get(room.name) is room:
+            del self.rooms[room.name]
+
+    def _heartbeat(self, now):
+        ping = encode_frame(OP_PING)
+        for room in list(self.rooms.values()):
+            for conn in room.seats:
+                if conn is None:
+                    continue
+                idle = now - conn.last_seen
+                if idle > HEARTBEAT_TIMEOUT:
+                    self._drop(conn)
+                elif idle > HEARTBEAT_INTERVAL and not conn.closing:
+                    self._write(conn, ping)
+            waiting = [c for c in room.seats if c is not None]
+            if len(waiting) == 1 and not room.finished and now - room.created > WAIT_TIMEOUT:
+                self._close(waiting[0], CLOSE_GOING_AWAY, 'No opponent joined')
+
+
+def detach_socket(sock):
+    """把HTTP服务器的连接socket转交出去：原socket对象变为关闭状态，但底层连接保持打开
+
+    socketserver 处理完请求后会对原socket调用 shutdown()/close()，
+    直接 dup() 的话 shutdown 会连同复制出来的socket一起关掉。
+    """
+    return socket.socket(fileno=sock.detach())
+
+
+def duel_params(query):
+    """从 ?room=&name=&class= 取出 (房间名, 角色名, 职业)"""
+    params = parse_qs(query)
+    return (params.get('room', [''])[0], params.get('name', [''])[0],
+            params.get('class', ['warrior'])[0])
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+幂等键 - 客户端重试同一个请求时返回第一次的结果，而不是再执行一次
+
+移动网络不稳定时浏览器会重试请求：重试的 /api/rpg/battle 会再打一回合，
+重试的 /api/cave/make_choice 会让洞穴游戏再前进一步。
+客户端给每个操作生成一个唯一的 Idempotency-Key 请求头，重试时带上同一个值：
+
+    - 第一次请求正常执行，结果按 (玩家, 接口, 幂等键) 缓存 ttl 秒
+    - 之后带同样幂等键的请求直接返回缓存的结果（响应头 Idempotent-Replayed: true）
+    - 第一次请求还没执行完时，重复的请求等待它的结果，而不是各自再执行一次
+    - 同一个幂等键配上不同的请求内容，说明客户端用错了键，返回 422
+
+执行时抛出异常的请求不缓存，等待它的重复请求会收到同样的异常，客户端之后可以重试。
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+
+class KeyReused(Exception):
+    """同一个幂等键对应了不同的请求内容"""
+
+
+class StillRunning(Exception):
+    """等待第一次请求的结果超时"""
+
+
+def fingerprint(*parts):
+    """请求内容的摘要，用来发现幂等键被用在了不同的请求上"""
+    digest = hashlib.sha256()
+    for part in parts:
+        data = part if isinstance(part, bytes) else str(part).encode('utf-8')
+        digest.update(len(data).to_bytes(8, 'big'))
+        digest.update(data)
+    return digest.digest()
+
+
+def validate_key(key):
+    """幂等键为空时返回 None，过长时抛出 ValueError"""
+    if key is None:
+        return None
+    key = key.strip()
+    if not key:
+        return None
+    if len(key) > MAX_KEY_LENGTH:
+        raise ValueError('Invalid Idempotency-Key')
+    return key
+
+
+class _Entry:
+    __slots__ = ('fingerprint', 'done', 'result', 'error', 'expires')
+
+    def __init__(self, request_fingerprint):
+        self.fingerprint = request_fingerprint
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.expires = None
+
+
+class IdempotencyCache:
+    """有上限、按时间过期的结果缓存，加上正在执行的请求表（用于合并重复请求）"""
+
+    def __init__(self, ttl=300.0, max_entries=10000, wait_timeout=10.0):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.wait_timeout = wait_timeout
+        self.hits = 0
+        self.coalesced = 0
+        self._results = OrderedDict()  # key -> 已完成的 _Entry，按完成时间排列
+        self._running = {}              # key -> 正在执行的 _Entry
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._results)
+
+    def run(self, key, request_fingerprint, compute):
+        """执行 compute() 或返回同一个幂等键之前的结果，返回 (结果, 是否是重放的结果)"""
+        with self._lock:
+            self._expire(time.monotonic())
+            entry = self._results.get(key)
+            if entry is not None:
+                if entry.fingerprint != request_fingerprint:
+                    raise KeyReused('Idempotency-Key reused with a different request')
+                self.hits += 1
+                return entry.result, True
+            entry = self._running.get(key)
+            if entry is None:
+                entry = self._running[key] = _Entry(request_fingerprint)
+                leader = True
+            else:
+                if entry.fingerprint != request_fingerprint:
+                    raise KeyReused('Idempotency-Key reused with a different request')
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            if not entry.done.wait(self.wait_timeout):
+                raise StillRunning('A request with this Idempotency-Key is still being processed')
+            if entry.error is not None:
+                raise entry.error
+            return entry.result, True
+
+        try:
+            entry.result = compute()
+        except BaseException as e:
+            entry.error = e
+            with self._lock:
+                del self._running[key]
+            entry.done.set()
+            raise
+        with self._lock:
+            del self._running[key]
+            entry.expires = time.monotonic() + self.ttl
+            self._results[key] = entry
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+        entry.done.set()
+        return entry.result, False
+
+    def _expire(self, now):
+        # 所有结果的有效期相同，按完成顺序排列后最早过期的总在最前面
+        while self._results:
+            entry = next(iter(self._results.values()))
+            if entry.expires > now:
+                return
+            self._results.popitem(last=False)
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+匹配队列 - 玩家加入队列后自动配对对手
+
+队列按 (职业, 分数段) 分桶，每个桶是一个按入队时间排序的小根堆，
+配对时只查看附近的几个桶，不会扫描全部等待的玩家。
+等待时间越长，允许的分数差距越大；超过 max_wait 后匹配任意对手。
+
+sweep() 只负责配对，配好的对局交给后台的 match-runner 线程打完（background=True 时），
+调用 sweep() 的线程（服务器的接收循环）不会被打一整场战斗卡住。
+"""
+
+import heapq
+import itertools
+import queue
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+class MatchQueue:
+    """分桶堆实现的匹配队列
+
+    on_match(name1, name2) 在配对成功后调用（不持有队列锁），
+    返回值会作为双方的匹配结果保存，供 result() 查询。
+    enqueue() 当场配对时在调用线程里执行 on_match；sweep() 配出的对局在 background=True 时
+    交给后台线程执行，还没打完的双方 is_waiting() 仍为真。
+    """
+
+    def __init__(self, on_match, bucket_size=10, widen_every=1.0, max_wait=5.0,
+                 max_results=100000, background=False, max_pairs=100):
+        self.on_match = on_match
+        self.bucket_size = bucket_size
+        self.widen_every = widen_every
+        self.max_wait = max_wait
+        self.max_results = max_results
+        self.background = background
+        self.max_pairs = max_pairs  # 每次 sweep() 最多配出的对局数
+        self._buckets = {}       # (职业, 分数段) -> [(入队时间, 序号, 名字), ...]
+        self._by_age = []        # 全部等待者按入队时间排序，用于放宽长时间等待者的匹配范围
+        self._waiting = {}       # 名字 -> (入队时间, 序号, 职业, 分数段)
+        self._classes = []
+        self._results = OrderedDict()
+        self._playing = set()    # 已经配对、后台线程还没打完的玩家
+        self._jobs = queue.SimpleQueue()
+        self._runner = None
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._waiting)
+
+    def enqueue(self, name, character_class, score, now=None):
+        """加入队列，能立即配对时返回匹配结果，否则返回 None"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if name in self._waiting or name in self._playing:
+                return None
+            self._results.pop(name, None)
+            bucket = int(score) // self.bucket_size
+            opponent = self._pop_nearest(character_class, bucket, 1, exclude=name)
+            if opponent is None:
+                self._push(name, character_class, bucket, now)
+                return None
+        return self._finish(opponent, name)
+
+    def leave(self, name):
+        """离开队列；堆里的旧条目会在之后被懒惰删除，堆顶的旧条目立即清掉"""
+        with self._lock:
+            return self._remove_waiting(name)
+
+    def is_waiting(self, name):
+        """还在排队，或者已经配对但对局还在后台进行"""
+        return name in self._waiting or name in self._playing
+
+    def result(self, name):
+        """最近一次匹配结果"""
+        return self._results.get(name)
+
+    def sweep(self, now=None, limit=1000):
+        """为等待较久的玩家放宽匹配范围，由服务器的空闲循环定期调用，返回配出的对局数
+
+        每次最多检查 limit 个配不上的玩家、配出 max_pairs 对；剩下的留到下一次。
+        """
+        now = time.monotonic() if now is None else now
+        pairs = []
+        retry = []
+        with self._lock:
+            while self._by_age and len(retry) < limit and len(pairs) < self.max_pairs:
+                entry = self._by_age[0]
+                enqueued_at, seq, name = entry
+                waiting = self._waiting.get(name)
+                if waiting is None or waiting[1] != seq:
+                    heapq.heappop(self._by_age)
+                    continue
+                age = now - enqueued_at
+                if age < self.widen_every:
+                    break
+                heapq.heappop(self._by_age)
+                _, _, character_class, bucket = waiting
+                if age >= self.max_wait:
+                    width = None
+                else:
+                    width = 1 + int(age / self.widen_every)
+                opponent = self._pop_nearest(character_class, bucket, width, exclude=name)
+                if opponent is None:
+                    retry.append(entry)
+                else:
+                    self._remove_waiting(name)
+                    pairs.append((opponent, name))
+            for entry in retry:
+                heapq.heappush(self._by_age, entry)
+            if self.background and pairs:
+                for pair in pairs:
+                    self._playing.update(pair)
+                    self._jobs.put(pair)
+                if self._runner is None:
+                    self._runner = threading.Thread(target=self._run, name='match-runner', daemon=True)
+                    self._runner.start()
+        if not self.background:
+            for opponent, name in pairs:
+                self._finish(opponent, name)
+        return len(pairs)
+
+    def _run(self):
+        while True:
+            pair = self._jobs.get()
+            if pair is None:
+                return
+            try:
+                self._finish(*pair)
+            except Exception as e:
+                print(f"⚠️  匹配对局 {pair} 执行失败: {e}", file=sys.stderr)
+                with self._lock:
+                    self._playing.difference_update(pair)
+
+    def close(self, timeout=None):
+        """等后台线程打完已经配好的对局再返回；之后再配出的对局会启动新的后台线程"""
+        with self._lock:
+            runner, self._runner = self._runner, None
+            if runner is not None:
+                self._jobs.put(None)
+        if runner is not None:
+            runner.join(timeout)
+
+    def _push(self, name, character_class, bucket, now):
+        seq = next(self._seq)
+        entry = (now, seq, name)
+        self._waiting[name] = (now, seq, character_class, bucket)
+        heapq.heappush(self._buckets.setdefault((character_class, bucket), []), entry)
+        heapq.heappush(self._by_age, entry)
+        if character_class not in self._classes:
+            self._classes.append(character_class)
+
+    def _remove_waiting(self, name):
+        """把玩家移出等待表，并清掉所在分数段堆顶的旧条目，分数段空了就删掉"""
+        waiting = self._waiting.pop(name, None)
+        if waiting is None:
+            return False
+        key = (waiting[2], waiting[3])
+        heap = self._buckets.get(key)
+        while heap and self._waiting.get(heap[0][2], (None, None))[1] != heap[0][1]:
+            heapq.heappop(heap)
+        if not heap:
+            self._buckets.pop(key, None)
+        return True
+
+    def _pop_nearest(self, character_class, bucket, width, exclude):
+        """从最近的分数段里取出等待最久的对手，同职业优先；width 为 None 表示不限分数"""
+        classes = [character_class] + [c for c in self._classes if c != character_class]
+        if width is None:
+            # 只看还有人排队的分数段（空的分数段会被删掉），由近到远，同样距离时低分段优先
+            candidates = sorted({b for _, b in self._buckets}, key=lambda b: (abs(b - bucket), b))
+        else:
+            candidates = [bucket]
+            for distance in range(1, width + 1):
+                candidates += (bucket - distance, bucket + distance)
+        for candidate in candidates:
+            for cls in classes:
+                name = self._pop_valid((cls, candidate), exclude)
+                if name is not None:
+                    return name
+        return None
+
+    def _pop_valid(self, key, exclude):
+        heap = self._buckets.get(key)
+        if heap is None:
+            return None
+        held = None
+        found = None
+        while heap:
+            _, seq, name = heap[0]
+            waiting = self._waiting.get(name)
+            if waiting is None or waiting[1] != seq:
+                heapq.heappop(heap)
+            elif name == exclude:
+                # 不能和自己配对，暂时拿出来，找完再放回去
+                held = heapq.heappop(heap)
+            else:
+                heapq.heappop(heap)
+                del self._waiting[name]
+                found = name
+                break
+        if held is not None:
+            heapq.heappush(heap, held)
+        if not heap:
+            # 空的分数段直接删掉，不限分数的查找只需要遍历还有人排队的分数段
+            del self._buckets[key]
+        return found
+
+    def _finish(self, name1, name2):
+        result = self.on_match(name1, name2)
+        with self._lock:
+            for name in (name1, name2):
+                self._results[name] = result
+                self._results.move_to_end(name)
+                self._playing.discard(name)
+            while len(self._results) > self.max_results:
+                self._results.popitem(last=False)
+        return result
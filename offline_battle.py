@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+离线战斗校验 - 浏览器本地打完整场战斗，服务器只校验结果
+
+浏览器和服务器使用同一个带种子的随机数生成器（mulberry32），
+按和 Warrior.attack / Mage.attack 相同的规则、相同的随机数调用顺序结算，
+所以同一个种子和同样的参战角色一定得到同样的结果。
+浏览器只需要上传 (种子, 参战角色, 声称的结果)，服务器重算一遍比较即可。
+
+每个回合的随机数调用顺序（rpg.html 里的 fightOffline 必须保持一致）：
+    1. random() < 0.5 时玩家1先攻，否则玩家2先攻
+    2. 先攻方攻击：random() < 暴击概率 时按暴击范围，否则按普通范围 randint 伤害
+    3. 防守方还活着时，按同样方式反击
+
+种子必须由服务器发放（SeedIssuer）：种子由客户端选择时，客户端可以反复尝试
+直到找到想要的结果。发放种子时就把票据绑定到两个参战角色（职业和HP），
+同一对角色同时只能有一张未校验的票据；校验时无论客户端声称什么，都按服务器重算的结果结算，
+过期仍未校验的票据也按服务器算出的结果结算，所以多要几张票据、只提交赢了的战斗没有用处。
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+import character_store
+from battle_oracle import ATTACK_PROFILES, CLASS_NAMES, normalize_class
+
+MASK = 0xFFFFFFFF
+MAX_ROUNDS = 100
+
+
+class Mulberry32:
+    """32位状态的随机数生成器，和 JavaScript 版本逐位一致"""
+
+    def __init__(self, seed):
+        self.state = int(seed) & MASK
+
+    def random(self):
+        self.state = (self.state + 0x6D2B79F5) & MASK
+        t = self.state
+        t = ((t ^ (t >> 15)) * (t | 1)) & MASK
+        t = ((t + (((t ^ (t >> 7)) * (t | 61)) & MASK)) & MASK) ^ t
+        return ((t ^ (t >> 14)) & MASK) / 4294967296
+
+    def randint(self, low, high):
+        return low + int(self.random() * (high - low + 1))
+
+
+def simulate(seed, class1, class2, hp1=None, hp2=None, max_rounds=MAX_ROUNDS):
+    """按种子打完整场战斗
+
+    返回 {'winner': 1/2/None, 'rounds': 回合数, 'hp': [HP1, HP2], 'events': [...]}，
+    events 中每一项是 [攻击方1/2, 伤害, 是否暴击]。
+    """
+    profiles = (ATTACK_PROFILES[normalize_class(class1)], ATTACK_PROFILES[normalize_class(class2)])
+    hp = [profiles[0]['hp'] if hp1 is None else int(hp1),
+          profiles[1]['hp'] if hp2 is None else int(hp2)]
+    events = []
+    winner, rounds = fight(Mulberry32(seed), profiles, hp, max_rounds, events)
+    return {'winner': winner, 'rounds': rounds, 'hp': hp, 'events': events}
+
+
+def fight(rng, profiles, hp, max_rounds=MAX_ROUNDS, events=None):
+    """用给定的随机数生成器和 ATTACK_PROFILES 格式的两个职业打一场，原地修改 hp
+
+    返回 (胜者1/2/None, 回合数)；events 不为 None 时追加 [攻击方, 伤害, 是否暴击]。
+    """
+    rounds = 0
+
+    def attack(i):
+        profile = profiles[i]
+        special = rng.random() < profile['special_chance']
+        low, high = profile['special'] if special else profile['normal']
+        damage = rng.randint(low, high)
+        hp[1 - i] = max(0, hp[1 - i] - damage)
+        if events is not None:
+            events.append([i + 1, damage, special])
+
+    while rounds < max_rounds and hp[0] > 0 and hp[1] > 0:
+        rounds += 1
+        first = 0 if rng.random() < 0.5 else 1
+        attack(first)
+        if hp[1 - first] > 0:
+            attack(1 - first)
+
+    if hp[0] == 0:
+        return 2, rounds
+    if hp[1] == 0:
+        return 1, rounds
+    return None, rounds
+
+
+class VerificationCache:
+    """校验结果缓存：同样的种子和参战角色只重算一次"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def outcome(self, seed, class1, class2, hp1=None, hp2=None):
+        key = (int(seed) & MASK, normalize_class(class1), normalize_class(class2), hp1, hp2)
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return result
+            self.misses += 1
+        full = simulate(*key)
+        result = {'winner': full['winner'], 'rounds': full['rounds'], 'hp': full['hp']}
+        with self._lock:
+            self._results[key] = result
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+        return result
+
+
+def fighters(data, owner, lookup=None):
+    """从请求里取出两个参战角色，返回 ((全局key, 职业, HP), (全局key, 职业, HP))
+
+    data: {"player1": {"name": 角色名, "class": "warrior", "hp": 可选}, "player2": {...}}
+    lookup(角色名) 返回已保存角色的 (职业, HP)：已保存的角色按服务器上的职业和HP参战，
+    请求里的只作为浏览器本地角色的数值。参数不合法时抛出 ValueError。
+    """
+    result = []
+    for key in ('player1', 'player2'):
+        player = data.get(key) if isinstance(data, dict) else None
+        if not isinstance(player, dict):
+            raise ValueError('Invalid replay')
+        name = character_store.normalize_name(player.get('name'))
+        stored = lookup(name) if lookup is not None else None
+        if stored is not None:
+            character_class, hp = normalize_class(stored[0]), stored[1]
+        else:
+            character_class = normalize_class(player.get('class'))
+            hp = player.get('hp')
+            try:
+                hp = ATTACK_PROFILES[character_class]['hp'] if hp is None else int(hp)
+            except (TypeError, ValueError):
+                raise ValueError('Invalid replay')
+        if not 0 < hp <= ATTACK_PROFILES[character_class]['hp']:
+            raise ValueError('Invalid hp')
+        result.append((character_store.qualify(owner, name), character_class, hp))
+    if result[0][0] == result[1][0]:
+        raise ValueError('A character cannot fight itself')
+    return tuple(result)
+
+
+def fighters_json(pair):
+    """发放种子时返回给浏览器的参战角色（职业用 'warrior'/'mage'），浏览器按这些数值打这一场"""
+    api_names = {name: key for key, name in CLASS_NAMES.items()}
+    return {f'player{i}': {'name': character_store.split_key(key)[1], 'class': api_names[character_class], 'hp': hp}
+            for i, (key, character_class, hp) in enumerate(pair, 1)}
+
+
+class SeedIssuer:
+    """发放一次性种子：票据是 "种子.过期时间.HMAC签名"，签名覆盖种子、过期时间和两个参战角色
+
+    签名密钥取 REPLAY_SECRET 环境变量，没有设置时每个进程随机生成
+    （Vercel 等多实例部署必须设置，否则一个实例发的票据另一个实例不认）。
+    已用票据只在内存里保存到过期为止，最多 max_used 条。
+    未校验的票据记在发放它的进程里：同一对角色同时只能有一张，过期后由 expired() 取出交给调用方结算。
+    """
+
+    def __init__(self, secret=None, ttl=300, max_used=100000):
+        secret = os.environ.get('REPLAY_SECRET') if secret is None else secret
+        self.secret = secret.encode('utf-8') if secret else secrets.token_bytes(32)
+        self.ttl = ttl
+        self.max_used = max_used
+        self._used = OrderedDict()  # 票据 -> 过期时间，按使用顺序排列
+        self._pending = OrderedDict()  # 票据 -> (种子, 参战角色, 过期时间)，按发放顺序排列
+        self._pairs = {}  # 两个角色的全局key（排好序） -> 未校验的票据
+        self._lock = threading.Lock()
+
+    def _sign(self, seed, expires, pair):
+        message = json.dumps([str(seed), expires, pair], ensure_ascii=False).encode('utf-8')
+        return hmac.new(self.secret, message, hashlib.sha256).hexdigest()
+
+    @staticmethod
+    def _pair_key(pair):
+        return tuple(sorted((pair[0][0], pair[1][0])))
+
+    def issue(self, pair, now=None):
+        """为两个参战角色（fighters() 的返回值）发放种子，返回 {'seed', 'ticket', 'expires'}
+
+        这一对角色还有没校验、也没过期的票据时抛出 ValueError。
+        """
+        now = time.time() if now is None else now
+        pair = tuple(tuple(fighter) for fighter in pair)
+        pair_key = self._pair_key(pair)
+        with self._lock:
+            ticket = self._pairs.get(pair_key)
+            if ticket is not None and self._pending[ticket][2] >= now:
+                raise ValueError('Battle already pending')
+            seed = secrets.randbits(32)
+            expires = int(now + self.ttl)
+            ticket = f'{seed}.{expires}.{self._sign(seed, expires, pair)}'
+            self._pending[ticket] = (seed, pair, expires)
+            self._pairs[pair_key] = ticket
+        return {'seed': seed, 'ticket': ticket, 'expires': expires}
+
+    def redeem(self, ticket, seed, pair, now=None):
+        """票据和种子、参战角色匹配，没有过期并且没用过时记为已用，否则抛出 ValueError"""
+        now = time.time() if now is None else now
+        pair = tuple(tuple(fighter) for fighter in pair)
+        try:
+            seed_part, expires_part, signature = ticket.split('.')
+            expires = int(expires_part)
+        except (AttributeError, ValueError):
+            raise ValueError('Invalid seed ticket')
+        if (seed_part != str(seed)
+                or not hmac.compare_digest(signature, self._sign(seed_part, expires, pair))):
+            raise ValueError('Invalid seed ticket')
+        if now > expires:
+            raise ValueError('Seed ticket expired')
+        with self._lock:
+            while self._used and next(iter(self._used.values())) < now:
+                self._used.popitem(last=False)
+            if ticket in self._used:
+                raise ValueError('Seed already used')
+            self._used[ticket] = expires
+            while len(self._used) > self.max_used:
+                self._used.popitem(last=False)
+            if self._pending.pop(ticket, None) is not None:
+                del self._pairs[self._pair_key(pair)]
+
+    def expired(self, now=None):
+        """取出已经过期还没校验的票据，返回 [(种子, 参战角色), ...]"""
+        now = time.time() if now is None else now
+        result = []
+        with self._lock:
+            # 所有票据的有效期相同，按发放顺序排列也就是按过期时间排列
+            while self._pending and next(iter(self._pending.values()))[2] < now:
+                ticket, (seed, pair, _) = self._pending.popitem(last=False)
+                if self._pairs.get(self._pair_key(pair)) == ticket:
+                    del self._pairs[self._pair_key(pair)]
+                result.append((seed, pair))
+        return result
+
+
+def outcome(cache, seed, pair):
+    """服务器按种子算出的结果"""
+    (_, class1, hp1), (_, class2, hp2) = pair
+    return cache.outcome(seed, class1, class2, hp1, hp2)
+
+
+def settle_expired(cache, seeds, on_result, now=None):
+    """按服务器算出的结果结算过期未校验的票据：on_result(参战角色, 结果)"""
+    for seed, pair in seeds.expired(now):
+        on_result(pair, outcome(cache, seed, pair))
+
+
+def verify_claim(claim, cache, seeds, owner=character_store.PUBLIC_OWNER, on_result=None):
+    """校验客户端上传的结果，种子必须是 seeds（SeedIssuer）为这两个角色发放的，并且只能用一次
+
+    claim: {"seed": 整数, "ticket": 发放种子时的票据, "player1": {"name": 角色名, "class": "warrior", "hp": 可选},
+            "player2": {...}, "result": {"winner": 1/2/null, "rounds": n, "hp": [a, b]}}
+    player1/player2 必须和发放种子时返回的名字、职业、HP一致（签名覆盖了它们），owner 也要相同。
+    不管客户端声称的结果是否一致，都调用 on_result(参战角色, 服务器算出的结果) 结算这一场。
+    返回 {'valid': 是否一致, 'result': 服务器算出的结果}；参数不合法时抛出 ValueError
+    """
+    try:
+        seed = int(claim['seed'])
+        claimed = claim['result']
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('Invalid replay')
+    pair = fighters(claim, owner)
+    seeds.redeem(claim.get('ticket'), seed, pair)
+
+    expected = outcome(cache, seed, pair)
+    if on_result is not None:
+        on_result(pair, expected)
+    valid = (isinstance(claimed, dict)
+             and claimed.get('winner') == expected['winner']
+             and claimed.get('rounds') == expected['rounds']
+             and list(claimed.get('hp') or []) == expected['hp'])
+    return {'valid': valid, 'result': expected}
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+游戏状态持久化 - 追加写入的二进制日志 + 定期压缩快照
+
+- 每次状态变化（创建角色、HP变化、洞穴状态变化）编码成一条二进制记录，
+  请求线程只负责放进内存缓冲区，后台线程批量写入并 fsync（group commit）
+- 日志记录达到一定数量后，把当前完整状态写成紧凑快照，并开始新的日志
+- 启动时用 mmap 读取快照，再重放快照之后的日志，恢复全部状态
+
+所有记录保存的都是变化后的完整状态（而不是增量），所以重复重放同一段日志结果不变。
+"""
+
+import mmap
+import os
+import shutil
+import struct
+import sys
+import threading
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Windows：没有 flock
+    fcntl = None
+
+SNAPSHOT_MAGIC = b'KBSNAP01'
+LOG_NAME = 'state.log'
+OLD_LOG_NAME = 'state.log.old'
+SNAPSHOT_NAME = 'state.snap'
+LOCK_NAME = 'state.lock'
+
+# 记录类型
+CHARACTER_CREATED = 1
+CHARACTER_HP = 2
+CAVE_STATE = 3
+
+# 用一个字节表示职业和洞穴状态
+CHARACTER_CLASSES = ('战士', '法师')
+CAVE_STATES = ('start', 'room', 'sitting', 'standing')
+
+# 记录头：载荷长度 + 载荷的CRC32
+RECORD_HEADER = struct.Struct('<II')
+SNAPSHOT_HEADER = struct.Struct('<8sQQ')  # magic, 角色数, 游戏数
+U8 = struct.Struct('<B')
+U16 = struct.Struct('<H')
+I32 = struct.Struct('<i')
+
+
+def _pack_str(value):
+    data = (value or '').encode('utf-8')
+    if len(data) > 0xFFFF:
+        raise ValueError('String too long to persist')
+    return U16.pack(len(data)) + data
+
+
+def _unpack_str(buf, offset):
+    (length,) = U16.unpack_from(buf, offset)
+    offset += U16.size
+    return bytes(buf[offset:offset + length]).decode('utf-8'), offset + length
+
+
+def encode_character_created(name, character_class, hp):
+    return (U8.pack(CHARACTER_CREATED) + _pack_str(name)
+            + U8.pack(CHARACTER_CLASSES.index(character_class)) + I32.pack(hp))
+
+
+def encode_character_hp(name, hp):
+    return U8.pack(CHARACTER_HP) + _pack_str(name) + I32.pack(hp)
+
+
+def encode_cave_state(game_id, state, previous_choice):
+    return (U8.pack(CAVE_STATE) + _pack_str(game_id)
+            + U8.pack(CAVE_STATES.index(state)) + _pack_str(previous_choice))
+
+
+def frame(payload):
+    """给载荷加上长度和校验和，写入时断电留下的半条记录会在恢复时被丢弃"""
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def iter_records(buf, offset=0):
+    """依次解出 buf 中的完整记录，遇到截断或损坏的记录就停止"""
+    end = len(buf)
+    while offset + RECORD_HEADER.size <= end:
+        length, crc = RECORD_HEADER.unpack_from(buf, offset)
+        start = offset + RECORD_HEADER.size
+        if start + length > end:
+            return
+        payload = buf[start:start + length]
+        if zlib.crc32(payload) != crc:
+            return
+        yield payload
+        offset = start + length
+
+
+def apply_record(payload, on_character, on_hp, on_cave):
+    """把一条记录交给对应的回调"""
+    kind = payload[0]
+    name, offset = _unpack_str(payload, 1)
+    if kind == CHARACTER_CREATED:
+        class_code = payload[offset]
+        (hp,) = I32.unpack_from(payload, offset + 1)
+        on_character(name, CHARACTER_CLASSES[class_code], hp)
+    elif kind == CHARACTER_HP:
+        (hp,) = I32.unpack_from(payload, offset)
+        on_hp(name, hp)
+    elif kind == CAVE_STATE:
+        state_code = payload[offset]
+        previous_choice, _ = _unpack_str(payload, offset + 1)
+        on_cave(name, CAVE_STATES[state_code], previous_choice or None)
+
+
+def write_snapshot(path, characters, games):
+    """把完整状态写成快照：先写临时文件，fsync 后再原子替换
+
+    characters: {name: (character_class, hp)}
+    games: {game_id: (state, previous_choice)}
+    """
+    tmp_path = path + '.tmp'
+    try:
+        _write_snapshot_file(tmp_path, characters, games)
+    except BaseException:
+        # 写了一半的临时文件没有用处，不留在目录里
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    os.replace(tmp_path, path)
+    _fsync_dir(os.path.dirname(path))
+
+
+def _write_snapshot_file(tmp_path, characters, games):
+    with open(tmp_path, 'wb') as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(characters), len(games)))
+        chunk = []
+        for name, (character_class, hp) in characters.items():
+            chunk.append(frame(encode_character_created(name, character_class, hp)))
+            if len(chunk) >= 4096:
+                f.write(b''.join(chunk))
+                chunk = []
+        for game_id, (state, previous_choice) in games.items():
+            chunk.append(frame(encode_cave_state(game_id, state, previous_choice)))
+            if len(chunk) >= 4096:
+                f.write(b''.join(chunk))
+                chunk = []
+        f.write(b''.join(chunk))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _fsync_dir(directory):
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(directory or '.', os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _replay_file(path, on_character, on_hp, on_cave, header_size=0):
+    """重放一个文件中的全部记录，返回 (记录条数, 最后一条完整记录的结束位置)"""
+    if not os.path.exists(path) or os.path.getsize(path) <= header_size:
+        return 0, 0
+    count = 0
+    end = header_size
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            if header_size and buf[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+                raise ValueError(f'{path} 不是有效的快照文件')
+            for payload in iter_records(buf, header_size):
+                apply_record(payload, on_character, on_hp, on_cave)
+                count += 1
+                end += RECORD_HEADER.size + len(payload)
+    return count, end
+
+
+def load_snapshot(path):
+    """读取快照文件，返回 (characters, games)，格式和 write_snapshot 的参数相同"""
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    characters = {}
+    games = {}
+
+    def on_character(name, character_class, hp):
+        characters[name] = (character_class, hp)
+
+    def on_hp(name, hp):
+        if name in characters:
+            characters[name] = (characters[name][0], hp)
+
+    def on_cave(game_id, state, previous_choice):
+        games[game_id] = (state, previous_choice)
+
+    _replay_file(path, on_character, on_hp, on_cave, header_size=SNAPSHOT_HEADER.size)
+    return characters, games
+
+
+class Journal:
+    """状态日志：请求线程调用 record_*，后台线程负责写盘和压缩"""
+
+    def __init__(self, directory, commit_interval=0.05, snapshot_every=100000):
+        self.directory = directory
+        self.commit_interval = commit_interval
+        self.snapshot_every = snapshot_every
+        self.log_path = os.path.join(directory, LOG_NAME)
+        self.old_log_path = os.path.join(directory, OLD_LOG_NAME)
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_NAME)
+        self._pending = []
+        self._checkpoints = []
+        self._cond = threading.Condition()
+        self._records_since_snapshot = 0
+        self._closed = False
+        self._thread = None
+        self._log = None
+        self._get_state = None
+        self._log_end = 0
+        self._compacted = True
+        self.failures = 0
+        self._lock_file = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _acquire_lock(self):
+        """独占目录：重启时新进程要等旧进程写完日志、退出之后才能开始重放"""
+        if fcntl is None or self._lock_file is not None:
+            return
+        self._lock_file = open(os.path.join(self.directory, LOCK_NAME), 'a')
+        try:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print(f"⏳ 等待其他进程释放 {self.directory}", file=sys.stderr)
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+
+    def _release_lock(self):
+        if self._lock_file is not None:
+            self._lock_file.close()  # 关闭文件即释放 flock
+            self._lock_file = None
+
+    def recover(self, on_character, on_hp, on_cave):
+        """先独占目录，再读取快照、重放日志，返回恢复的记录条数"""
+        self._acquire_lock()
+        count, _ = _replay_file(self.snapshot_path, on_character, on_hp, on_cave,
+                                header_size=SNAPSHOT_HEADER.size)
+        # 上次压缩可能在写完快照前中断，旧日志还在时也要重放
+        old_count, _ = _replay_file(self.old_log_path, on_character, on_hp, on_cave)
+        log_count, self._log_end = _replay_file(self.log_path, on_character, on_hp, on_cave)
+        self._records_since_snapshot = log_count
+        return count + old_count + log_count
+
+    def start(self, get_state):
+        """开始接受写入；get_state() 返回 (characters, games) 的紧凑副本，用于生成快照
+
+        必须在 recover() 之后调用。
+        """
+        self._get_state = get_state
+        if os.path.exists(self.old_log_path):
+            # 上次压缩没有完成：内存里已经是完整状态，直接写一份新快照
+            characters, games = get_state()
+            write_snapshot(self.snapshot_path, characters, games)
+            os.remove(self.old_log_path)
+            self._log_end = 0
+            self._records_since_snapshot = 0
+        self._log = open(self.log_path, 'ab')
+        # 去掉上次崩溃时写了一半的记录，保证新记录接在完整记录后面
+        self._log.truncate(self._log_end)
+        self._thread = threading.Thread(target=self._run, name='journal-writer', daemon=True)
+        self._thread.start()
+
+    def record_character_created(self, name, character_class, hp):
+        self._append(encode_character_created(name, character_class, hp))
+
+    def record_character_hp(self, name, hp):
+        self._append(encode_character_hp(name, hp))
+
+    def record_cave_state(self, game_id, state, previous_choice):
+        self._append(encode_cave_state(game_id, state, previous_choice))
+
+    def _append(self, payload):
+        with self._cond:
+            self._pending.append(frame(payload))
+            if len(self._pending) == 1:
+                self._cond.notify()
+
+    def checkpoint(self, timeout=None):
+        """让后台线程马上压缩一次并等待完成（例如整体替换了内存中的状态之后），超时或压缩失败返回 False"""
+        if self._thread is None:
+            return False
+        done = threading.Event()
+        with self._cond:
+            self._checkpoints.append(done)
+            self._cond.notify()
+        return done.wait(timeout) and self._compacted
+
+    def close(self):
+        if self._thread is None:
+            return
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self._thread = None
+        self._log.close()
+        self._release_lock()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._pending and not self._closed and not self._checkpoints:
+                    self._cond.wait()
+                if self._pending and not self._closed and not self._checkpoints:
+                    # 多等一小会儿，把这段时间内的写入合并成一次 fsync
+                    self._cond.wait(self.commit_interval)
+                batch, self._pending = self._pending, []
+                checkpoints, self._checkpoints = self._checkpoints, []
+                closed = self._closed
+            # 写盘或压缩失败时报告并继续运行：线程退出的话之后的修改就再也不会写盘了
+            try:
+                if batch:
+                    self._write(batch)
+                    self._records_since_snapshot += len(batch)
+                if checkpoints or self._records_since_snapshot >= self.snapshot_every:
+                    self._compacted = False
+                    self.compact()
+                    self._compacted = True
+            except Exception as e:
+                self.failures += 1
+                print(f"⚠️  状态日志写入失败: {e!r}", file=sys.stderr)
+                if self._log.closed:
+                    try:
+                        self._log = open(self.log_path, 'ab')
+                    except OSError:
+                        pass
+            for done in checkpoints:
+                done.set()
+            if closed:
+                return
+
+    def _write(self, batch):
+        self._log.write(b''.join(batch))
+        self._log.flush()
+        os.fsync(self._log.fileno())
+
+    def compact(self):
+        """把当前状态写成快照并清空日志（在后台线程中执行）"""
+        with self._cond:
+            # 先把缓冲区里的记录写进旧日志，再切换到新日志
+            batch, self._pending = self._pending, []
+            if batch:
+                self._write(batch)
+            self._log.close()
+            if os.path.exists(self.old_log_path):
+                # 上次压缩失败留下的旧日志还没有写进快照，接在它后面而不是覆盖
+                with open(self.log_path, 'rb') as src, open(self.old_log_path, 'ab') as dst:
+                    shutil.copyfileobj(src, dst)
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                os.remove(self.log_path)
+            else:
+                os.replace(self.log_path, self.old_log_path)
+            self._log = open(self.log_path, 'ab')
+            self._records_since_snapshot = 0
+        # 切换日志之后再读取状态：读到的任何修改都会在新日志里再出现一次
+        characters, games = self._get_state()
+        write_snapshot(self.snapshot_path, characters, games)
+        os.remove(self.old_log_path)
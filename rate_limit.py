@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+限流和准入控制 - 防止单个客户端刷爆接口
+
+- TokenBucketLimiter: 每个客户端一个令牌桶，超过速率返回 429。
+  只跟踪最近活跃的 max_clients 个客户端（LRU淘汰），每个客户端只占一个小列表。
+- AdmissionController: 全局准入控制，同时处理中的请求过多、游戏状态过多
+  或进程内存超过上限时返回 503，新请求直接拒绝而不是排队拖慢所有人。
+
+参数都可以用环境变量调整：
+    RATE_LIMIT         每个客户端每秒补充的令牌数（默认10，0表示不限流）
+    RATE_LIMIT_BURST   令牌桶容量（默认20）
+    MAX_IN_FLIGHT      同时处理的请求数上限（默认64）
+    MAX_GAME_STATE     角色和洞穴游戏总数上限（默认200000）
+    MAX_MEMORY_MB      进程内存上限（默认0，不检查）
+    TRUST_PROXY        前面可信的反向代理层数，按 X-Forwarded-For 识别客户端
+                       （默认0；检测到 Heroku 的 DYNO 或 Vercel 的 VERCEL 环境变量时默认1，即信任平台的路由）
+                       导入时就检查，不是非负整数时抛出 ValueError，服务器启动失败而不是每个请求都报错
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+MEMORY_CHECK_INTERVAL = 1.0
+
+
+def env_number(name, default):
+    value = os.environ.get(name, '').strip()
+    return float(value) if value else default
+
+
+def trusted_proxies():
+    """前面有几层可信的反向代理：TRUST_PROXY 优先，否则在 Heroku（DYNO）或 Vercel（VERCEL）上为1"""
+    value = os.environ.get('TRUST_PROXY', '').strip()
+    if value:
+        if not value.isdigit():
+            raise ValueError(f'TRUST_PROXY must be a non-negative integer, got {value!r}')
+        return int(value)
+    return 1 if os.environ.get('DYNO') or os.environ.get('VERCEL') else 0
+
+
+# 启动时读取一次
+TRUSTED_PROXIES = trusted_proxies()
+
+
+def client_key(address, forwarded_for=None, proxies=None):
+    """客户端标识：默认使用连接的IP，前面有 N 层可信代理时取 X-Forwarded-For 倒数第 N 个地址
+
+    每层代理都把它看到的对端地址追加到末尾，客户端自己伪造的地址只会出现在前面，
+    所以不能取第一个。proxies 默认是启动时读取的 TRUSTED_PROXIES。
+    """
+    if proxies is None:
+        proxies = TRUSTED_PROXIES
+    if proxies and forwarded_for:
+        hops = [hop.strip() for hop in forwarded_for.split(',') if hop.strip()]
+        if hops:
+            return hops[-min(proxies, len(hops))]
+    return address or 'unknown'
+
+
+def current_memory_mb():
+    """当前进程的常驻内存（MB），读不到时返回 None"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, AttributeError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # 没有 /proc 时退而求其次使用峰值内存（macOS 单位是字节，Linux 是KB）
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if peak > 1 << 30 else peak / 1024
+
+
+class TokenBucketLimiter:
+    """按客户端限流的令牌桶，超过 max_clients 时淘汰最久没有请求的客户端"""
+
+    def __init__(self, rate=None, burst=None, max_clients=100000):
+        self.rate = env_number('RATE_LIMIT', 10.0) if rate is None else rate
+        self.burst = env_number('RATE_LIMIT_BURST', 20.0) if burst is None else burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()  # 客户端 -> [剩余令牌, 上次更新时间]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def allow(self, client, cost=1.0, now=None):
+        """消耗令牌，返回 (是否允许, 需要等待的秒数)"""
+        if self.rate <= 0:
+            return True, 0.0
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = [self.burst, now]
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(client)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                return True, 0.0
+            return False, (cost - bucket[0]) / self.rate
+
+
+class AdmissionController:
+    """全局准入控制
+
+    state_size() 返回当前保存的游戏状态数量，只有会新增状态的请求（allocates=True）
+    才会因为状态过多被拒绝，已有角色的战斗等请求不受影响。
+    """
+
+    def __init__(self, state_size=None, max_in_flight=None, max_state=None, max_memory_mb=None):
+        self.state_size = state_size
+        self.max_in_flight = int(env_number('MAX_IN_FLIGHT', 64)) if max_in_flight is None else max_in_flight
+        self.max_state = int(env_number('MAX_GAME_STATE', 200000)) if max_state is None else max_state
+        self.max_memory_mb = env_number('MAX_MEMORY_MB', 0) if max_memory_mb is None else max_memory_mb
+        self.in_flight = 0
+        self.shed = 0
+        self._memory_mb = 0.0
+        self._memory_checked = 0.0
+        self._lock = threading.Lock()
+
+    def enter(self, allocates=False, now=None):
+        """请求开始时调用，允许时返回 None（之后必须调用 leave），否则返回拒绝原因"""
+        reason = None
+        with self._lock:
+            if self.max_in_flight and self.in_flight >= self.max_in_flight:
+                reason = 'Server busy'
+            elif allocates and self._over_state_limit():
+                reason = 'Too many active games'
+            elif allocates and self._over_memory_limit(now):
+                reason = 'Server out of memory'
+            if reason is None:
+                self.in_flight += 1
+            else:
+                self.shed += 1
+        return reason
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def _over_state_limit(self):
+        return bool(self.max_state and self.state_size and self.state_size() >= self.max_state)
+
+    def _over_memory_limit(self, now=None):
+        if not self.max_memory_mb:
+            return False
+        # 读内存要访问文件系统，最多每秒检查一次
+        now = time.monotonic() if now is None else now
+        if now - self._memory_checked >= MEMORY_CHECK_INTERVAL:
+            self._memory_checked = now
+            self._memory_mb = current_memory_mb() or 0.0
+        return self._memory_mb >= self.max_memory_mb
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Elo积分和排行榜
+
+每场分出胜负的战斗都会增量更新双方的Elo积分。积分保存在一个带跨度的跳表里，
+按积分从高到低排序，查排名、前K名、某个玩家附近的排名都是 O(log n)，
+更新积分时只需要删除旧位置再插入新位置，不需要整体重新排序。
+"""
+
+import heapq
+import random
+import threading
+
+INITIAL_RATING = 1500.0
+K_FACTOR = 32.0
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, level):
+        self.key = key
+        self.next = [None] * level
+        # width[i]: 沿第 i 层走到 next[i] 时跨过的第0层节点数
+        self.width = [1] * level
+
+
+class IndexableSkipList:
+    """支持按位置访问的有序跳表，位置从1开始"""
+
+    MAX_LEVEL = 24
+
+    def __init__(self):
+        self.head = _Node(None, self.MAX_LEVEL)
+        self.size = 0
+        self.level = 1  # 当前用到的最高层数，更高的层只有头节点
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        node = self.head.next[0]
+        while node is not None:
+            yield node.key
+            node = node.next[0]
+
+    def _random_level(self):
+        level = 1
+        while level < self.MAX_LEVEL and random.random() < 0.5:
+            level += 1
+        return level
+
+    def _find(self, key):
+        """返回每一层上最后一个小于 key 的节点及其位置"""
+        update = [self.head] * self.MAX_LEVEL
+        ranks = [0] * self.MAX_LEVEL
+        node = self.head
+        pos = 0
+        for i in range(self.level - 1, -1, -1):
+            nxt = node.next[i]
+            while nxt is not None and nxt.key < key:
+                pos += node.width[i]
+                node = nxt
+                nxt = node.next[i]
+            update[i] = node
+            ranks[i] = pos
+        return update, ranks
+
+    def insert(self, key):
+        update, ranks = self._find(key)
+        position = ranks[0] + 1
+        level = self._random_level()
+        if level > self.level:
+            for i in range(self.level, level):
+                self.head.width[i] = self.size + 1
+            self.level = level
+        node = _Node(key, level)
+        for i in range(level):
+            prev = update[i]
+            node.next[i] = prev.next[i]
+            node.width[i] = ranks[i] + prev.width[i] + 1 - position
+            prev.next[i] = node
+            prev.width[i] = position - ranks[i]
+        for i in range(level, self.level):
+            update[i].width[i] += 1
+        self.size += 1
+
+    def rebuild(self, keys):
+        """用已经排好序的 keys 重建整个跳表，O(n)
+
+        逐个 insert 每次都要从最高层找插入位置；批量加载时按顺序把节点接到每一层的末尾，
+        同时记下每一层上一个节点的位置来计算跨度。keys 可以是遍历旧跳表的迭代器，新表建好后才替换。
+        """
+        head = _Node(None, self.MAX_LEVEL)
+        last = [head] * self.MAX_LEVEL
+        last_pos = [0] * self.MAX_LEVEL
+        size = 0
+        level = 1
+        for key in keys:
+            size += 1
+            node_level = self._random_level()
+            node = _Node(key, node_level)
+            for i in range(node_level):
+                prev = last[i]
+                prev.next[i] = node
+                prev.width[i] = size - last_pos[i]
+                last[i] = node
+                last_pos[i] = size
+            if node_level > level:
+                level = node_level
+        for i in range(self.MAX_LEVEL):
+            last[i].width[i] = size + 1 - last_pos[i]
+        self.head, self.size, self.level = head, size, level
+
+    def remove(self, key):
+        update, _ = self._find(key)
+        node = update[0].next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        for i in range(self.level):
+            prev = update[i]
+            if prev.next[i] is node:
+                prev.width[i] += node.width[i] - 1
+                prev.next[i] = node.next[i]
+            else:
+                prev.width[i] -= 1
+        self.size -= 1
+
+    def rank(self, key):
+        """key 的位置，不存在时返回 None"""
+        update, ranks = self._find(key)
+        node = update[0].next[0]
+        if node is None or node.key != key:
+            return None
+        return ranks[0] + 1
+
+    def slice(self, start, count):
+        """从位置 start 开始取 count 个key"""
+        if start < 1 or start > self.size or count <= 0:
+            return []
+        node = self.head
+        pos = 0
+        for i in range(self.level - 1, -1, -1):
+            while node.next[i] is not None and pos + node.width[i] <= start:
+                pos += node.width[i]
+                node = node.next[i]
+        keys = []
+        while node is not None and len(keys) < count:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+class RatingBoard:
+    """Elo积分表，跳表里的key是 (-积分, 名字)，积分高的排在前面"""
+
+    def __init__(self, k_factor=K_FACTOR, initial=INITIAL_RATING):
+        self.k_factor = k_factor
+        self.initial = initial
+        self._stats = {}  # 名字 -> [积分, 胜场, 负场]
+        self._index = IndexableSkipList()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._stats)
+
+    def add(self, name):
+        """登记新角色，已存在时保留原有积分"""
+        name = str(name)
+        with self._lock:
+            if name not in self._stats:
+                self._stats[name] = [self.initial, 0, 0]
+                self._index.insert((-self.initial, name))
+
+    def add_many(self, names):
+        """一次登记大量角色（例如恢复状态之后），已存在的保留原有积分
+
+        新角色都是初始积分，按名字排好序后和原有的key归并，一次性重建跳表，
+        不再为每个角色单独查找插入位置。
+        """
+        with self._lock:
+            new = sorted({str(name) for name in names}.difference(self._stats))
+            if not new:
+                return
+            for name in new:
+                self._stats[name] = [self.initial, 0, 0]
+            self._index.rebuild(heapq.merge(self._index, ((-self.initial, name) for name in new)))
+
+    def record_result(self, winner, loser):
+        """记录一场胜负并更新双方积分"""
+        winner = str(winner)
+        loser = str(loser)
+        if winner == loser:
+            return
+        self.add(winner)
+        self.add(loser)
+        with self._lock:
+            w = self._stats[winner]
+            l = self._stats[loser]
+            expected = 1.0 / (1.0 + 10 ** ((l[0] - w[0]) / 400.0))
+            delta = self.k_factor * (1.0 - expected)
+            self._move(winner, w, w[0] + delta)
+            self._move(loser, l, l[0] - delta)
+            w[1] += 1
+            l[2] += 1
+
+    def _move(self, name, stats, rating):
+        self._index.remove((-stats[0], name))
+        stats[0] = rating
+        self._index.insert((-rating, name))
+
+    def rating(self, name):
+        stats = self._stats.get(str(name))
+        return stats[0] if stats else None
+
+    def rank(self, name):
+        name = str(name)
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                return None
+            return self._index.rank((-stats[0], name))
+
+    def top(self, count, start=1):
+        """从第 start 名开始的 count 个玩家"""
+        with self._lock:
+            keys = self._index.slice(start, count)
+            return [self._entry(start + i, name) for i, (_, name) in enumerate(keys)]
+
+    def around(self, name, radius):
+        """某个玩家前后各 radius 名"""
+        rank = self.rank(name)
+        if rank is None:
+            return []
+        start = max(1, rank - radius)
+        return self.top(rank + radius - start + 1, start)
+
+    def _entry(self, rank, name):
+        rating, wins, losses = self._stats[name]
+        return {'rank': rank, 'name': name, 'rating': round(rating, 1),
+                'wins': wins, 'losses': losses}
@@ -1,4 +1,13 @@
+import argparse
+import json
 import random
+import sys
+import time
+
+# 输出和输入方式：交互模式下直接打印、读取键盘输入；
+# 无界面模式下由 configure_io() 换成静默/JSONL输出和脚本输入
+say = print
+ask = input
 
 class Character:
     """角色基类 - 所有角色的通用属性和方法"""
@@ -53,7 +62,7 @@ class Warrior(Character):
         if random.random() < 0.3:
             damage = random.randint(self.damage + 10, self.damage + 20)
             actual_damage = target.take_damage(damage)
-            print(f"💥 {self.name} 发动暴击！造成 {actual_damage} 点伤害！")
+            say(f"💥 {self.name} 发动暴击！造成 {actual_damage} 点伤害！")
             return actual_damage
         else:
             damage = random.randint(self.damage - 5, self.damage + 5)
@@ -77,7 +86,7 @@ class Mage(Character):
         if random.random() < 0.2:
             damage = random.randint(self.damage + 15, self.damage + 25)
             actual_damage = target.take_damage(damage)
-            print(f"🔥 {self.name} 施放强力法术！造成 {actual_damage} 点伤害！")
+            say(f"🔥 {self.name} 施放强力法术！造成 {actual_damage} 点伤害！")
             return actual_damage
         else:
             damage = random.randint(self.damage - 3, self.damage + 7)
@@ -87,84 +96,249 @@ class Mage(Character):
 
 def create_character():
     """创建角色"""
-    print("\n=== 角色创建 ===")
-    name = input("请输入角色名字: ")
+    say("\n=== 角色创建 ===")
+    name = ask("请输入角色名字: ")
     
-    print("请选择职业:")
-    print("1. 战士 (高HP，中等伤害)")
-    print("2. 法师 (低HP，高伤害)")
+    say("请选择职业:")
+    say("1. 战士 (高HP，中等伤害)")
+    say("2. 法师 (低HP，高伤害)")
     
     while True:
-        choice = input("请输入选择 (1/2): ")
+        choice = ask("请输入选择 (1/2): ")
         if choice == "1":
             return Warrior(name)
         elif choice == "2":
             return Mage(name)
         else:
-            print("无效选择，请重新输入！")
+            say("无效选择，请重新输入！")
+
+
+def make_character(spec):
+    """根据 '名字:职业' 创建角色，职业可以写 warrior/mage 或 1/2"""
+    name, _, character_class = spec.rpartition(':')
+    if character_class in ('1', 'warrior', '战士'):
+        return Warrior(name)
+    if character_class in ('2', 'mage', '法师'):
+        return Mage(name)
+    raise ValueError(f"无效的角色配置: {spec}")
 
 
 def battle_round(player1, player2):
     """一回合战斗逻辑"""
-    print(f"\n--- 战斗回合 ---")
-    print(f"{player1}")
-    print(f"{player2}")
+    say(f"\n--- 战斗回合 ---")
+    say(f"{player1}")
+    say(f"{player2}")
     
     # 随机决定攻击顺序
     if random.random() < 0.5:
         attacker, defender = player1, player2
-        print(f"\n{player1.name} 先攻！")
+        say(f"\n{player1.name} 先攻！")
     else:
         attacker, defender = player2, player1
-        print(f"\n{player2.name} 先攻！")
+        say(f"\n{player2.name} 先攻！")
     
     # 第一轮攻击
     if attacker.is_alive and defender.is_alive:
         damage = attacker.attack(defender)
         if damage > 0:
-            print(f"{attacker.name} 攻击 {defender.name}，造成 {damage} 点伤害！")
+            say(f"{attacker.name} 攻击 {defender.name}，造成 {damage} 点伤害！")
     
     # 第二轮攻击（如果双方都还活着）
     if attacker.is_alive and defender.is_alive:
         damage = defender.attack(attacker)
         if damage > 0:
-            print(f"{defender.name} 反击 {attacker.name}，造成 {damage} 点伤害！")
+            say(f"{defender.name} 反击 {attacker.name}，造成 {damage} 点伤害！")
 
 
-def main():
-    """主函数 - 控制整个战斗流程"""
-    print("🎮 欢迎来到RPG战斗模拟器！")
-    print("=" * 50)
-    
-    # 角色创建
-    print("\n玩家1创建角色:")
-    player1 = create_character()
-    
-    print("\n玩家2创建角色:")
-    player2 = create_character()
-    
-    print(f"\n战斗开始！")
-    print(f"玩家1: {player1.name} ({player1.character_class})")
-    print(f"玩家2: {player2.name} ({player2.character_class})")
-    print("=" * 50)
-    
-    # 回合制战斗
+def fight(player1, player2):
+    """回合制战斗直到一方阵亡，返回 (获胜的玩家编号, 回合数)"""
     round_count = 1
     while player1.is_alive and player2.is_alive:
-        print(f"\n第 {round_count} 回合")
+        say(f"\n第 {round_count} 回合")
         battle_round(player1, player2)
         round_count += 1
         
         # 检查战斗是否结束
         if not player1.is_alive:
-            print(f"\n🏆 战斗结束！{player2.name} 获胜！")
-            break
+            say(f"\n🏆 战斗结束！{player2.name} 获胜！")
+            return 2, round_count - 1
         elif not player2.is_alive:
-            print(f"\n🏆 战斗结束！{player1.name} 获胜！")
-            break
+            say(f"\n🏆 战斗结束！{player1.name} 获胜！")
+            return 1, round_count - 1
+    return (1 if player1.is_alive else 2), round_count - 1
+
+
+def main(player_specs=None):
+    """主函数 - 控制整个战斗流程，返回获胜的玩家编号"""
+    say("🎮 欢迎来到RPG战斗模拟器！")
+    say("=" * 50)
+    
+    # 角色创建
+    if player_specs:
+        player1, player2 = (make_character(spec) for spec in player_specs)
+    else:
+        say("\n玩家1创建角色:")
+        player1 = create_character()
+        
+        say("\n玩家2创建角色:")
+        player2 = create_character()
+    
+    say(f"\n战斗开始！")
+    say(f"玩家1: {player1.name} ({player1.character_class})")
+    say(f"玩家2: {player2.name} ({player2.character_class})")
+    say("=" * 50)
+    
+    # 回合制战斗
+    winner, rounds = fight(player1, player2)
+    
+    say("\n游戏结束，感谢游玩！")
+    emit_event({
+        'winner': winner,
+        'winner_name': (player1, player2)[winner - 1].name,
+        'rounds': rounds,
+        'players': [
+            {'name': p.name, 'class': p.character_class, 'hp': p.hp} for p in (player1, player2)
+        ],
+    })
+    return winner
+
+
+def parse_team(spec):
+    """解析队伍配置，例如 'warrior=30,mage=20'"""
+    roster = []
+    for part in spec.split(','):
+        character_class, _, count = part.partition('=')
+        roster.extend([(character_class.strip(), None)] * int(count or 1))
+    return roster
+
+
+def raid(args):
+    """团队战斗模式，返回获胜的队伍编号（平局为 None）"""
+    from team_battle import resolve_team_battle
+    
+    rng = random.Random(args.seed)
+    try:
+        team1 = parse_team(args.team1)
+        team2 = parse_team(args.team2)
+        start = time.perf_counter()
+        result = resolve_team_battle(team1, team2, policy=args.policy, mode=args.mode, rng=rng)
+    except ValueError as e:
+        print(f"❌ 队伍配置错误: {e}", file=sys.stderr)
+        raise SystemExit(2)
+    elapsed = (time.perf_counter() - start) * 1000
+    
+    say(f"⚔️  团队战斗：{len(team1)} 人 vs {len(team2)} 人（{args.mode} / {args.policy}）")
+    if result['winner'] is None:
+        say(f"🤝 平局！")
+    else:
+        say(f"🏆 队伍{result['winner']} 获胜！")
+    say(f"步数: {result['ticks']}，存活: {result['survivors'][0]} vs {result['survivors'][1]}，耗时 {elapsed:.1f} ms")
+    emit_event({
+        'winner': result['winner'],
+        'ticks': result['ticks'],
+        'survivors': result['survivors'],
+        'elapsed_ms': round(elapsed, 3),
+    })
+    return result['winner']
+
+
+def emit_event(record):
+    """JSONL 模式下输出一行结果，其他模式下什么都不做"""
+
+
+def configure_io(output='text', script=None):
+    """切换输入输出方式
+
+    output: 'text' 正常打印，'quiet' 不输出，'jsonl' 每场战斗输出一行JSON
+    script: 从文件（'-' 为标准输入）按行读取回答，代替键盘输入；
+            不输出的模式下没有指定时从标准输入读取，不打印提问
+    """
+    global say, ask, emit_event
+    
+    if output != 'text':
+        say = lambda *args, **kwargs: None
+    if output == 'jsonl':
+        def emit_event(record):
+            sys.stdout.write(json.dumps(record, ensure_ascii=False) + '\n')
+    
+    if script is None and output != 'text':
+        script = '-'
+    if script is not None:
+        if script == '-':
+            answers = (line.rstrip('\n') for line in sys.stdin)
+        else:
+            with open(script, encoding='utf-8') as f:
+                answers = iter(f.read().splitlines())
+        
+        def ask(prompt=''):
+            answer = next(answers, None)
+            if answer is None:
+                raise EOFError('脚本中的回答不够')
+            return answer
+
+
+# 无界面模式的退出码：和 grep 一样，0/1 表示结果，2 表示用法或输入错误
+EXIT_PLAYER1_WINS = 0
+EXIT_PLAYER2_WINS = 1
+EXIT_ERROR = 2
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='RPG战斗模拟器',
+        epilog='无界面模式的退出码：0 玩家1（队伍1）获胜，1 玩家2（队伍2）获胜或团队战平局，2 参数或输入错误；'
+               '--runs 按胜场多少决定，胜场相同时返回 0')
+    parser.add_argument('--p1', metavar='NAME:CLASS', help="玩家1，例如 '亚瑟:warrior'")
+    parser.add_argument('--p2', metavar='NAME:CLASS', help="玩家2，例如 '梅林:mage'")
+    parser.add_argument('--script', metavar='FILE',
+                        help="按行从文件读取创建角色时的回答，'-' 表示标准输入")
+    parser.add_argument('--runs', type=int, default=1, help='重复战斗的次数（需要 --p1/--p2）')
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument('--quiet', action='store_true', help='不输出战斗过程')
+    output.add_argument('--jsonl', action='store_true', help='每场战斗输出一行JSON结果')
+    parser.add_argument('--team1', help="团队战斗的队伍1，例如 'warrior=30,mage=20'")
+    parser.add_argument('--team2', help="团队战斗的队伍2，例如 'mage=50'")
+    parser.add_argument('--policy', default='random', choices=['random', 'weakest', 'focus'],
+                        help='目标选择策略')
+    parser.add_argument('--mode', default='simultaneous', choices=['simultaneous', 'initiative'],
+                        help='同时结算或按先后手结算')
+    parser.add_argument('--seed', type=int, help='随机数种子')
+    args = parser.parse_args(argv)
+    if bool(args.team1) != bool(args.team2):
+        parser.error('--team1 和 --team2 需要同时指定')
+    if bool(args.p1) != bool(args.p2):
+        parser.error('--p1 和 --p2 需要同时指定')
+    if args.runs > 1 and not args.p1:
+        parser.error('--runs 需要配合 --p1/--p2 使用')
+    return args
+
+
+def run_cli(argv=None):
+    """命令行入口，交互模式返回 0，无界面模式返回表示结果的退出码"""
+    args = parse_args(argv)
+    headless = bool(args.p1 or args.script or args.team1 or args.quiet or args.jsonl)
+    configure_io('jsonl' if args.jsonl else 'quiet' if args.quiet else 'text', args.script)
+    if args.seed is not None:
+        random.seed(args.seed)
+    
+    if args.team1:
+        winner = raid(args)
+        return EXIT_PLAYER1_WINS if winner == 1 else EXIT_PLAYER2_WINS
+    
+    try:
+        specs = (args.p1, args.p2) if args.p1 else None
+        wins = [0, 0]
+        for _ in range(args.runs):
+            wins[main(specs) - 1] += 1
+    except (ValueError, EOFError) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return EXIT_ERROR
     
-    print("\n游戏结束，感谢游玩！")
+    if not headless:
+        return 0
+    # 多场战斗胜场相同不算玩家2获胜
+    return EXIT_PLAYER2_WINS if wins[1] > wins[0] else EXIT_PLAYER1_WINS
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(run_cli())
@@ -5,12 +5,32 @@
 """
 
 import http.server
+import itertools
+import socket
 import socketserver
 import json
+import math
 import urllib.parse
 import random
 import os
-from datetime import datetime
+import tempfile
+import email.utils
+import gc
+import gzip
+import threading
+import time
+
+import battle_oracle
+import character_store
+import idempotency
+import matchmaking
+import persistence
+import rate_limit
+import rating
+import static_files
+
+# 只在少数请求或可选功能里用到的模块（duel_ws、offline_battle、team_battle、
+# battle_analytics）在第一次用到时才导入，缩短启动时间
 
 # RPG战斗游戏类定义
 class Character:
@@ -138,69 +158,740 @@ class CaveGame:
                 self.message = "Game over. Choose 'restart' to play again."
 
 
-# 全局游戏状态
+# 全局游戏状态（只保存在本进程的内存里，服务器只能单进程运行）
 games = {}
-characters = {}
+# 洞穴游戏按状态（start/room/sitting/standing）索引，供管理接口查询
+game_states = character_store.BucketIndex()
+# 角色按玩家ID分命名空间保存：玩家ID -> 角色名 -> (职业, HP)
+characters = character_store.CharacterStore()
+
+
+# 同一时刻创建的多个游戏靠序号区分（多线程下时间戳可能相同）
+_game_seq = itertools.count()
+
+
+def new_game_id():
+    """生成游戏ID：时间戳加序号"""
+    return f"{time.time()}-{next(_game_seq)}"
+
+
+# Elo积分排行榜
+ratings = rating.RatingBoard()
+
+# 状态持久化（设置 GAME_STATE_DIR 环境变量后启用）
+journal = None
+
+# 战斗数据分析（设置 ANALYTICS_DIR 环境变量后启用）
+analytics = None
+
+# 运行中状态的快照（管理接口使用）
+snapshots = None
+
+
+def restore_character(name, character_class, hp):
+    """根据职业和HP重建角色字典"""
+    character = Warrior(name) if character_class == '战士' else Mage(name)
+    if hp <= 0:
+        character.take_damage(character.hp)
+    else:
+        character.hp = hp
+    return character.to_dict()
+
+
+def restore_cave_game(state, previous_choice):
+    """按原来的选择重新走一遍，恢复洞穴游戏的状态和提示信息"""
+    game = CaveGame()
+    if state != 'start':
+        game.make_choice(previous_choice)
+        if state == 'sitting':
+            game.make_choice('sit down')
+        elif state == 'standing':
+            game.make_choice('stand up')
+    return game
+
+
+def _on_restored_character(key, character_class, hp):
+    owner, name = character_store.split_key(key)
+    characters.put(owner, name, character_class, max(hp, 0))
+
+
+def _on_restored_hp(key, hp):
+    owner, name = character_store.split_key(key)
+    if characters.get(owner, name) is not None:
+        characters.set_hp(owner, name, max(hp, 0))
+
+
+def _on_restored_cave(game_id, state, previous_choice):
+    previous = games.get(game_id)
+    game = games[game_id] = restore_cave_game(state, previous_choice)
+    if previous is None:
+        game_states.add(game_id, game.state)
+    else:
+        game_states.move(game_id, previous.state, game.state)
+
+
+def snapshot_state():
+    """生成快照用的紧凑状态副本"""
+    character_state = {character_store.qualify(owner, name): (character_class, hp)
+                       for owner, name, character_class, hp in characters.items()}
+    game_state = {game_id: (game.state, game.previous_choice)
+                  for game_id, game in list(games.items())}
+    return character_state, game_state
+
+
+def setup_persistence():
+    """从磁盘恢复状态并开始记录日志"""
+    global journal
+    state_dir = os.environ.get('GAME_STATE_DIR')
+    if not state_dir or journal is not None:
+        return
+    journal = persistence.Journal(state_dir)
+    # 恢复时新建的几百万个对象会一直存活：期间暂停循环垃圾回收，省掉反复扫描它们的时间，
+    # 恢复完把它们移到永久代，以后的完整回收也不再扫描
+    gc.disable()
+    try:
+        count = journal.recover(_on_restored_character, _on_restored_hp, _on_restored_cave)
+        # 恢复完再一次性登记积分，比重放每条记录时逐个插入跳表快得多
+        ratings.add_many(character_store.qualify(owner, name) for owner, name, _, _ in characters.items())
+    finally:
+        gc.freeze()
+        gc.enable()
+    journal.start(snapshot_state)
+    print(f"💾 已从 {state_dir} 恢复 {count} 条状态记录")
+
+
+def replace_state(character_state, game_state):
+    """用快照里的状态整体替换内存中的角色和洞穴游戏（回滚），返回 (角色数, 游戏数)
+
+    角色存储和游戏字典都是建好新对象后一次性换上；正在进行中的请求可能还会写到旧对象上，
+    这些修改随旧状态一起丢弃。积分不在快照里，保留原有积分，快照里的新角色按初始积分登记。
+    持久化开启时立即压缩一次，让磁盘上的状态也回到快照。
+    """
+    global games, game_states
+    records = []
+    for key, (character_class, hp) in character_state.items():
+        owner, name = character_store.split_key(key)
+        records.append((owner, name, character_class, max(hp, 0)))
+    ratings.add_many(character_state)
+    characters.replace_all(records)
+    restored = {game_id: restore_cave_game(state, previous_choice)
+                for game_id, (state, previous_choice) in game_state.items()}
+    index = character_store.BucketIndex()
+    for game_id, game in restored.items():
+        index.add(game_id, game.state)
+    games, game_states = restored, index
+    if journal is not None:
+        journal.checkpoint(timeout=60)
+    return len(characters), len(games)
+
+
+def characters_frozen():
+    """fork 快照时持有的锁（characters 回滚时会被换掉，每次取当前的）"""
+    return characters.frozen()
+
+
+def setup_snapshots():
+    """快照保存在 SNAPSHOT_DIR（默认在临时目录下，不放在网站目录里）；LOAD_SNAPSHOT 指定启动时加载的快照"""
+    global snapshots
+    import state_snapshot
+    if snapshots is None:
+        snapshots = state_snapshot.Snapshotter(
+            os.environ.get('SNAPSHOT_DIR', os.path.join(tempfile.gettempdir(), 'kbpygames-snapshots')),
+            snapshot_state, characters_frozen)
+    path = os.environ.get('LOAD_SNAPSHOT')
+    if path:
+        count = replace_state(*persistence.load_snapshot(path))
+        print(f"📸 已从 {path} 加载 {count[0]} 个角色、{count[1]} 个洞穴游戏")
+
+
+def setup_analytics():
+    """开始记录每次攻击，文件名带进程号，多个服务器进程可以共用一个目录"""
+    global analytics
+    directory = os.environ.get('ANALYTICS_DIR')
+    if not directory or analytics is not None:
+        return
+    import battle_analytics
+    analytics = battle_analytics.AnalyticsSink(directory)
+    analytics.start()
+    print(f"📊 战斗数据写入 {directory}（{analytics.file_format}）")
+
+
+def close_analytics():
+    global analytics
+    if analytics is not None:
+        analytics.close()
+        analytics = None
+
+
+def close_persistence():
+    global journal
+    if journal is not None:
+        journal.close()
+        journal = None
+
+
+def get_character(owner, name):
+    """按玩家ID和角色名取出角色字典，不存在时返回 None"""
+    record = characters.get(owner, name)
+    if record is None:
+        return None
+    return restore_character(name, *record)
+
+
+def battle_round(player1_name, player2_name, owner=character_store.PUBLIC_OWNER, opponent_owner=None):
+    """进行一回合战斗并更新角色状态，角色不存在时返回 None
+
+    两个角色默认都在 owner 的命名空间里，匹配到其他玩家的角色时用 opponent_owner 指定。
+    读取、结算和写回HP期间锁住这两个角色，同一个角色的并发战斗不会丢失更新。
+    """
+    opponent_owner = owner if opponent_owner is None else opponent_owner
+    with characters.locked((owner, player1_name), (opponent_owner, player2_name)):
+        return _battle_round(player1_name, player2_name, owner, opponent_owner)
+
+
+def _battle_round(player1_name, player2_name, owner, opponent_owner):
+    p1_data = get_character(owner, player1_name)
+    p2_data = get_character(opponent_owner, player2_name)
+    if p1_data is None or p2_data is None:
+        return None
+    
+    # 重新创建角色对象
+    
+    if p1_data['character_class'] == '战士':
+        player1 = Warrior(p1_data['name'])
+    else:
+        player1 = Mage(p1_data['name'])
+    
+    if p2_data['character_class'] == '战士':
+        player2 = Warrior(p2_data['name'])
+    else:
+        player2 = Mage(p2_data['name'])
+    
+    # 恢复HP状态
+    player1.hp = p1_data['hp']
+    player1.is_alive = p1_data['is_alive']
+    player2.hp = p2_data['hp']
+    player2.is_alive = p2_data['is_alive']
+    
+    key1 = character_store.qualify(owner, player1_name)
+    key2 = character_store.qualify(opponent_owner, player2_name)
+    
+    # 随机决定攻击顺序
+    if random.random() < 0.5:
+        attacker, defender = player1, player2
+        attacker_key, defender_key = key1, key2
+        first_attacker = player1_name
+    else:
+        attacker, defender = player2, player1
+        attacker_key, defender_key = key2, key1
+        first_attacker = player2_name
+    
+    battle_log = []
+    exchanges = []
+    
+    # 第一轮攻击
+    if attacker.is_alive and defender.is_alive:
+        result = attacker.attack(defender)
+        if isinstance(result, tuple):
+            damage, is_special = result
+            exchanges.append((attacker_key, attacker.character_class, defender_key,
+                              defender.character_class, damage, is_special, True))
+            if is_special:
+                if attacker.character_class == '战士':
+                    battle_log.append(f"💥 {attacker.name} 发动暴击！造成 {damage} 点伤害！")
+                else:
+                    battle_log.append(f"🔥 {attacker.name} 施放强力法术！造成 {damage} 点伤害！")
+            else:
+                battle_log.append(f"{attacker.name} 攻击 {defender.name}，造成 {damage} 点伤害！")
+        else:
+            battle_log.append(f"{attacker.name} 攻击 {defender.name}，造成 {result} 点伤害！")
+    
+    # 第二轮攻击（如果双方都还活着）
+    if attacker.is_alive and defender.is_alive:
+        result = defender.attack(attacker)
+        if isinstance(result, tuple):
+            damage, is_special = result
+            exchanges.append((defender_key, defender.character_class, attacker_key,
+                              attacker.character_class, damage, is_special, False))
+            if is_special:
+                if defender.character_class == '战士':
+                    battle_log.append(f"💥 {defender.name} 发动暴击！造成 {damage} 点伤害！")
+                else:
+                    battle_log.append(f"🔥 {defender.name} 施放强力法术！造成 {damage} 点伤害！")
+            else:
+                battle_log.append(f"{defender.name} 反击 {attacker.name}，造成 {damage} 点伤害！")
+        else:
+            battle_log.append(f"{defender.name} 反击 {attacker.name}，造成 {result} 点伤害！")
+    
+    # 更新角色状态
+    characters.set_hp(owner, player1_name, player1.hp)
+    characters.set_hp(opponent_owner, player2_name, player2.hp)
+    if journal is not None:
+        journal.record_character_hp(key1, player1.hp)
+        journal.record_character_hp(key2, player2.hp)
+    
+    # 检查胜负（只在本回合分出胜负时更新积分，已经结束的战斗重复请求不计分）
+    # 胜者按位置记录：不同玩家的角色可以同名，只比较名字分不清是哪一方
+    winner = winner_side = None
+    if not player1.is_alive:
+        winner, winner_side = player2_name, 2
+        if p1_data['is_alive']:
+            ratings.record_result(key2, key1)
+    elif not player2.is_alive:
+        winner, winner_side = player1_name, 1
+        if p2_data['is_alive']:
+            ratings.record_result(key1, key2)
+    
+    if analytics is not None:
+        analytics.record_round('battle', exchanges, (None, key1, key2)[winner_side or 0])
+    
+    return {
+        'battle_log': battle_log,
+        'player1': player1.to_dict(),
+        'player2': player2.to_dict(),
+        'first_attacker': first_attacker,
+        'winner': winner,
+        'winner_side': winner_side
+    }
+
+
+def run_match(player1_key, player2_key):
+    """匹配成功后把战斗一直打到分出胜负，参数是 character_store.qualify 生成的全局key"""
+    owner1, player1_name = character_store.split_key(player1_key)
+    owner2, player2_name = character_store.split_key(player2_key)
+    rounds = 0
+    result = None
+    while rounds < MAX_MATCH_ROUNDS:
+        result = battle_round(player1_name, player2_name, owner1, owner2)
+        rounds += 1
+        if result is None or result['winner']:
+            break
+    winner = winner_owner = None
+    if result and result['winner']:
+        winner = result['winner']
+        winner_owner = (owner1, owner2)[result['winner_side'] - 1]
+    return {
+        'player1': player1_name,
+        'player2': player2_name,
+        'owners': [owner1, owner2],
+        'winner': winner,
+        'winner_owner': winner_owner,
+        'rounds': rounds,
+        'final': [result['player1'], result['player2']] if result else []
+    }
+
+
+MAX_MATCH_ROUNDS = 100
+
+# 匹配队列：按职业和当前HP分桶配对；定期放宽范围配出的对局在后台线程里打完
+matchmaker = matchmaking.MatchQueue(run_match, background=True)
+
+def duel_exchange(fighters):
+    """WebSocket对战的一回合：fighters 为 [(名字, 职业, HP), (名字, 职业, HP)]
+
+    和 /api/rpg/battle 一样随机决定先攻，先攻方攻击，对方存活则反击。
+    返回 (先攻方1/2, [[攻击方, 伤害, 是否暴击], ...], [HP1, HP2])
+    """
+    players = []
+    for name, character_class, hp in fighters:
+        player = Warrior(name) if character_class == '战士' else Mage(name)
+        player.hp = hp
+        players.append(player)
+    first = 0 if random.random() < 0.5 else 1
+    events = []
+    for index in (first, 1 - first):
+        result = players[index].attack(players[1 - index])
+        if isinstance(result, tuple):
+            damage, is_special = result
+            events.append([index + 1, damage, is_special])
+    if analytics is not None:
+        # 双方可以同名：先攻按出手顺序、胜者按位置确定，不比较名字
+        names = [name for name, _, _ in fighters]
+        winner = names[0] if players[1].hp <= 0 else names[1] if players[0].hp <= 0 else None
+        analytics.record_round('duel', [
+            (names[i - 1], players[i - 1].character_class, names[2 - i], players[2 - i].character_class,
+             damage, is_special, i - 1 == first) for i, damage, is_special in events], winner)
+    return first + 1, events, [players[0].hp, players[1].hp]
+
+
+# 按需创建的全局对象：WebSocket对战房间（所有连接由一个后台线程管理）、
+# 浏览器离线战斗的校验结果缓存和一次性种子
+_duel_hub = None
+_replay_cache = None
+_seed_issuer = None
+_lazy_lock = threading.Lock()
+
+
+def duel_hub():
+    global _duel_hub
+    with _lazy_lock:
+        if _duel_hub is None:
+            import duel_ws
+            _duel_hub = duel_ws.DuelHub(duel_exchange)
+        return _duel_hub
+
+
+def replay_cache():
+    global _replay_cache
+    with _lazy_lock:
+        if _replay_cache is None:
+            import offline_battle
+            _replay_cache = offline_battle.VerificationCache()
+        return _replay_cache
+
+
+def seed_issuer():
+    global _seed_issuer
+    with _lazy_lock:
+        if _seed_issuer is None:
+            import offline_battle
+            _seed_issuer = offline_battle.SeedIssuer()
+        return _seed_issuer
+
+
+def settle_offline_battle(pair, result):
+    """按服务器算出的结果结算一场离线战斗（pair 是 offline_battle.fighters() 的返回值）
+
+    双方都是已保存的角色、并且职业和HP还是发放种子时的数值，才把最终HP写回并更新积分；
+    浏览器本地的角色或者期间已经打过别的战斗的角色不受影响。
+    """
+    (key1, class1, hp1), (key2, class2, hp2) = pair
+    owner1, name1 = character_store.split_key(key1)
+    owner2, name2 = character_store.split_key(key2)
+    with characters.locked((owner1, name1), (owner2, name2)):
+        if (characters.get(owner1, name1) != (class1, hp1)
+                or characters.get(owner2, name2) != (class2, hp2)):
+            return
+        final1, final2 = result['hp']
+        characters.set_hp(owner1, name1, final1)
+        characters.set_hp(owner2, name2, final2)
+        if journal is not None:
+            journal.record_character_hp(key1, final1)
+            journal.record_character_hp(key2, final2)
+        if result['winner'] == 1:
+            ratings.record_result(key1, key2)
+        elif result['winner'] == 2:
+            ratings.record_result(key2, key1)
+
+
+# 限流和准入控制：每个客户端一个令牌桶，服务器过载时拒绝新请求
+limiter = rate_limit.TokenBucketLimiter()
+admission = rate_limit.AdmissionController(lambda: len(characters) + len(games))
+
+# 会新增游戏状态的接口，状态过多或内存不足时优先拒绝
+ALLOCATING_PATHS = ('/api/rpg/create_character', '/api/cave/init')
+
+# 支持 Idempotency-Key 的接口：重试时返回第一次的结果，不会重复打一回合或重复前进一步
+IDEMPOTENT_PATHS = ('/api/rpg/battle', '/api/cave/make_choice')
+idempotent_results = idempotency.IdempotencyCache(ttl=rate_limit.env_number('IDEMPOTENCY_TTL', 300))
+
+
+# 响应体超过这个大小并且客户端支持时才用gzip压缩，太小的响应压缩反而更慢
+GZIP_MIN_SIZE = 1024
+# 长连接空闲多少秒后关闭，避免空闲连接一直占用线程
+KEEP_ALIVE_TIMEOUT = 15
+
+# 页面路由：URL路径（不含查询参数） -> templates/ 下的文件
+PAGE_ROUTES = {
+    '/': 'simple_index.html',
+    '/index.html': 'simple_index.html',
+    '/rpg': 'simple_rpg.html',
+    '/rpg.html': 'simple_rpg.html',
+    '/cave': 'simple_cave.html',
+    '/cave.html': 'simple_cave.html',
+}
+# 除了页面路由和预构建资源，只有 public/ 目录下的文件可以直接访问（/xxx 对应 public/xxx）；
+# 其他路径（源代码、状态日志、快照、目录列表）一律 404
+PUBLIC_DIR = os.environ.get('PUBLIC_DIR', 'public')
+
+# build_static.py 生成的预构建页面，没有构建时为 None（直接读取 templates/）
+static_site = None
+# 最近发送过的静态文件保持打开，下次请求只需要 stat 一次
+fd_cache = static_files.FdCache(max_entries=128)
+
+
+def setup_static():
+    global static_site
+    static_dir = os.environ.get('STATIC_DIR', os.path.join('build', 'static'))
+    static_site = static_files.StaticSite.load(static_dir)
+    if static_site is not None:
+        print(f"📦 使用 {static_dir} 下的预构建页面")
 
 
 class GameHandler(http.server.SimpleHTTPRequestHandler):
+    # HTTP/1.1 长连接：一整局游戏可以复用同一个连接，每个响应都必须带 Content-Length
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEP_ALIVE_TIMEOUT
+    # 响应头和响应体分两次写入，关闭Nagle算法避免长连接上的40ms延迟
+    disable_nagle_algorithm = True
+    
     def do_GET(self):
-        if self.path == '/' or self.path == '/index.html':
-            self.serve_file('simple_index.html')
-        elif self.path == '/rpg' or self.path == '/rpg.html':
-            self.serve_file('simple_rpg.html')
-        elif self.path == '/cave' or self.path == '/cave.html':
-            self.serve_file('simple_cave.html')
+        found = static_site.lookup(self.path) if static_site is not None else None
+        url_path = urllib.parse.urlparse(self.path).path
+        if found is not None:
+            self.serve_static(*found)
+        elif url_path in PAGE_ROUTES:
+            self.serve_file(PAGE_ROUTES[url_path])
+        elif url_path == '/ws/duel':
+            self.upgrade_duel()
+        elif (self.path.startswith('/api/rpg/leaderboard') or self.path.startswith('/api/rpg/roster')
+              or self.path.startswith('/api/admin/')):
+            if not self.admit():
+                return
+            try:
+                if self.path.startswith('/api/admin/'):
+                    self.admin_request({})
+                elif self.path.startswith('/api/rpg/roster'):
+                    self.roster()
+                else:
+                    self.leaderboard()
+            except ValueError as e:
+                self.send_json_response({'error': str(e)}, 400)
+            finally:
+                admission.leave()
         else:
-            super().do_GET()
+            self.serve_path(url_path)
+    
+    # HEAD 和 GET 走同样的路由，发送响应时跳过响应体
+    do_HEAD = do_GET
+    
+    def handle_one_request(self):
+        # 等待下一个请求期间算作空闲，服务器关闭时空闲的长连接会被断开
+        if not self.server.set_idle(self.connection, True):
+            self.close_connection = True
+            return
+        try:
+            super().handle_one_request()
+        finally:
+            self.server.set_idle(self.connection, False)
+    
+    def parse_request(self):
+        # 已经读到请求行，这个请求要完整处理；服务器正在关闭时处理完就断开连接
+        self.server.set_idle(self.connection, False)
+        ok = super().parse_request()
+        if self.server.draining:
+            self.close_connection = True
+        return ok
     
     def do_POST(self):
         try:
             content_length = int(self.headers.get('Content-Length', 0))
-            if content_length > 0:
-                post_data = self.rfile.read(content_length)
-                data = json.loads(post_data.decode('utf-8'))
-            else:
-                data = {}
+        except ValueError:
+            self.send_error(400, "Bad Request - Invalid Content-Length")
+            return
+        # 先读完请求体再决定是否拒绝，保证连接上的数据完整
+        post_data = self.rfile.read(content_length) if content_length > 0 else b''
+        if not self.admit(self.path in ALLOCATING_PATHS):
+            return
+        
+        try:
+            data = json.loads(post_data.decode('utf-8')) if post_data else {}
             
             if self.path == '/api/rpg/create_character':
                 self.create_character(data)
             elif self.path == '/api/rpg/battle':
-                self.battle(data)
+                self.run_idempotent(self.battle, data, post_data)
+            elif self.path == '/api/rpg/odds':
+                self.battle_odds(data)
+            elif self.path == '/api/rpg/team_battle':
+                self.team_battle(data)
+            elif self.path == '/api/rpg/seed':
+                self.issue_seed(data)
+            elif self.path == '/api/rpg/verify':
+                self.verify_replay(data)
+            elif self.path == '/api/rpg/match/join':
+                self.match_join(data)
+            elif self.path == '/api/rpg/match/status':
+                self.match_status(data)
+            elif self.path == '/api/rpg/match/leave':
+                self.match_leave(data)
             elif self.path == '/api/cave/init':
                 self.init_cave_game()
             elif self.path == '/api/cave/make_choice':
-                self.make_cave_choice(data)
+                self.run_idempotent(self.make_cave_choice, data, post_data)
+            elif self.path.startswith('/api/admin/'):
+                self.admin_request(data)
             else:
                 self.send_error(404)
-        except (json.JSONDecodeError, ValueError) as e:
+        except json.JSONDecodeError as e:
             print(f"JSON decode error: {e}")
             self.send_error(400, "Bad Request - Invalid JSON")
+        except ValueError as e:
+            self.send_json_response({'error': str(e)}, 400)
         except Exception as e:
             print(f"Error in do_POST: {e}")
             self.send_error(500, "Internal Server Error")
+        finally:
+            admission.leave()
+    
+    def upgrade_duel(self):
+        """WebSocket握手，成功后把连接交给 duel_hub，这个线程随即结束"""
+        import duel_ws
+        headers = duel_ws.handshake_headers(self.headers)
+        if headers is None or self.command != 'GET':
+            self.send_json_response({'error': 'WebSocket upgrade required'}, 400)
+            return
+        if not self.admit(allocates=True):
+            return
+        admission.leave()
+        hub = duel_hub()
+        if len(hub) >= duel_ws.MAX_ROOMS:
+            self.send_json_response({'error': 'Too many duel rooms'}, 503)
+            return
+        self.send_response(101)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.flush()
+        self.close_connection = True
+        room, name, character_class = duel_ws.duel_params(urllib.parse.urlparse(self.path).query)
+        hub.adopt(duel_ws.detach_socket(self.connection), room, name, character_class)
+    
+    def admit(self, allocates=False):
+        """限流和准入检查，拒绝时直接返回 429/503 响应；通过后请求结束时要调用 admission.leave()"""
+        client = rate_limit.client_key(self.client_address[0], self.headers.get('X-Forwarded-For'))
+        allowed, retry_after = limiter.allow(client)
+        if not allowed:
+            self.send_json_response({'error': 'Too many requests'}, 429,
+                                    {'Retry-After': str(math.ceil(retry_after))})
+            return False
+        reason = admission.enter(allocates)
+        if reason is not None:
+            self.send_json_response({'error': reason}, 503, {'Retry-After': '1'})
+            return False
+        return True
     
     def do_OPTIONS(self):
         """处理CORS预检请求"""
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, X-Player-Id, Idempotency-Key, Authorization')
+        self.send_header('Content-Length', '0')
         self.end_headers()
     
     def serve_file(self, filename):
+        self.send_file(os.path.join('templates', filename), 'text/html; charset=utf-8')
+    
+    def serve_path(self, url_path):
+        """其他路径只发送 PUBLIC_DIR 下的文件，不列目录"""
+        path = static_files.public_path(PUBLIC_DIR, url_path)
+        if path is None:
+            self.send_error(404, "File not found")
+            return
+        content_type = self.guess_type(path)
+        if content_type.startswith('text/'):
+            content_type += '; charset=utf-8'
+        self.send_file(path, content_type)
+    
+    def serve_static(self, name, entry, immutable):
+        """发送预构建页面：按 Accept-Encoding 选择预压缩版本"""
+        path, encoding, etag = static_site.variant(name, self.headers.get('Accept-Encoding'))
+        headers = {
+            'Cache-Control': static_files.IMMUTABLE_CACHE if immutable else static_files.ROUTE_CACHE,
+            'Vary': 'Accept-Encoding',
+        }
+        if encoding:
+            headers['Content-Encoding'] = encoding
+        self.send_file(path, entry['content_type'], headers, etag)
+    
+    def send_file(self, path, content_type, headers=None, etag=None):
+        """发送文件：支持条件请求和单个 Range，文件内容用 sendfile 由内核直接发送"""
         try:
-            with open(f'templates/{filename}', 'r', encoding='utf-8') as f:
-                content = f.read()
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html; charset=utf-8')
+            handle = fd_cache.open(path)
+        except OSError:
+            self.send_error(404, "File not found")
+            return
+        with handle:
+            size = handle.size
+            etag = etag or handle.etag
+            headers = dict(headers or {})
+            headers['ETag'] = etag
+            headers['Last-Modified'] = self.date_time_string(handle.mtime)
+            headers['Accept-Ranges'] = 'bytes'
+            
+            if self.not_modified(etag, handle.mtime):
+                self.send_response(304)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                return
+            
+            # If-Range 和当前版本不一致时忽略 Range，发送完整的新文件
+            byte_range = None
+            if self.headers.get('If-Range', etag) == etag:
+                byte_range = static_files.parse_range(self.headers.get('Range'), size)
+            if byte_range is False:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            
+            start, end = byte_range or (0, size - 1)
+            if byte_range:
+                self.send_response(206)
+                headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+            else:
+                self.send_response(200)
+            self.send_header('Content-type', content_type)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.send_header('Content-Length', str(end - start + 1))
             self.end_headers()
-            self.wfile.write(content.encode('utf-8'))
-        except FileNotFoundError:
-            self.send_error(404)
+            if self.command == 'HEAD' or end < start:
+                return
+            if hasattr(os, 'sendfile'):
+                self.connection.sendfile(handle.file, start, end - start + 1)
+            else:
+                # 退回 seek+read 发送时，同一个文件对象一次只能给一个请求使用
+                with handle.lock:
+                    self.connection.sendfile(handle.file, start, end - start + 1)
+    
+    def not_modified(self, etag, mtime):
+        """If-None-Match 优先；没有时按 If-Modified-Since 比较修改时间"""
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return etag in tags or '*' in tags
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since is None:
+            return False
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since is None or since.tzinfo is None:
+            return False
+        return int(mtime) <= since.timestamp()
+    
+    def send_body(self, body, content_type, status=200, headers=None):
+        """发送完整响应，设置 Content-Length，较大的响应按客户端支持用gzip压缩"""
+        compressible = len(body) >= GZIP_MIN_SIZE
+        compress = compressible and static_files.accepts_encoding(self.headers.get('Accept-Encoding'), 'gzip')
+        if compress:
+            body = gzip.compress(body, compresslevel=5, mtime=0)
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if compressible:
+            self.send_header('Vary', 'Accept-Encoding')
+        if compress:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+    
+    def owner(self, data=None):
+        """请求所属的玩家ID：请求体里的 owner 字段或 X-Player-Id 头，都没有时为 public"""
+        owner = (data or {}).get('owner') or self.headers.get('X-Player-Id')
+        return character_store.normalize_owner(owner)
     
     def create_character(self, data):
-        name = data.get('name')
+        owner = self.owner(data)
+        name = character_store.normalize_name(data.get('name'))
         char_class = data.get('class')
         
         if char_class == 'warrior':
@@ -211,100 +902,311 @@ class GameHandler(http.server.SimpleHTTPRequestHandler):
             self.send_json_response({'error': 'Invalid character class'}, 400)
             return
         
-        characters[name] = character.to_dict()
+        key = character_store.qualify(owner, name)
+        with characters.locked((owner, name)):
+            characters.put(owner, name, character.character_class, character.hp)
+            if journal is not None:
+                journal.record_character_created(key, character.character_class, character.hp)
+        ratings.add(key)
         self.send_json_response(character.to_dict())
     
     def battle(self, data):
+        result = battle_round(data.get('player1'), data.get('player2'), self.owner(data))
+        if result is None:
+            self.send_json_response({'error': 'Character not found'}, 400)
+            return
+        self.send_json_response(result)
+    
+    def battle_odds(self, data):
+        """预测胜率：传入两个已有角色的名字，或者直接传入职业和HP"""
         player1_name = data.get('player1')
         player2_name = data.get('player2')
         
-        if player1_name not in characters or player2_name not in characters:
-            self.send_json_response({'error': 'Character not found'}, 400)
+        if player1_name is not None or player2_name is not None:
+            owner = self.owner(data)
+            p1_data = get_character(owner, player1_name)
+            p2_data = get_character(owner, player2_name)
+            if p1_data is None or p2_data is None:
+                self.send_json_response({'error': 'Character not found'}, 400)
+                return
+            args = (p1_data['character_class'], p1_data['hp'],
+                    p2_data['character_class'], p2_data['hp'])
+        else:
+            args = (data.get('class1'), data.get('hp1'), data.get('class2'), data.get('hp2'))
+        
+        try:
+            result = battle_oracle.odds(*args)
+        except (TypeError, ValueError) as e:
+            self.send_json_response({'error': str(e)}, 400)
+            return
+        self.send_json_response(result)
+    
+    def issue_seed(self, data):
+        """为两个参战角色发放离线战斗的一次性种子；已保存的角色按服务器上的职业和HP参战"""
+        import offline_battle
+        owner = self.owner(data)
+        try:
+            offline_battle.settle_expired(replay_cache(), seed_issuer(), settle_offline_battle)
+            pair = offline_battle.fighters(data, owner, lambda name: characters.get(owner, name))
+            issued = seed_issuer().issue(pair)
+        except ValueError as e:
+            self.send_json_response({'error': str(e)}, 400)
             return
+        issued.update(offline_battle.fighters_json(pair))
+        self.send_json_response(issued)
+    
+    def verify_replay(self, data):
+        """校验浏览器离线打完的战斗：只上传服务器发的种子、参战角色和结果，服务器重算比较并结算"""
+        try:
+            import offline_battle
+            offline_battle.settle_expired(replay_cache(), seed_issuer(), settle_offline_battle)
+            result = offline_battle.verify_claim(data, replay_cache(), seed_issuer(),
+                                                 self.owner(data), settle_offline_battle)
+        except ValueError as e:
+            self.send_json_response({'error': str(e)}, 400)
+            return
+        self.send_json_response(result)
+    
+    def team_battle(self, data):
+        """团队战斗：队员可以是已有角色的名字，也可以是 {"class": "warrior", "hp": 100}"""
+        owner = self.owner(data)
+        # 整场战斗期间锁住所有参战的已有角色
+        named = [member for key in ('team1', 'team2') for member in data.get(key) or []
+                 if isinstance(member, str)]
+        with characters.locked(*((owner, name) for name in named)):
+            self.run_team_battle(data, owner)
+    
+    def run_team_battle(self, data, owner):
+        rosters = []
+        named = []
+        for key in ('team1', 'team2'):
+            roster = []
+            for member in data.get(key) or []:
+                if isinstance(member, str):
+                    record = characters.get(owner, member)
+                    if record is None:
+                        self.send_json_response({'error': f'Character not found: {member}'}, 400)
+                        return
+                    if any(name == member for _, name in named):
+                        self.send_json_response({'error': f'Duplicate team member: {member}'}, 400)
+                        return
+                    # 记录这个角色在参战者数组里的位置，战斗结束后写回HP
+                    named.append((sum(len(r) for r in rosters) + len(roster), member))
+                    roster.append(record)
+                elif isinstance(member, dict):
+                    roster.append((member.get('class'), member.get('hp')))
+                else:
+                    self.send_json_response({'error': 'Invalid team member'}, 400)
+                    return
+            rosters.append(roster)
         
-        # 重新创建角色对象
-        p1_data = characters[player1_name]
-        p2_data = characters[player2_name]
+        import team_battle
+        try:
+            result = team_battle.resolve_team_battle(
+                rosters[0], rosters[1],
+                policy=data.get('policy', 'random'),
+                mode=data.get('mode', 'simultaneous'))
+        except (TypeError, ValueError) as e:
+            self.send_json_response({'error': str(e)}, 400)
+            return
         
-        if p1_data['character_class'] == '战士':
-            player1 = Warrior(p1_data['name'])
-        else:
-            player1 = Mage(p1_data['name'])
+        # 已有角色的HP写回
+        for index, name in named:
+            characters.set_hp(owner, name, result['hp'][index])
+            if journal is not None:
+                journal.record_character_hp(character_store.qualify(owner, name), result['hp'][index])
+        self.send_json_response(result)
+    
+    def match_join(self, data):
+        owner = self.owner(data)
+        name = data.get('name')
+        character = get_character(owner, name)
+        if character is None:
+            self.send_json_response({'error': 'Character not found'}, 400)
+            return
+        if not character['is_alive']:
+            self.send_json_response({'error': 'Character is dead'}, 400)
+            return
         
-        if p2_data['character_class'] == '战士':
-            player2 = Warrior(p2_data['name'])
+        key = character_store.qualify(owner, name)
+        result = matchmaker.enqueue(key, character['character_class'], character['hp'])
+        if result is None:
+            self.send_json_response({'status': 'waiting'})
         else:
-            player2 = Mage(p2_data['name'])
-        
-        # 恢复HP状态
-        player1.hp = p1_data['hp']
-        player1.is_alive = p1_data['is_alive']
-        player2.hp = p2_data['hp']
-        player2.is_alive = p2_data['is_alive']
-        
-        # 随机决定攻击顺序
-        if random.random() < 0.5:
-            attacker, defender = player1, player2
-            first_attacker = player1_name
+            self.send_json_response({'status': 'matched', 'match': result})
+    
+    def match_status(self, data):
+        key = character_store.qualify(self.owner(data), data.get('name'))
+        if matchmaker.is_waiting(key):
+            self.send_json_response({'status': 'waiting'})
+            return
+        result = matchmaker.result(key)
+        if result is None:
+            self.send_json_response({'status': 'idle'})
         else:
-            attacker, defender = player2, player1
-            first_attacker = player2_name
-        
-        battle_log = []
-        
-        # 第一轮攻击
-        if attacker.is_alive and defender.is_alive:
-            result = attacker.attack(defender)
-            if isinstance(result, tuple):
-                damage, is_special = result
-                if is_special:
-                    if attacker.character_class == '战士':
-                        battle_log.append(f"💥 {attacker.name} 发动暴击！造成 {damage} 点伤害！")
-                    else:
-                        battle_log.append(f"🔥 {attacker.name} 施放强力法术！造成 {damage} 点伤害！")
-                else:
-                    battle_log.append(f"{attacker.name} 攻击 {defender.name}，造成 {damage} 点伤害！")
-            else:
-                battle_log.append(f"{attacker.name} 攻击 {defender.name}，造成 {result} 点伤害！")
+            self.send_json_response({'status': 'matched', 'match': result})
+    
+    def match_leave(self, data):
+        left = matchmaker.leave(character_store.qualify(self.owner(data), data.get('name')))
+        self.send_json_response({'status': 'left' if left else 'idle'})
+    
+    def leaderboard(self):
+        """排行榜：?top=10 前K名，?start=11 翻页，?name=xxx&around=2 查某个角色附近的排名"""
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        try:
+            count = min(int(query.get('top', ['10'])[0]), 100)
+            start = max(int(query.get('start', ['1'])[0]), 1)
+            radius = min(int(query.get('around', ['2'])[0]), 50)
+        except ValueError:
+            self.send_json_response({'error': 'Invalid query'}, 400)
+            return
         
-        # 第二轮攻击（如果双方都还活着）
-        if attacker.is_alive and defender.is_alive:
-            result = defender.attack(attacker)
-            if isinstance(result, tuple):
-                damage, is_special = result
-                if is_special:
-                    if defender.character_class == '战士':
-                        battle_log.append(f"💥 {defender.name} 发动暴击！造成 {damage} 点伤害！")
-                    else:
-                        battle_log.append(f"🔥 {defender.name} 施放强力法术！造成 {damage} 点伤害！")
-                else:
-                    battle_log.append(f"{defender.name} 反击 {attacker.name}，造成 {damage} 点伤害！")
-            else:
-                battle_log.append(f"{defender.name} 反击 {attacker.name}，造成 {result} 点伤害！")
+        response = {'total': len(ratings), 'top': self.with_owners(ratings.top(count, start))}
+        name = query.get('name', [None])[0]
+        if name is not None:
+            key = character_store.qualify(self.owner({'owner': query.get('owner', [None])[0]}), name)
+            response['rank'] = ratings.rank(key)
+            response['around'] = self.with_owners(ratings.around(key, radius))
+        self.send_json_response(response)
+    
+    def with_owners(self, entries):
+        """排行榜里的key拆成玩家ID和角色名"""
+        for entry in entries:
+            entry['owner'], entry['name'] = character_store.split_key(entry['name'])
+        return entries
+    
+    def roster(self):
+        """列出玩家自己的角色：?start=0&count=50 翻页，玩家ID来自 X-Player-Id 头或 ?owner="""
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        try:
+            start = max(int(query.get('start', ['0'])[0]), 0)
+            count = min(max(int(query.get('count', ['50'])[0]), 0), 200)
+        except ValueError:
+            self.send_json_response({'error': 'Invalid query'}, 400)
+            return
         
-        # 更新角色状态
-        characters[player1_name] = player1.to_dict()
-        characters[player2_name] = player2.to_dict()
+        owner = self.owner({'owner': query.get('owner', [None])[0]})
+        self.send_json_response({
+            'owner': owner,
+            'total': characters.roster_size(owner),
+            'start': start,
+            'characters': [restore_character(name, character_class, hp)
+                           for name, character_class, hp in characters.roster(owner, start, count)]
+        })
+    
+    def admin_request(self, data):
+        """管理接口：需要 ADMIN_TOKEN 环境变量，请求带 Authorization: Bearer <token>；没有配置时接口不存在"""
+        import hmac
+        token = os.environ.get('ADMIN_TOKEN')
+        if not token:
+            self.send_json_response({'error': 'Not found'}, 404)
+            return
+        supplied = self.headers.get('Authorization', '')
+        if not hmac.compare_digest(supplied.encode('utf-8'), f'Bearer {token}'.encode('utf-8')):
+            self.send_json_response({'error': 'Unauthorized'}, 401, {'WWW-Authenticate': 'Bearer'})
+            return
         
-        # 检查胜负
-        winner = None
-        if not player1.is_alive:
-            winner = player2_name
-        elif not player2.is_alive:
-            winner = player1_name
+        route = (self.command, urllib.parse.urlparse(self.path).path)
+        if route == ('GET', '/api/admin/snapshots'):
+            self.send_json_response({'snapshots': snapshots.list()})
+        elif route == ('GET', '/api/admin/stats'):
+            self.admin_stats()
+        elif route == ('GET', '/api/admin/characters'):
+            self.admin_characters()
+        elif route == ('GET', '/api/admin/games'):
+            self.admin_games()
+        elif route == ('POST', '/api/admin/snapshot'):
+            self.send_json_response(snapshots.create(), 202)
+        elif route == ('POST', '/api/admin/restore'):
+            self.admin_restore(data)
+        else:
+            self.send_json_response({'error': 'Not found'}, 404)
+    
+    def admin_stats(self):
+        """角色按职业、存活状态统计，洞穴游戏按状态统计（只汇总索引的桶大小）"""
+        by_class = {}
+        alive = 0
+        for (character_class, hp), size in characters.index.counts().items():
+            by_class[character_class] = by_class.get(character_class, 0) + size
+            if hp > 0:
+                alive += size
+        self.send_json_response({
+            'characters': {'total': len(characters), 'alive': alive, 'dead': len(characters) - alive,
+                           'by_class': by_class},
+            'games': {'total': len(games), 'by_state': game_states.counts()},
+        })
+    
+    def admin_query(self):
+        """管理接口的查询参数，返回 (参数字典, start, count)；参数不合法时抛出 ValueError"""
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        params = {key: values[0] for key, values in query.items()}
+        start = max(int(params.pop('start', 0)), 0)
+        count = min(max(int(params.pop('count', 50)), 0), 200)
+        return params, start, count
+    
+    def admin_characters(self):
+        """?class=warrior&min_hp=1&max_hp=50&alive=true&start=0&count=50，count=0 时只返回总数"""
+        try:
+            params, start, count = self.admin_query()
+            character_class = params.get('class')
+            if character_class is not None:
+                character_class = battle_oracle.normalize_class(character_class)
+            min_hp = int(params['min_hp']) if 'min_hp' in params else None
+            max_hp = int(params['max_hp']) if 'max_hp' in params else None
+            alive = params.get('alive')
+            if alive is not None:
+                if alive not in ('true', 'false'):
+                    raise ValueError(alive)
+                alive = alive == 'true'
+        except ValueError:
+            self.send_json_response({'error': 'Invalid query'}, 400)
+            return
         
+        total, entries = characters.query(character_class, min_hp, max_hp, alive, start, count)
         self.send_json_response({
-            'battle_log': battle_log,
-            'player1': player1.to_dict(),
-            'player2': player2.to_dict(),
-            'first_attacker': first_attacker,
-            'winner': winner
+            'total': total,
+            'start': start,
+            'characters': [dict(restore_character(name, character_class, hp), owner=owner)
+                           for owner, name, character_class, hp in entries]
         })
     
+    def admin_games(self):
+        """?state=room&start=0&count=50，count=0 时只返回总数"""
+        try:
+            params, start, count = self.admin_query()
+        except ValueError:
+            self.send_json_response({'error': 'Invalid query'}, 400)
+            return
+        
+        state = params.get('state')
+        match = None if state is None else (lambda bucket: bucket == state)
+        total, entries = game_states.page(match, start, count)
+        response_games = []
+        for game_id, _ in entries:
+            game = games.get(game_id)
+            if game is not None:
+                response_games.append({'game_id': game_id, 'state': game.state,
+                                       'previous_choice': game.previous_choice})
+        self.send_json_response({'total': total, 'start': start, 'games': response_games})
+    
+    def admin_restore(self, data):
+        """回滚到某个快照；回滚前先给当前状态拍一个快照，回滚错了还能再回来"""
+        try:
+            state = snapshots.load(data.get('name'))
+        except FileNotFoundError:
+            self.send_json_response({'error': 'Snapshot not found'}, 404)
+            return
+        backup = snapshots.create()
+        count = replace_state(*state)
+        self.send_json_response({'characters': count[0], 'games': count[1], 'backup': backup['name']})
+    
     def init_cave_game(self):
         game = CaveGame()
-        game_id = str(datetime.now().timestamp())
+        game_id = new_game_id()
         games[game_id] = game
+        game_states.add(game_id, game.state)
+        if journal is not None:
+            journal.record_cave_state(game_id, game.state, game.previous_choice)
         self.send_json_response({
             'state': game.state,
             'message': game.message,
@@ -322,36 +1224,143 @@ class GameHandler(http.server.SimpleHTTPRequestHandler):
             return
         
         game = games[game_id]
-        game.make_choice(choice)
+        with characters.locks.hold(('cave', game_id)):
+            previous_state = game.state
+            game.make_choice(choice)
+            game_states.move(game_id, previous_state, game.state)
+            if journal is not None:
+                journal.record_cave_state(game_id, game.state, game.previous_choice)
+            response = {
+                'state': game.state,
+                'message': game.message,
+                'choices': game.choices,
+                'previous_choice': game.previous_choice
+            }
         
-        self.send_json_response({
-            'state': game.state,
-            'message': game.message,
-            'choices': game.choices,
-            'previous_choice': game.previous_choice
-        })
+        self.send_json_response(response)
     
-    def send_json_response(self, data, status=200):
-        self.send_response(status)
-        self.send_header('Content-type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.end_headers()
-        self.wfile.write(json.dumps(data, ensure_ascii=False).encode('utf-8'))
+    def run_idempotent(self, handle, data, body):
+        """带 Idempotency-Key 时，handle 发出的响应先记录下来再发送，重复的请求直接返回记录的响应"""
+        key = idempotency.validate_key(self.headers.get(idempotency.HEADER))
+        if key is None:
+            handle(data)
+            return
+        
+        def compute():
+            self._captured = []
+            try:
+                handle(data)
+                return self._captured[0]
+            finally:
+                self._captured = None
+        
+        try:
+            (payload, status, headers), replayed = idempotent_results.run(
+                (self.owner(data), self.path, key), idempotency.fingerprint(self.path, body), compute)
+        except idempotency.KeyReused as e:
+            self.send_json_response({'error': str(e)}, 422)
+            return
+        except idempotency.StillRunning as e:
+            self.send_json_response({'error': str(e)}, 409, {'Retry-After': '1'})
+            return
+        if replayed:
+            headers = dict(headers or {}, **{idempotency.REPLAYED_HEADER: 'true'})
+        self.send_json_response(payload, status, headers)
+    
+    # run_idempotent 执行期间不为 None，send_json_response 把响应记在这里而不是发送
+    _captured = None
+    
+    def send_json_response(self, data, status=200, headers=None):
+        if self._captured is not None:
+            self._captured.append((data, status, headers))
+            return
+        headers = dict(headers or {})
+        headers['Access-Control-Allow-Origin'] = '*'
+        headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
+        headers['Access-Control-Allow-Headers'] = 'Content-Type, X-Player-Id, Idempotency-Key, Authorization'
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_body(body, 'application/json', status, headers)
+
+
+class GameServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    # 每个连接一个线程，慢客户端不会阻塞其他请求；修改角色的地方由分段锁保护。
+    # 关闭时等待处理中的请求写完响应，空闲的长连接直接断开
+    daemon_threads = False
+    block_on_close = True
+    # 重启后立即重新绑定端口，不必等待旧连接的 TIME_WAIT 结束
+    allow_reuse_address = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.draining = False
+        self._idle = set()
+        self._idle_lock = threading.Lock()
+
+    def set_idle(self, connection, idle):
+        """长连接在等待下一个请求时登记为空闲；正在关闭时返回 False，连接不应再等待"""
+        with self._idle_lock:
+            if not idle:
+                self._idle.discard(connection)
+                return True
+            if self.draining:
+                return False
+            self._idle.add(connection)
+            return True
+
+    def service_actions(self):
+        # 接收循环每次接受连接或轮询超时都会调用，在这里给等待较久的玩家放宽匹配范围。
+        # sweep 只配对，每次最多配出 max_pairs 对，对局交给后台线程打完，不会拖慢接受新连接；
+        # 对局和请求线程同时修改角色，靠 battle_round 里的分段锁保证不丢更新
+        matchmaker.sweep()
+
+    def server_close(self):
+        with self._idle_lock:
+            self.draining = True
+            idle, self._idle = self._idle, set()
+        for connection in idle:
+            try:
+                # 唤醒阻塞在读请求行上的线程，它读到EOF后结束连接
+                connection.shutdown(socket.SHUT_RD)
+            except OSError:
+                pass
+        super().server_close()  # 等待所有连接线程结束
+        matchmaker.close()  # 后台正在打的对局也写完日志再关闭持久化
+        close_persistence()
+        close_analytics()
+
+
+def make_server(port=8000):
+    """恢复状态、打开快照和数据分析，创建HTTP服务器"""
+    setup_persistence()
+    setup_snapshots()
+    setup_analytics()
+    setup_static()
+    return GameServer(("", port), GameHandler)
+
+
+def print_banner(port):
+    print(f"🎮 游戏服务器启动成功！")
+    print(f"📍 访问地址: http://localhost:{port}")
+    print(f"🎯 游戏列表:")
+    print(f"   - 首页: http://localhost:{port}")
+    print(f"   - RPG战斗: http://localhost:{port}/rpg")
+    print(f"   - 洞穴探险: http://localhost:{port}/cave")
+    print(f"⏹️  按 Ctrl+C 停止服务器")
 
 
 def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='简单Web游戏服务器')
+    parser.add_argument('--load-snapshot', metavar='FILE',
+                        help='启动时加载快照（state_snapshot.py 生成的文件），用于离线重放或A/B测试')
+    args = parser.parse_args()
+
     PORT = int(os.environ.get('PORT', 8000))
-    
-    with socketserver.TCPServer(("", PORT), GameHandler) as httpd:
-        print(f"🎮 游戏服务器启动成功！")
-        print(f"📍 访问地址: http://localhost:{PORT}")
-        print(f"🎯 游戏列表:")
-        print(f"   - 首页: http://localhost:{PORT}")
-        print(f"   - RPG战斗: http://localhost:{PORT}/rpg")
-        print(f"   - 洞穴探险: http://localhost:{PORT}/cave")
-        print(f"⏹️  按 Ctrl+C 停止服务器")
+    if args.load_snapshot:
+        os.environ['LOAD_SNAPSHOT'] = args.load_snapshot
+
+    with make_server(port=PORT) as httpd:
+        print_banner(PORT)
         
         try:
             httpd.serve_forever()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+启动时间预算 - 用 python -X importtime 测量各个服务入口的导入耗时，超出预算时返回非0
+
+    python startup_budget.py                   # 检查全部入口
+    python startup_budget.py --precompile      # 先生成 .pyc 再测量（和部署时预编译的效果一致）
+    python startup_budget.py --only api.index --runs 9
+
+每个入口在新的解释器里单独导入若干次，取最小值（受系统负载影响最小），
+和 BUDGETS 里的毫秒数比较。CI 机器较慢时可以用 STARTUP_BUDGET_SCALE=2 放宽所有预算。
+
+除了耗时，还检查两件和机器速度无关的事：
+    - 导入时不应该启动线程（导入不能有副作用，serverless 冷启动时尤其重要）
+    - 导入时不应该加载 LAZY_MODULES 里列出的模块（这些模块只在少数请求里用到）
+超出预算时会列出最慢的几个导入，方便找到是哪个模块变慢了。
+"""
+
+import argparse
+import compileall
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# 入口模块 -> 导入耗时预算（毫秒）
+BUDGETS = {
+    'simple_web_games': 120,
+    'api.index': 50,
+    'app': 300,
+    '20linegame': 20,
+}
+
+# 入口模块导入时不应该出现的模块
+LAZY_MODULES = {
+    'simple_web_games': ('argparse', 'duel_ws', 'offline_battle', 'team_battle', 'battle_analytics'),
+    'api.index': ('http.server', 'offline_battle', 'persistence'),
+    'app': ('uuid', 'duel_ws'),
+}
+
+# 在子进程里执行：导入入口模块，报告线程数和已加载的模块
+# （用 __import__ 而不是 importlib.import_module，后者不会出现在 -X importtime 的输出里；
+#   json 和 threading 放在后面导入，不算进入口模块之外的耗时）
+PROBE = """
+import sys
+sys.path.insert(0, {root!r})
+__import__({module!r})
+import json, threading
+print(json.dumps({{'threads': threading.active_count(), 'modules': sorted(sys.modules)}}))
+"""
+
+
+def parse_importtime(stderr):
+    """解析 -X importtime 的输出，返回 {模块名: 包含子模块的累计耗时（微秒）}"""
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3:
+            continue
+        try:
+            cumulative = int(parts[1])
+        except ValueError:
+            continue  # 表头
+        times[parts[2].strip()] = cumulative
+    return times
+
+
+def probe(module, env=None):
+    """在新的解释器里导入一次，返回 (importtime 结果, 线程数, 已加载的模块)"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE.format(root=ROOT, module=module)],
+        capture_output=True, text=True, cwd=ROOT, env=env)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'import failed')
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    return parse_importtime(result.stderr), report['threads'], set(report['modules'])
+
+
+def is_available(module):
+    """app.py 依赖 Flask，没有安装时跳过"""
+    if module == 'app':
+        return importlib.util.find_spec('flask') is not None
+    return True
+
+
+def check(module, budget_ms, runs, env=None, top=5):
+    """返回 (是否通过, 说明文字)"""
+    best = None
+    problems = []
+    for _ in range(runs):
+        times, threads, modules = probe(module, env)
+        total = times.get(module, 0) / 1000
+        if best is None or total < best[0]:
+            best = (total, times)
+    total, times = best
+
+    if threads != 1:
+        problems.append(f'导入时启动了 {threads - 1} 个线程')
+    loaded = [name for name in LAZY_MODULES.get(module, ()) if name in modules]
+    if loaded:
+        problems.append(f"导入时加载了应该延迟导入的模块: {', '.join(loaded)}")
+    if total > budget_ms:
+        slowest = sorted(((t, name) for name, t in times.items() if name != module), reverse=True)[:top]
+        detail = ', '.join(f'{name} {t / 1000:.1f}ms' for t, name in slowest)
+        problems.append(f'超出预算 {total - budget_ms:.1f}ms（最慢: {detail}）')
+
+    status = f'{module:<18} {total:7.1f}ms / {budget_ms:.0f}ms'
+    if problems:
+        return False, f'❌ {status}  ' + '；'.join(problems)
+    return True, f'✅ {status}'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='检查服务入口的导入耗时')
+    parser.add_argument('--runs', type=int, default=5, help='每个入口测量的次数，取最小值')
+    parser.add_argument('--only', action='append', choices=sorted(BUDGETS), help='只检查指定入口（可重复）')
+    parser.add_argument('--precompile', action='store_true', help='测量前先把所有模块编译成 .pyc')
+    args = parser.parse_args(argv)
+
+    if args.precompile:
+        compileall.compile_dir(ROOT, quiet=1, workers=0)
+    scale = float(os.environ.get('STARTUP_BUDGET_SCALE') or 1)
+    # 测量时不启用持久化和数据分析，这两项本来就会在启动时读写磁盘
+    env = {key: value for key, value in os.environ.items() if key not in ('GAME_STATE_DIR', 'ANALYTICS_DIR')}
+
+    ok = True
+    for module in args.only or BUDGETS:
+        if not is_available(module):
+            print(f'⏭️  {module:<18} 缺少依赖，跳过')
+            continue
+        try:
+            passed, message = check(module, BUDGETS[module] * scale, args.runs, env)
+        except RuntimeError as e:
+            passed, message = False, f'❌ {module:<18} 导入失败: {e}'
+        ok = ok and passed
+        print(message)
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
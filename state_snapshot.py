@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+运行中状态的快照 - 不暂停服务，把全部角色和洞穴游戏保存成某一时刻的副本
+
+生成快照时 fork 一个子进程：子进程拿到的是 fork 那一刻内存的写时复制副本，
+由它慢慢遍历并写文件，父进程只付出 fork 本身的时间（复制页表，百万级角色约几毫秒），
+之后继续处理请求，修改的内存页由内核按需复制，不影响子进程看到的内容。
+服务器是多线程的：fork 前先拿到 hold() 给出的全部锁（角色的分段锁、存储和索引的锁），
+fork 后父子进程各自释放，子进程里不会有被其他线程持有、永远不会释放的锁，快照里也没有改到一半的战斗。
+子进程超过 timeout 秒还没写完就被杀掉，任务记为失败。
+不支持 fork 的平台退回到在后台线程里复制状态再写文件。
+
+文件格式和 persistence.py 的 state.snap 相同（紧凑的二进制记录），所以：
+    - 可以直接复制成 GAME_STATE_DIR/state.snap 作为另一个服务器的初始状态
+    - python simple_web_games.py --load-snapshot <文件> 在另一个进程里加载，用来离线重放或A/B测试
+    - 管理接口可以把运行中的服务器回滚到某个快照
+
+查看快照：
+    python state_snapshot.py info snapshots/snapshot-20240501-120000.000.snap
+    python state_snapshot.py dump snapshots/xxx.snap --limit 20
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import signal
+import sys
+import threading
+import time
+
+import persistence
+
+SNAPSHOT_SUFFIX = '.snap'
+
+
+def snapshot_name():
+    """按时间命名（精确到毫秒），文件名排序即时间顺序"""
+    now = time.time()
+    stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(now))
+    return f'snapshot-{stamp}.{int(now * 1000) % 1000:03d}{SNAPSHOT_SUFFIX}'
+
+
+def safe_path(directory, name):
+    """快照名只能是目录下的文件名，防止管理接口读写其他路径"""
+    if not name or os.path.basename(name) != name or not name.endswith(SNAPSHOT_SUFFIX):
+        raise ValueError('Invalid snapshot name')
+    return os.path.join(directory, name)
+
+
+class Snapshotter:
+    """管理一个目录下的快照：创建（fork 写时复制）、列出、读取
+
+    get_state() 返回 (characters, games)，格式和 persistence.write_snapshot 的参数相同；
+    fork 模式下它在子进程里调用，遍历的是 fork 那一刻的内存副本。
+    hold() 返回一个上下文管理器，持有 get_state() 会用到的全部锁，只在 fork 的那一刻持有。
+    """
+
+    def __init__(self, directory, get_state, hold=None, timeout=600):
+        self.directory = directory
+        self.get_state = get_state
+        self.hold = hold or contextlib.nullcontext
+        self.timeout = timeout
+        self.jobs = {}  # 快照名 -> 'running' / 'done' / 'failed'
+        self._lock = threading.Lock()
+
+    def create(self):
+        """开始生成快照，立即返回 {'name', 'pid', 'pause_ms'}；写文件在子进程或后台线程里完成"""
+        os.makedirs(self.directory, exist_ok=True)
+        name = snapshot_name()
+        path = os.path.join(self.directory, name)
+        with self._lock:
+            self.jobs[name] = 'running'
+
+        if not hasattr(os, 'fork'):
+            started = time.perf_counter()
+            thread = threading.Thread(target=self._write_in_thread, args=(name, path), daemon=True)
+            thread.start()
+            return {'name': name, 'pid': None, 'pause_ms': (time.perf_counter() - started) * 1000}
+
+        started = time.perf_counter()
+        with self.hold():
+            pid = os.fork()
+        if pid == 0:
+            # 子进程：只做写文件这一件事，然后直接退出（不执行父进程的清理代码、不刷新父进程的缓冲区）
+            code = 0
+            try:
+                characters, games = self.get_state()
+                persistence.write_snapshot(path, characters, games)
+            except BaseException:
+                code = 1
+            finally:
+                os._exit(code)
+        pause_ms = (time.perf_counter() - started) * 1000
+        threading.Thread(target=self._reap, args=(name, path, pid), daemon=True).start()
+        return {'name': name, 'pid': pid, 'pause_ms': pause_ms}
+
+    def _write_in_thread(self, name, path):
+        try:
+            characters, games = self.get_state()
+            persistence.write_snapshot(path, characters, games)
+        except Exception as e:
+            print(f"⚠️  快照 {name} 写入失败: {e}", file=sys.stderr)
+            self._finish(name, 'failed')
+        else:
+            self._finish(name, 'done')
+
+    def _reap(self, name, path, pid):
+        """等子进程结束；超时就杀掉它并删掉写了一半的临时文件"""
+        deadline = time.monotonic() + self.timeout
+        delay = 0.01
+        while True:
+            finished, status = os.waitpid(pid, os.WNOHANG)
+            if finished:
+                break
+            if time.monotonic() >= deadline:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+                print(f"⚠️  快照 {name} 超过 {self.timeout} 秒没有写完，已终止", file=sys.stderr)
+                try:
+                    os.remove(path + '.tmp')
+                except OSError:
+                    pass
+                self._finish(name, 'failed')
+                return
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+        self._finish(name, 'done' if os.waitstatus_to_exitcode(status) == 0 else 'failed')
+
+    def _finish(self, name, status):
+        with self._lock:
+            self.jobs[name] = status
+
+    def list(self):
+        """目录下已经写完的快照，以及正在生成或失败的任务"""
+        entries = []
+        try:
+            names = sorted(os.listdir(self.directory))
+        except FileNotFoundError:
+            names = []
+        with self._lock:
+            jobs = dict(self.jobs)
+        for name in names:
+            if not name.endswith(SNAPSHOT_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            entries.append({'name': name, 'size': os.path.getsize(path), 'status': jobs.pop(name, 'done')})
+        entries.extend({'name': name, 'size': None, 'status': status} for name, status in sorted(jobs.items())
+                       if status != 'done')
+        return entries
+
+    def load(self, name):
+        """读取目录下的一个快照，返回 (characters, games)"""
+        return persistence.load_snapshot(safe_path(self.directory, name))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='查看运行中状态的快照文件')
+    sub = parser.add_subparsers(dest='command', required=True)
+    info = sub.add_parser('info', help='统计快照里的角色和游戏')
+    info.add_argument('path')
+    dump = sub.add_parser('dump', help='以JSON Lines输出快照内容')
+    dump.add_argument('path')
+    dump.add_argument('--limit', type=int, default=None, help='最多输出的条数')
+    args = parser.parse_args(argv)
+
+    try:
+        characters, games = persistence.load_snapshot(args.path)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+
+    if args.command == 'info':
+        classes = {}
+        alive = 0
+        for character_class, hp in characters.values():
+            classes[character_class] = classes.get(character_class, 0) + 1
+            alive += hp > 0
+        states = {}
+        for state, _ in games.values():
+            states[state] = states.get(state, 0) + 1
+        print(json.dumps({'characters': len(characters), 'alive': alive, 'classes': classes,
+                          'games': len(games), 'game_states': states}, ensure_ascii=False, indent=2))
+        return 0
+
+    records = ([{'character': key, 'class': c, 'hp': hp} for key, (c, hp) in characters.items()]
+               + [{'game': game_id, 'state': s, 'previous_choice': p} for game_id, (s, p) in games.items()])
+    for record in records[:args.limit]:
+        print(json.dumps(record, ensure_ascii=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+静态文件 - 预构建页面的 manifest、打开文件的缓存和 Range 请求
+
+manifest 由 build_static.py 生成，记录每个路由对应的带内容哈希的文件名，
+以及预先压缩好的 .br/.gz 版本。服务器按 Accept-Encoding 选一个版本，
+直接把文件交给内核发送（sendfile），请求路径上不再读模板、不再压缩。
+
+FdCache 缓存最近用到的已打开文件，每次请求只需要一次 stat 检查文件是否变化，
+不用重新 open；文件内容不经过 Python 的缓冲区。
+"""
+
+import json
+import os
+import stat
+import threading
+import urllib.parse
+from collections import OrderedDict
+
+MANIFEST_NAME = 'manifest.json'
+STATIC_PREFIX = '/static/'
+
+# 按优先顺序排列的预压缩格式：(Content-Encoding, 文件后缀)
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# 带哈希的文件名内容永远不变，可以让浏览器和CDN缓存一年；
+# 路由（/rpg 等）对应的内容会随构建变化，每次用 ETag 向服务器确认
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+ROUTE_CACHE = 'no-cache'
+
+
+def accepts_encoding(accept_encoding, coding):
+    """Accept-Encoding 是否允许某种压缩格式（q=0 表示明确拒绝）"""
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.partition(';')
+        if name.strip().lower() in (coding, '*'):
+            try:
+                return float(params.replace(' ', '').partition('q=')[2] or 1) > 0
+            except ValueError:
+                return True
+    return False
+
+
+def public_path(root, url_path):
+    """把URL路径映射成 root 目录下的文件路径，不允许走出 root
+
+    解码后按 / 拆开逐段检查：空段跳过；.. 和以 . 开头的隐藏文件、带反斜杠、冒号或 NUL 的段
+    （Windows 上的另一种分隔符和盘符）直接拒绝，返回 None。
+    """
+    parts = [part for part in urllib.parse.unquote(url_path).split('/') if part]
+    if not parts:
+        return None
+    for part in parts:
+        if part.startswith('.') or '\\' in part or ':' in part or '\0' in part:
+            return None
+    return os.path.join(root, *parts)
+
+
+class StaticSite:
+    """一次构建的结果：路由 -> 文件名 -> 文件信息"""
+
+    def __init__(self, root, manifest):
+        self.root = root
+        self.routes = manifest['routes']
+        self.files = manifest['files']
+
+    @classmethod
+    def load(cls, root):
+        """读取 root 目录下的 manifest.json，没有构建过时返回 None"""
+        try:
+            with open(os.path.join(root, MANIFEST_NAME), encoding='utf-8') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return None
+        return cls(root, manifest)
+
+    def lookup(self, url_path):
+        """返回 (文件名, 文件信息, 是否带哈希的地址)，不是静态页面时返回 None"""
+        url_path = url_path.split('?', 1)[0]
+        name = self.routes.get(url_path)
+        if name is not None:
+            return name, self.files[name], False
+        if url_path.startswith(STATIC_PREFIX):
+            name = url_path[len(STATIC_PREFIX):]
+            if name in self.files:
+                return name, self.files[name], True
+        return None
+
+    def variant(self, name, accept_encoding):
+        """按客户端支持的压缩格式选择文件，返回 (路径, Content-Encoding 或 None, ETag)"""
+        entry = self.files[name]
+        for coding, suffix in ENCODINGS:
+            if coding in entry['encodings'] and accepts_encoding(accept_encoding, coding):
+                return (os.path.join(self.root, name + suffix), coding,
+                        f'"{entry["hash"]}-{coding}"')
+        return os.path.join(self.root, name), None, f'"{entry["hash"]}"'
+
+
+class OpenFile:
+    """FdCache 里的一个已打开文件，用 with 语句持有，离开时释放引用"""
+
+    __slots__ = ('file', 'size', 'mtime', 'etag', 'lock', '_version', '_cache', '_refs', '_evicted')
+
+    def __init__(self, cache, file, st):
+        self.file = file
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+        self.etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+        self._version = (st.st_ino, st.st_size, st.st_mtime_ns)
+        # 没有 os.sendfile 的平台要靠 seek+read 发送，同一个文件对象不能并发使用
+        self.lock = threading.Lock()
+        self._cache = cache
+        self._refs = 0
+        self._evicted = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cache._release(self)
+
+
+class FdCache:
+    """有上限的已打开文件缓存（LRU）
+
+    被淘汰的文件如果正在被其他线程发送，等最后一个使用者释放后才关闭，
+    不会出现文件描述符被关闭后又被其他文件复用的问题。
+    """
+
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self._files = OrderedDict()  # 路径 -> OpenFile
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._files)
+
+    def open(self, path):
+        """返回持有引用的 OpenFile；文件不存在或是目录时抛出 OSError"""
+        st = os.stat(path)
+        if not stat.S_ISREG(st.st_mode):
+            raise IsADirectoryError(path)
+        with self._lock:
+            cached = self._files.get(path)
+            if cached is not None and cached._version == (st.st_ino, st.st_size, st.st_mtime_ns):
+                self._files.move_to_end(path)
+                cached._refs += 1
+                return cached
+        # 文件变化了或者还没打开过：在锁外打开，避免慢磁盘阻塞其他请求
+        f = open(path, 'rb', buffering=0)
+        entry = OpenFile(self, f, os.fstat(f.fileno()))
+        entry._refs = 1
+        with self._lock:
+            old = self._files.pop(path, None)
+            if old is not None:
+                self._evict(old)
+            self._files[path] = entry
+            while len(self._files) > self.max_entries:
+                self._evict(self._files.popitem(last=False)[1])
+        return entry
+
+    def clear(self):
+        with self._lock:
+            while self._files:
+                self._evict(self._files.popitem()[1])
+
+    def _evict(self, entry):
+        entry._evicted = True
+        if entry._refs == 0:
+            entry.file.close()
+
+    def _release(self, entry):
+        with self._lock:
+            entry._refs -= 1
+            if entry._evicted and entry._refs == 0:
+                entry.file.close()
+
+
+def parse_range(header, size):
+    """解析单个字节范围的 Range 头
+
+    返回 (起始位置, 结束位置)（包含两端）；不需要按范围发送（包括格式无效）时返回 None，
+    范围无法满足时返回 False。多个范围的请求按整个文件处理。
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    start, sep, end = header[6:].strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if start:
+            start = int(start)
+            end = int(end) if end else max(size - 1, start)
+        else:
+            # bytes=-N 表示最后N个字节
+            suffix = int(end)
+            if suffix <= 0:
+                return False
+            start, end = max(size - suffix, 0), size - 1
+    except ValueError:
+        return None
+    if start > end:
+        # RFC 9110 §14.1.1：结束位置小于起始位置的范围无效，忽略 Range 头发送完整文件
+        return None
+    if start >= size:
+        return False
+    return start, min(end, size - 1)
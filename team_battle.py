@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+团队战斗 - N对M的多人战斗
+
+战斗状态按列存放在数组里（每个参战者一格：队伍、HP、职业属性），
+每一步所有存活的参战者一起选目标、一起结算，不用为每一对攻击者和防守者写循环。
+
+两种结算方式：
+    - simultaneous: 同一步里的伤害同时生效，双方可能同归于尽（平局）
+    - initiative: 每一步随机排出先后手，伤害立即生效，阵亡者本步不再行动
+      （1对1时就是 battle() 里50%先攻的规则）
+
+目标选择策略：
+    - random: 随机选择一个存活的敌人
+    - weakest: 攻击当前HP最低的敌人
+    - focus: 全队集中攻击编号最小的存活敌人
+"""
+
+import random
+from array import array
+
+from battle_oracle import ATTACK_PROFILES, normalize_class
+
+POLICIES = ('random', 'weakest', 'focus')
+MODES = ('simultaneous', 'initiative')
+MAX_TEAM_SIZE = 500
+
+
+class TeamBattle:
+    """一场团队战斗，members 为 [(队伍编号0/1, 职业, HP), ...]"""
+
+    def __init__(self, members, policy='random', mode='simultaneous', rng=None):
+        if policy not in POLICIES:
+            raise ValueError(f'Invalid policy: {policy}')
+        if mode not in MODES:
+            raise ValueError(f'Invalid mode: {mode}')
+        self.policy = policy
+        self.mode = mode
+        self.rng = rng or random.Random()
+        self.classes = [normalize_class(c) for _, c, _ in members]
+        self.team = array('b', (t for t, _, _ in members))
+        self.hp = array('i', (int(hp) for _, _, hp in members))
+        self.max_hp = array('i', (ATTACK_PROFILES[c]['hp'] for c in self.classes))
+        # 每个参战者的攻击属性：(暴击概率, 普通伤害下限, 上限, 暴击伤害下限, 上限)
+        self.attack = [
+            (p['special_chance'],) + p['normal'] + p['special']
+            for p in (ATTACK_PROFILES[c] for c in self.classes)
+        ]
+        self.damage_dealt = array('i', bytes(4 * len(members)))
+        self.specials = array('i', bytes(4 * len(members)))
+        self.ticks = 0
+
+    def alive(self, team):
+        return [i for i, t in enumerate(self.team) if t == team and self.hp[i] > 0]
+
+    def _roll(self, i):
+        chance, low, high, special_low, special_high = self.attack[i]
+        rng = self.rng
+        if rng.random() < chance:
+            self.specials[i] += 1
+            return rng.randint(special_low, special_high)
+        return rng.randint(low, high)
+
+    def _pick(self, enemies):
+        if self.policy == 'random':
+            return enemies[int(self.rng.random() * len(enemies))]
+        if self.policy == 'focus':
+            return enemies[0]
+        hp = self.hp
+        return min(enemies, key=hp.__getitem__)
+
+    def step(self):
+        """推进一步，返回本步是否有伤害发生"""
+        alive = (self.alive(0), self.alive(1))
+        if not alive[0] or not alive[1]:
+            return False
+        self.ticks += 1
+        if self.mode == 'simultaneous':
+            self._step_simultaneous(alive)
+        else:
+            self._step_initiative(alive)
+        return True
+
+    def _step_simultaneous(self, alive):
+        hp = self.hp
+        incoming = {}
+        for team in (0, 1):
+            enemies = alive[1 - team]
+            # weakest/focus 在同一步里所有人的目标相同，只需要算一次
+            fixed = None if self.policy == 'random' else self._pick(enemies)
+            for i in alive[team]:
+                target = fixed if fixed is not None else self._pick(enemies)
+                damage = self._roll(i)
+                incoming[target] = incoming.get(target, 0) + damage
+                self.damage_dealt[i] += damage
+        for target, damage in incoming.items():
+            hp[target] = max(0, hp[target] - damage)
+
+    def _step_initiative(self, alive):
+        hp = self.hp
+        order = alive[0] + alive[1]
+        self.rng.shuffle(order)
+        living = [list(alive[0]), list(alive[1])]
+        for i in order:
+            if hp[i] <= 0:
+                continue
+            enemies = living[1 - self.team[i]]
+            if not enemies:
+                break
+            target = self._pick(enemies)
+            damage = self._roll(i)
+            self.damage_dealt[i] += damage
+            hp[target] = max(0, hp[target] - damage)
+            if hp[target] == 0:
+                enemies.remove(target)
+
+    def run(self, max_ticks=1000):
+        while self.ticks < max_ticks and self.step():
+            pass
+        return self.summary()
+
+    def summary(self):
+        survivors = (len(self.alive(0)), len(self.alive(1)))
+        if survivors[0] and not survivors[1]:
+            winner = 1
+        elif survivors[1] and not survivors[0]:
+            winner = 2
+        else:
+            winner = None  # 同归于尽或达到步数上限
+        return {
+            'winner': winner,
+            'ticks': self.ticks,
+            'survivors': list(survivors),
+            'hp': list(self.hp),
+            'damage_dealt': list(self.damage_dealt),
+            'specials': list(self.specials),
+        }
+
+
+def resolve_team_battle(team1, team2, policy='random', mode='simultaneous',
+                        max_ticks=1000, rng=None):
+    """team1/team2: [(职业, HP), ...]，HP 为 None 时使用满血"""
+    if not team1 or not team2:
+        raise ValueError('Both teams need at least one member')
+    if len(team1) > MAX_TEAM_SIZE or len(team2) > MAX_TEAM_SIZE:
+        raise ValueError(f'Team size exceeds {MAX_TEAM_SIZE}')
+    members = []
+    for team, roster in ((0, team1), (1, team2)):
+        for character_class, hp in roster:
+            character_class = normalize_class(character_class)
+            max_hp = ATTACK_PROFILES[character_class]['hp']
+            if hp is None:
+                hp = max_hp
+            # 超过职业满血的HP会让 array('i') 溢出，和离线战斗校验一样直接拒绝
+            hp = int(hp)
+            if not 0 <= hp <= max_hp:
+                raise ValueError('Invalid hp')
+            members.append((team, character_class, hp))
+    return TeamBattle(members, policy, mode, rng).run(max_ticks)
@@ -0,0 +1,59 @@
+"""
+测试公用的设置：把仓库根目录加入导入路径，提供加载各个版本游戏代码的 fixture
+
+三份游戏代码（simple_web_games.py、api/index.py、app.py）各自定义了 Warrior、Mage 和 CaveGame，
+rpg_battle_simulator.py 是命令行版本。app.py 依赖 Flask，没有安装时相关测试跳过。
+
+性能基线提交在 benchmarks/ 下；带 --benchmark-compare 运行时默认和它比较，
+平均耗时比基线慢 BENCHMARK_MAX_SLOWDOWN 以上时失败（本地随手保存的结果在 .benchmarks/，不提交）。
+"""
+
+import importlib
+import math
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+BENCHMARK_BASELINE = os.path.join(ROOT, 'benchmarks')
+BENCHMARK_MAX_SLOWDOWN = 'mean:25%'
+
+ENGINES = ('simple', 'api', 'app')
+ENGINE_MODULES = {'simple': 'simple_web_games', 'api': 'api.index', 'app': 'app'}
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_configure(config):
+    """比较基准时默认用仓库里的基线，并在变慢时失败（在 pytest-benchmark 读取选项之前修改）"""
+    option = config.option
+    if not getattr(option, 'benchmark_compare', None):
+        return
+    from pytest_benchmark.utils import parse_compare_fail
+    if option.benchmark_storage == 'file://./.benchmarks':
+        option.benchmark_storage = BENCHMARK_BASELINE
+    if not option.benchmark_compare_fail:
+        option.benchmark_compare_fail = [parse_compare_fail(BENCHMARK_MAX_SLOWDOWN)]
+
+
+def load_engine_module(engine):
+    if engine == 'app':
+        pytest.importorskip('flask')
+    return importlib.import_module(ENGINE_MODULES[engine])
+
+
+@pytest.fixture(params=ENGINES)
+def engine(request):
+    """依次返回三个版本的模块"""
+    return load_engine_module(request.param)
+
+
+def assert_proportion(successes, trials, expected, sigmas=5.0):
+    """二项分布的观测比例落在期望值的 sigmas 个标准差以内（固定种子下结果确定，不会偶然失败）"""
+    std = math.sqrt(expected * (1 - expected) / trials)
+    observed = successes / trials
+    assert abs(observed - expected) <= sigmas * std, (
+        f'observed {observed:.4f}, expected {expected:.4f} ± {sigmas * std:.4f}')
@@ -0,0 +1,85 @@
+"""
+战斗数据分析：环形缓冲区写成列式文件后能原样读回，按日期分区和统计
+"""
+
+import calendar
+import json
+
+import pytest
+
+import battle_analytics
+
+FORMATS = [
+    pytest.param('json.gz'),
+    pytest.param('npz', marks=pytest.mark.skipif(battle_analytics.numpy is None, reason='需要 numpy')),
+    pytest.param('parquet', marks=pytest.mark.skipif(battle_analytics.pyarrow is None, reason='需要 pyarrow')),
+]
+
+
+def exchanges(round_number):
+    return [('亚瑟', '战士', '梅林', '法师', 10 + round_number, False, True),
+            ('梅林', '法师', '亚瑟', '战士', 20 + round_number, round_number % 2 == 0, False)]
+
+
+def read_all(directory):
+    columns = {name: [] for name in battle_analytics.COLUMNS}
+    for path in battle_analytics.chunk_paths(directory):
+        for name, values in battle_analytics.read_chunk(path).items():
+            columns[name].extend(values)
+    return columns
+
+
+@pytest.mark.parametrize('file_format', FORMATS)
+def test_flush_and_read_back(tmp_path, file_format):
+    sink = battle_analytics.AnalyticsSink(str(tmp_path), batch_size=4, flush_interval=0.05, file_format=file_format)
+    sink.start()
+    for round_number in range(10):
+        sink.record_round('battle', exchanges(round_number), '梅林' if round_number == 9 else None)
+    sink.close()
+
+    stats = sink.stats()
+    assert stats['recorded'] == stats['written'] == 20
+    assert stats['buffered'] == stats['dropped'] == stats['failed_batches'] == 0
+    paths = battle_analytics.chunk_paths(str(tmp_path))
+    assert len(paths) == stats['files'] >= 1
+    assert all(path.endswith('.' + file_format) for path in paths)
+
+    columns = read_all(str(tmp_path))
+    assert set(columns) == set(battle_analytics.COLUMNS)
+    assert columns['damage'] == [damage for n in range(10) for damage in (10 + n, 20 + n)]
+    assert columns['attacker'] == ['亚瑟', '梅林'] * 10
+    assert columns['special'] == [special for n in range(10) for special in (False, n % 2 == 0)]
+    assert columns['first'] == [True, False] * 10
+    assert columns['winner'] == [''] * 18 + ['梅林'] * 2
+    assert set(columns['source']) == {'battle'}
+
+    totals = battle_analytics.class_stats(paths)
+    assert totals['法师']['attacks'] == 10 and totals['法师']['kills'] == 1
+    assert totals['战士']['max_damage'] == 19 and totals['战士']['special_rate'] == 0.0
+    assert battle_analytics.class_stats(paths, source='duel') == {}
+
+
+def test_full_buffer_drops_instead_of_blocking(tmp_path):
+    sink = battle_analytics.AnalyticsSink(str(tmp_path), capacity=3, file_format='json.gz')
+    sink.record_round('battle', exchanges(0), None)
+    sink.record_round('duel', exchanges(1), None)
+    assert sink.stats()['buffered'] == 3 and sink.stats()['dropped'] == 1
+    sink.start()
+    sink.close()
+    assert read_all(str(tmp_path))['source'] == ['battle', 'battle', 'duel']
+
+
+def test_rows_are_partitioned_by_utc_day(tmp_path, capsys):
+    sink = battle_analytics.AnalyticsSink(str(tmp_path), file_format='json.gz')
+    midnight = calendar.timegm((2024, 5, 2, 0, 0, 0))
+    rows = [(midnight + offset, 'battle', 'a', '战士', 'b', '法师', 10, False, True, '')
+            for offset in (-2, -1, 1)]
+    sink._flush(rows)
+    assert sorted(path.split('date=')[1][:10] for path in battle_analytics.chunk_paths(str(tmp_path))) == [
+        '2024-05-01', '2024-05-02']
+    assert len(battle_analytics.chunk_paths(str(tmp_path), since='2024-05-02')) == 1
+    assert len(battle_analytics.chunk_paths(str(tmp_path), until='2024-05-01')) == 1
+
+    assert battle_analytics.main(['stats', '--dir', str(tmp_path), '--json']) == 0
+    report = json.loads(capsys.readouterr().out)
+    assert report['files'] == 2 and report['classes']['战士']['attacks'] == 3
@@ -0,0 +1,123 @@
+"""
+battle_oracle 的精确胜率表和各个模拟器（offline_battle.fight、team_battle、balance_tuner）一致
+"""
+
+import random
+
+import pytest
+
+import balance_tuner
+import battle_oracle
+import offline_battle
+import team_battle
+from battle_oracle import ATTACK_PROFILES
+from conftest import assert_proportion
+
+MATCHUPS = [('战士', '战士'), ('战士', '法师'), ('法师', '战士'), ('法师', '法师')]
+FIGHTS = 20000
+
+
+def simulate_wins(class_a, hp_a, class_b, hp_b, fights=FIGHTS, seed=0):
+    rng = random.Random(seed)
+    profiles = (ATTACK_PROFILES[class_a], ATTACK_PROFILES[class_b])
+    wins = 0
+    total_rounds = 0
+    for _ in range(fights):
+        winner, rounds = offline_battle.fight(rng, profiles, [hp_a, hp_b], max_rounds=10 ** 6)
+        wins += winner == 1
+        total_rounds += rounds
+    return wins, total_rounds / fights
+
+
+@pytest.mark.parametrize('class_a,class_b', MATCHUPS)
+@pytest.mark.parametrize('hp_fraction', [1.0, 0.5, 0.2])
+def test_oracle_matches_simulation(class_a, class_b, hp_fraction):
+    hp_a = max(1, int(ATTACK_PROFILES[class_a]['hp'] * hp_fraction))
+    hp_b = ATTACK_PROFILES[class_b]['hp']
+    exact = battle_oracle.odds(class_a, hp_a, class_b, hp_b)
+    wins, mean_rounds = simulate_wins(class_a, hp_a, class_b, hp_b)
+    assert_proportion(wins, FIGHTS, exact['player1_win'])
+    assert mean_rounds == pytest.approx(exact['expected_rounds'], rel=0.03)
+
+
+def test_oracle_boundaries():
+    table = battle_oracle.table_for('战士', '法师')
+    assert table.lookup(0, 80) == (0.0, 0.0)
+    assert table.lookup(120, 0) == (1.0, 0.0)
+    # 双方都能一击致命时只看先攻
+    assert table.lookup(1, 1) == (pytest.approx(0.5), pytest.approx(1.0))
+    with pytest.raises(ValueError):
+        table.lookup(121, 80)
+
+
+@pytest.mark.parametrize('class_a,class_b', MATCHUPS)
+def test_odds_are_symmetric(class_a, class_b):
+    a = battle_oracle.odds(class_a, 60, class_b, 70)
+    b = battle_oracle.odds(class_b, 70, class_a, 60)
+    assert a['player1_win'] == pytest.approx(b['player2_win'])
+    assert a['expected_rounds'] == pytest.approx(b['expected_rounds'])
+
+
+@pytest.mark.parametrize('class_a,class_b', MATCHUPS)
+def test_team_battle_one_on_one_matches_oracle(class_a, class_b):
+    """initiative 模式的1对1就是 /api/rpg/battle 的规则"""
+    rng = random.Random(5)
+    fights = 10000
+    wins = 0
+    for _ in range(fights):
+        result = team_battle.resolve_team_battle([(class_a, None)], [(class_b, None)],
+                                                 policy='focus', mode='initiative', rng=rng)
+        assert result['winner'] in (1, 2)
+        wins += result['winner'] == 1
+    expected = battle_oracle.odds(class_a, ATTACK_PROFILES[class_a]['hp'],
+                                  class_b, ATTACK_PROFILES[class_b]['hp'])['player1_win']
+    assert_proportion(wins, fights, expected)
+
+
+@pytest.mark.parametrize('policy', team_battle.POLICIES)
+@pytest.mark.parametrize('mode', team_battle.MODES)
+def test_team_battle_invariants(policy, mode):
+    rng = random.Random(9)
+    team1 = [('warrior', None)] * 3 + [('mage', 40)]
+    team2 = [('mage', None)] * 4
+    result = team_battle.resolve_team_battle(team1, team2, policy, mode, rng=rng)
+    max_hp = [120, 120, 120, 80, 80, 80, 80, 80]
+    assert all(0 <= hp <= cap for hp, cap in zip(result['hp'], max_hp))
+    survivors = [sum(hp > 0 for hp in result['hp'][:4]), sum(hp > 0 for hp in result['hp'][4:])]
+    assert result['survivors'] == survivors
+    assert result['winner'] in (1, 2, None)
+    if result['winner'] == 1:
+        assert survivors[0] and not survivors[1]
+    elif result['winner'] == 2:
+        assert survivors[1] and not survivors[0]
+
+
+@pytest.mark.parametrize('hp', [2 ** 31, 10 ** 30, 121, -1, 'abc'])
+def test_team_battle_rejects_out_of_range_hp(hp):
+    with pytest.raises(ValueError):
+        team_battle.resolve_team_battle([('warrior', hp)], [('mage', None)])
+
+
+def test_balance_tuner_profiles_round_trip():
+    profiles = {}
+    for character_class, profile in ATTACK_PROFILES.items():
+        profiles[character_class] = balance_tuner.make_profile(
+            character_class, **balance_tuner.class_stats(character_class))
+        assert profiles[character_class] == profile
+    win, rounds = balance_tuner.exact_odds(profiles)
+    expected = battle_oracle.odds('战士', 120, '法师', 80)
+    assert win == pytest.approx(expected['player1_win'])
+    assert rounds == pytest.approx(expected['expected_rounds'])
+
+
+def test_balance_tuner_skips_waves_of_duplicates(monkeypatch):
+    """一整批候选都是重复方案时不能提前结束搜索"""
+    base = {c: balance_tuner.make_profile(c, **balance_tuner.class_stats(c)) for c in balance_tuner.CLASSES}
+    stronger = dict(base, 战士=balance_tuner.make_profile(
+        '战士', **dict(balance_tuner.class_stats('战士'), hp=130)))
+    weaker = dict(base, 战士=balance_tuner.make_profile(
+        '战士', **dict(balance_tuner.class_stats('战士'), hp=110)))
+    monkeypatch.setattr(balance_tuner, 'generate_candidates',
+                        lambda *args: iter([base] * 20 + [stronger, weaker]))
+    report = balance_tuner.tune(balance_tuner.Objective(), workers=1, fights=50, refine=0)
+    assert report['evaluated'] == 3
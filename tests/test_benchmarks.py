@@ -0,0 +1,84 @@
+"""
+性能基准（需要 pytest-benchmark，没有安装时整个文件跳过）
+
+和提交在 benchmarks/<平台>/ 下的基线比较，平均耗时变慢超过 25% 时失败（见 conftest.py）：
+
+    pytest tests/test_benchmarks.py --benchmark-only --benchmark-compare
+
+优化或换了 CI 机器之后重新生成基线并提交：
+
+    pytest tests/test_benchmarks.py --benchmark-only --benchmark-storage=benchmarks --benchmark-save=baseline
+
+基线只在同一类机器上有意义；本地随手保存的结果（--benchmark-autosave）在 .benchmarks/ 下，不提交。
+每个基准都先检查结果正确，再计时，避免把"更快但算错了"当成优化。
+"""
+
+import random
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+import battle_oracle
+import cave_solver
+import character_store
+import offline_battle
+import persistence
+import team_battle
+from battle_oracle import ATTACK_PROFILES
+
+
+def test_oracle_table_build(benchmark):
+    table = benchmark(battle_oracle.OddsTable, ATTACK_PROFILES['战士'], ATTACK_PROFILES['法师'])
+    assert 0.0 < table.lookup(120, 80)[0] < 1.0
+
+
+def test_offline_simulate(benchmark):
+    def run():
+        return [offline_battle.simulate(seed, 'warrior', 'mage')['winner'] for seed in range(200)]
+    winners = benchmark(run)
+    assert set(winners) <= {1, 2}
+
+
+def test_team_battle(benchmark):
+    team1 = [('warrior', None)] * 50
+    team2 = [('mage', None)] * 50
+
+    def run():
+        return team_battle.resolve_team_battle(team1, team2, 'weakest', 'simultaneous', rng=random.Random(1))
+    result = benchmark(run)
+    assert result['winner'] in (1, 2, None)
+
+
+def test_cave_solver(benchmark):
+    game_class = cave_solver.load_engine('simple')
+    report = benchmark(cave_solver.explore, game_class)
+    assert report['shortest_win'] == ['right', 'stand up']
+
+
+def test_snapshot_load(benchmark, tmp_path):
+    """只计时读取（写入时的 fsync 耗时取决于磁盘，波动太大，不适合做基线）"""
+    characters = {f'p{i % 100}\0c{i}': ('战士' if i % 2 else '法师', i % 121) for i in range(20000)}
+    games = {f'g{i}': ('room', 'left') for i in range(2000)}
+    path = str(tmp_path / 'state.snap')
+    persistence.write_snapshot(path, characters, games)
+    assert benchmark(persistence.load_snapshot, path) == (characters, games)
+
+
+def test_record_encoding(benchmark):
+    def run():
+        return b''.join(persistence.frame(persistence.encode_character_hp(f'c{i}', i)) for i in range(20000))
+    data = benchmark(run)
+    assert sum(1 for _ in persistence.iter_records(data)) == 20000
+
+
+def test_indexed_character_query(benchmark):
+    store = character_store.CharacterStore()
+    for i in range(100000):
+        store.put(f'p{i % 1000}', f'c{i}', '战士' if i % 2 else '法师', i % 121)
+
+    def run():
+        return store.query('战士', 10, 60, True, start=20000, count=50)
+    total, entries = benchmark(run)
+    assert total == sum(1 for _, _, c, hp in store.items() if c == '战士' and 10 <= hp <= 60)
+    assert len(entries) == 50
@@ -0,0 +1,134 @@
+"""
+洞穴探险状态机：各版本的 CaveGame 和参考转移表逐步一致，求解器的结论不变
+
+参考实现是一张显式的转移表 (状态, 选择) -> 新状态，和 CaveGame.make_choice 的分支一一对应；
+previous_choice 只在 start 状态做出有效选择时记录，restart 时清空。
+"""
+
+import itertools
+
+import pytest
+
+import cave_solver
+import persistence
+from conftest import load_engine_module
+
+WELCOME = ('Welcome to the game! You are in a dark cave', ['left', 'right'])
+ROOM = ('You are in a room with a table and a chair', ['sit down', 'stand up'])
+SITTING = ('You are sitting down. You need to find the magic stone', ['restart'])
+STANDING_LOST = ('You are standing up. You need to find the magic stone', ['restart'])
+STANDING_WON = ('You are standing up. You did it! You are a wizard!', ['restart'])
+INVALID = {
+    'start': "Invalid choice. Please choose 'left' or 'right'.",
+    'room': "Invalid choice. Please choose 'sit down' or 'stand up'.",
+    'sitting': "Game over. Choose 'restart' to play again.",
+    'standing': "Game over. Choose 'restart' to play again.",
+}
+ALPHABET = ['left', 'right', 'sit down', 'stand up', 'restart', 'jump']
+
+
+def reference_step(state, choice):
+    """state = (状态, 提示, 可选项, previous_choice)，返回下一个 state"""
+    name, message, choices, previous = state
+    if name == 'start' and choice in ('left', 'right'):
+        return ('room',) + ROOM + (choice,)
+    if name == 'room' and choice == 'sit down':
+        return ('sitting',) + SITTING + (previous,)
+    if name == 'room' and choice == 'stand up':
+        return ('standing',) + (STANDING_WON if previous == 'right' else STANDING_LOST) + (previous,)
+    if name in ('sitting', 'standing') and choice == 'restart':
+        return ('start',) + WELCOME + (None,)
+    return (name, INVALID[name], choices, previous)
+
+
+def observe(game):
+    return (game.state, game.message, list(game.choices), getattr(game, 'previous_choice', None))
+
+
+def check_sequences(game_class, length):
+    for sequence in itertools.product(ALPHABET, repeat=length):
+        game = game_class()
+        expected = ('start',) + WELCOME + (None,)
+        assert observe(game) == expected
+        for step, choice in enumerate(sequence):
+            game.make_choice(choice)
+            expected = reference_step(expected, choice)
+            assert observe(game) == expected, (sequence[:step + 1], observe(game), expected)
+
+
+@pytest.mark.parametrize('engine_name', ['simple', 'api'])
+def test_cave_game_matches_reference(engine_name):
+    check_sequences(cave_solver.load_engine(engine_name), 5)
+
+
+@pytest.mark.xfail(strict=True, reason='app.py 的 CaveGame 不记录 previous_choice，永远无法获胜')
+def test_app_cave_game_matches_reference():
+    pytest.importorskip('flask')
+    check_sequences(cave_solver.load_engine('app'), 3)
+
+
+@pytest.mark.parametrize('engine_name', ['simple', 'api'])
+def test_solver_report(engine_name):
+    report = cave_solver.explore(cave_solver.load_engine(engine_name))
+    assert not report['truncated']
+    assert report['shortest_win'] == ['right', 'stand up']
+    assert [ending['win'] for ending in report['endings']].count(True) == 1
+    # 没有进入过房间就没有 previous_choice；进入房间后一定有
+    assert {(combo['state'], combo['previous_choice']) for combo in report['unreachable']} == {
+        ('start', 'left'), ('start', 'right'),
+        ('room', None), ('sitting', None), ('standing', None)}
+
+
+def test_solver_matches_reference_reachability():
+    """参考转移表从初始状态出发能到达的状态数和求解器一致"""
+    start = ('start',) + WELCOME + (None,)
+    seen = {repr(start)}
+    frontier = [start]
+    transitions = 0
+    while frontier:
+        state = frontier.pop()
+        for choice in list(state[2]) + [cave_solver.INVALID_CHOICE]:
+            transitions += 1
+            target = reference_step(state, choice)
+            if repr(target) not in seen:
+                seen.add(repr(target))
+                frontier.append(target)
+    report = cave_solver.explore(cave_solver.load_engine('simple'))
+    assert (report['states'], report['transitions']) == (len(seen), transitions)
+
+
+def test_state_codec_round_trip():
+    game_class = cave_solver.load_engine('simple')
+    game = game_class()
+    codec = cave_solver.StateCodec(sorted(vars(game)))
+    keys = []
+    for sequence in itertools.product(ALPHABET, repeat=3):
+        game = game_class()
+        for choice in sequence:
+            game.make_choice(choice)
+        key = codec.encode(game)
+        restored = game_class()
+        codec.restore(restored, key)
+        assert observe(restored) == observe(game)
+        assert codec.encode(restored) == key
+        keys.append((key, repr(observe(game))))
+    # 编码是单射：不同的状态编码不同
+    assert len({key for key, _ in keys}) == len({state for _, state in keys})
+
+
+@pytest.mark.parametrize('engine_name', ['simple', 'api'])
+def test_restore_from_compact_record(engine_name):
+    """持久化只保存 (状态, previous_choice)，restore_cave_game 重建出的游戏和原来的一致"""
+    module = load_engine_module(engine_name)
+    game_class = module.CaveGame
+    for sequence in itertools.product(ALPHABET, repeat=3):
+        game = game_class()
+        for choice in sequence:
+            game.make_choice(choice)
+        record = persistence.encode_cave_state('g', game.state, game.previous_choice)
+        decoded = []
+        persistence.apply_record(record, None, None, lambda *args: decoded.append(args))
+        restored = module.restore_cave_game(decoded[0][1], decoded[0][2])
+        assert (restored.state, restored.previous_choice) == (game.state, game.previous_choice)
+        if 'Invalid' not in game.message and 'Game over' not in game.message:
+            assert observe(restored) == observe(game)
@@ -0,0 +1,121 @@
+"""
+命令行的无界面模式：20linegame.py 和 rpg_battle_simulator.py 的 --choices/--script/--runs/--jsonl 和退出码
+"""
+
+import builtins
+import importlib
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import rpg_battle_simulator
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+cave = importlib.import_module('20linegame')
+
+
+def run(script, *args, stdin=''):
+    return subprocess.run([sys.executable, os.path.join(ROOT, script), *args], input=stdin,
+                          capture_output=True, text=True, encoding='utf-8', timeout=60)
+
+
+def track_open(monkeypatch, module):
+    """记录模块打开的文件，检查它们都被关闭了"""
+    opened = []
+
+    def tracking_open(*args, **kwargs):
+        f = builtins.open(*args, **kwargs)
+        opened.append(f)
+        return f
+
+    monkeypatch.setattr(module, 'open', tracking_open, raising=False)
+    return opened
+
+
+@pytest.fixture
+def simulator(monkeypatch):
+    """run_cli 会替换模块里的 say/ask/emit_event，测试结束后恢复"""
+    for name in ('say', 'ask', 'emit_event'):
+        monkeypatch.setattr(rpg_battle_simulator, name, getattr(rpg_battle_simulator, name))
+    return rpg_battle_simulator
+
+
+@pytest.mark.parametrize('choices, code', [('right\nstand up\n', 0), ('left\nsit down\n', 1), ('right\n', 2)])
+def test_cave_script_file_is_closed(monkeypatch, tmp_path, choices, code):
+    script = tmp_path / 'choices.txt'
+    script.write_text(choices, encoding='utf-8')
+    opened = track_open(monkeypatch, cave)
+    assert cave.main(['--script', str(script), '--quiet']) == code
+    assert len(opened) == 1 and opened[0].closed
+
+
+def test_simulator_script_file_is_closed(simulator, monkeypatch, tmp_path):
+    script = tmp_path / 'answers.txt'
+    script.write_text('亚瑟\n1\n梅林\n2\n', encoding='utf-8')
+    opened = track_open(monkeypatch, simulator)
+    assert simulator.run_cli(['--script', str(script), '--quiet', '--seed', '1']) in (0, 1)
+    assert len(opened) == 1 and opened[0].closed
+
+
+@pytest.mark.parametrize('results, code', [([1, 2], 0), ([1, 2, 2, 1], 0), ([2, 2, 1], 1), ([1, 1, 2], 0)])
+def test_batch_exit_code(simulator, monkeypatch, results, code):
+    winners = iter(results)
+    monkeypatch.setattr(simulator, 'main', lambda specs: next(winners))
+    argv = ['--p1', '亚瑟:warrior', '--p2', '梅林:mage', '--runs', str(len(results)), '--quiet']
+    assert simulator.run_cli(argv) == code
+
+
+def test_quiet_without_script_prints_nothing():
+    result = run('rpg_battle_simulator.py', '--quiet', '--seed', '3', stdin='亚瑟\n1\n梅林\n2\n')
+    assert result.returncode in (0, 1), result.stderr
+    assert result.stdout == ''
+
+
+def test_quiet_without_enough_answers_is_an_error():
+    result = run('rpg_battle_simulator.py', '--quiet', stdin='亚瑟\n')
+    assert result.returncode == 2
+    assert result.stdout == ''
+
+
+@pytest.mark.parametrize('args, stdin', [(['--choices', 'right,stand up'], ''),
+                                         (['--script', '-'], 'right\nstand up\n'),
+                                         ([], 'right\nstand up\n')])
+def test_cave_jsonl(args, stdin):
+    result = run('20linegame.py', *args, '--jsonl', stdin=stdin)
+    assert result.returncode == 0, result.stderr
+    assert json.loads(result.stdout) == {'choices': ['right', 'stand up'], 'wizard': True}
+
+
+def test_cave_not_enough_choices():
+    result = run('20linegame.py', '--choices', 'left', '--quiet')
+    assert result.returncode == 2 and result.stdout == ''
+
+
+def test_simulator_runs_jsonl():
+    result = run('rpg_battle_simulator.py', '--p1', '亚瑟:warrior', '--p2', '梅林:mage',
+                 '--runs', '7', '--seed', '5', '--jsonl')
+    records = [json.loads(line) for line in result.stdout.splitlines()]
+    assert len(records) == 7
+    assert all(record['winner_name'] == ('亚瑟', '梅林')[record['winner'] - 1] for record in records)
+    wins = [sum(record['winner'] == side for record in records) for side in (1, 2)]
+    assert result.returncode == (1 if wins[1] > wins[0] else 0)
+    # 同一个种子结果相同
+    again = run('rpg_battle_simulator.py', '--p1', '亚瑟:warrior', '--p2', '梅林:mage',
+                '--runs', '7', '--seed', '5', '--jsonl')
+    assert again.stdout == result.stdout
+
+
+def test_simulator_team_battle_jsonl():
+    result = run('rpg_battle_simulator.py', '--team1', 'warrior=5', '--team2', 'mage=5', '--seed', '1', '--jsonl')
+    record = json.loads(result.stdout)
+    assert record['winner'] in (1, 2, None)
+    assert result.returncode == (0 if record['winner'] == 1 else 1)
+
+
+@pytest.mark.parametrize('args', [['--runs', '3'], ['--p1', '亚瑟:warrior'], ['--team1', 'warrior=1'],
+                                  ['--p1', '亚瑟:knight', '--p2', '梅林:mage', '--quiet']])
+def test_simulator_usage_errors(args):
+    assert run('rpg_battle_simulator.py', *args).returncode == 2
@@ -0,0 +1,161 @@
+"""
+WebSocket对战：握手、帧编解码，以及两个连接在 DuelHub 里打完一局
+"""
+
+import json
+import os
+import socket
+import struct
+
+import pytest
+
+import duel_ws
+
+
+def client_frame(opcode, payload=b'', mask=b'\x01\x02\x03\x04'):
+    """客户端发出的帧必须加掩码"""
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, 0x80 | length)
+    elif length < 1 << 16:
+        header = struct.pack('!BBH', 0x80 | opcode, 0x80 | 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 0x80 | 127, length)
+    masked = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return header + mask + masked
+
+
+def read_messages(sock, until):
+    """读取服务器发来的文本帧，直到 until(消息) 为真或连接关闭"""
+    sock.settimeout(5)
+    buffer = b''
+    messages = []
+    while True:
+        while len(buffer) >= 2:
+            opcode, length = buffer[0] & 0x0F, buffer[1] & 0x7F
+            offset = 2
+            if length == 126:
+                length, offset = struct.unpack_from('!H', buffer, 2)[0], 4
+            if len(buffer) < offset + length:
+                break
+            payload, buffer = buffer[offset:offset + length], buffer[offset + length:]
+            if opcode == duel_ws.OP_CLOSE:
+                return messages, struct.unpack('!H', payload[:2])[0]
+            if opcode == duel_ws.OP_TEXT:
+                messages.append(json.loads(payload))
+                if until(messages[-1]):
+                    return messages, None
+        data = sock.recv(4096)
+        if not data:
+            return messages, None
+        buffer += data
+
+
+def test_accept_key_matches_rfc_example():
+    assert duel_ws.accept_key('dGhlIHNhbXBsZSBub25jZQ==') == 's3pPLMBiTxaQ9kYGzzhZRbK+xOo='
+
+
+def test_handshake_requires_websocket_headers():
+    headers = {'Upgrade': 'websocket', 'Connection': 'keep-alive, Upgrade',
+               'Sec-WebSocket-Key': 'dGhlIHNhbXBsZSBub25jZQ==', 'Sec-WebSocket-Version': '13'}
+    assert duel_ws.handshake_headers(headers)['Sec-WebSocket-Accept'] == 's3pPLMBiTxaQ9kYGzzhZRbK+xOo='
+    for key, value in (('Upgrade', 'h2c'), ('Connection', 'close'), ('Sec-WebSocket-Version', '8'),
+                       ('Sec-WebSocket-Key', '')):
+        assert duel_ws.handshake_headers(dict(headers, **{key: value})) is None
+
+
+@pytest.mark.parametrize('size', [0, 5, 125, 126, 4000])
+def test_parse_frames_round_trip(size):
+    payload = os.urandom(size)
+    data = client_frame(duel_ws.OP_TEXT, payload) + client_frame(duel_ws.OP_PING, b'hi')
+    frames, consumed = duel_ws.parse_frames(bytearray(data))
+    assert frames == [(duel_ws.OP_TEXT, payload), (duel_ws.OP_PING, b'hi')]
+    assert consumed == len(data)
+    # 不完整的帧留在缓冲区里等后面的数据
+    frames, consumed = duel_ws.parse_frames(bytearray(data[:-1]))
+    assert frames == [(duel_ws.OP_TEXT, payload)]
+    assert consumed == len(client_frame(duel_ws.OP_TEXT, payload))
+
+
+def test_parse_frames_rejects_bad_frames():
+    unmasked = duel_ws.encode_frame(duel_ws.OP_TEXT, b'x')
+    fragmented = bytes([duel_ws.OP_TEXT]) + client_frame(duel_ws.OP_TEXT, b'x')[1:]
+    oversized = client_frame(duel_ws.OP_TEXT, b'x' * (duel_ws.MAX_FRAME_SIZE + 1))
+    for data, code in ((unmasked, duel_ws.CLOSE_PROTOCOL_ERROR), (fragmented, duel_ws.CLOSE_UNSUPPORTED),
+                       (oversized, duel_ws.CLOSE_TOO_BIG)):
+        with pytest.raises(duel_ws.ProtocolError) as info:
+            duel_ws.parse_frames(bytearray(data))
+        assert info.value.code == code
+
+
+def test_duel_params():
+    assert duel_ws.duel_params('room=r1&name=Bob&class=mage') == ('r1', 'Bob', 'mage')
+    assert duel_ws.duel_params('') == ('', '', 'warrior')
+
+
+def test_hub_plays_a_duel_to_the_end():
+    def resolve(fighters):
+        # 玩家1每回合打掉对手50点，先攻永远是玩家1
+        hp = [fighters[0][2], max(0, fighters[1][2] - 50)]
+        return 1, [[1, 50, False]], hp
+
+    hub = duel_ws.DuelHub(resolve)
+    clients = []
+    for name, character_class in (('Alice', 'warrior'), ('Bob', 'mage')):
+        server_side, client_side = socket.socketpair()
+        hub.adopt(server_side, 'arena', name, character_class)
+        clients.append(client_side)
+    alice, bob = clients
+    messages, _ = read_messages(alice, lambda m: m['type'] == 'start')
+    assert messages[0] == {'type': 'joined', 'you': 1, 'room': 'arena', 'players': [['Alice', '战士', 120], None]}
+    assert messages[-1]['players'] == [['Alice', '战士', 120], ['Bob', '法师', 80]]
+    read_messages(bob, lambda m: m['type'] == 'start')
+
+    alice.sendall(client_frame(duel_ws.OP_TEXT, b'{"type": "attack"}'))
+    assert read_messages(alice, lambda m: True)[0] == [{'type': 'waiting'}]
+    bob.sendall(client_frame(duel_ws.OP_TEXT, b'{"type": "attack"}'))
+    messages, _ = read_messages(bob, lambda m: m['type'] == 'round')
+    assert messages[-1] == {'type': 'round', 'round': 1, 'first': 1, 'events': [[1, 50, False]], 'hp': [120, 30]}
+
+    for sock in clients:
+        sock.sendall(client_frame(duel_ws.OP_TEXT, b'{"type": "attack"}'))
+    for sock in clients:
+        messages, close_code = read_messages(sock, lambda m: False)
+        assert messages[-1] == {'type': 'end', 'winner': 1, 'reason': 'ko'}
+        assert close_code == duel_ws.CLOSE_NORMAL
+        sock.close()
+
+    # 打完的房间随着两个连接断开被删除，同名房间可以重新开始
+    server_side, client_side = socket.socketpair()
+    hub.adopt(server_side, 'arena', 'Eve', 'warrior')
+    messages, _ = read_messages(client_side, lambda m: True)
+    assert messages == [{'type': 'joined', 'you': 1, 'room': 'arena', 'players': [['Eve', '战士', 120], None]}]
+    client_side.close()
+
+
+def test_full_room_rejects_a_third_player():
+    hub = duel_ws.DuelHub(lambda fighters: (1, [], [f[2] for f in fighters]))
+    clients = []
+    for name in ('Alice', 'Bob', 'Eve'):
+        server_side, client_side = socket.socketpair()
+        hub.adopt(server_side, 'full', name, 'warrior')
+        clients.append(client_side)
+    messages, close_code = read_messages(clients[2], lambda m: False)
+    assert messages == [{'type': 'error', 'error': 'Room is full'}]
+    assert close_code == duel_ws.CLOSE_POLICY
+    for sock in clients:
+        sock.close()
+
+
+def test_hub_awards_the_win_when_the_opponent_leaves():
+    hub = duel_ws.DuelHub(lambda fighters: (1, [], [f[2] for f in fighters]))
+    clients = []
+    for name in ('Alice', 'Bob'):
+        server_side, client_side = socket.socketpair()
+        hub.adopt(server_side, 'quit', name, 'warrior')
+        clients.append(client_side)
+    read_messages(clients[0], lambda m: m['type'] == 'start')
+    clients[1].close()
+    messages, close_code = read_messages(clients[0], lambda m: False)
+    assert messages[-1] == {'type': 'end', 'winner': 1, 'reason': 'left'}
+    clients[0].close()
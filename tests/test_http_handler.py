@@ -0,0 +1,307 @@
+"""
+simple_web_games.py 的 HTTP 处理：在线程里启动真实的服务器，用 http.client 发请求
+
+每个测试都换上干净的全局状态（角色、积分、限流、幂等缓存），不开启持久化和数据分析。
+"""
+
+import base64
+import http.client
+import json
+import os
+import socket
+import threading
+import time
+import urllib.parse
+
+import pytest
+
+import character_store
+import duel_ws
+import idempotency
+import offline_battle
+import rate_limit
+import rating
+from conftest import ROOT
+from test_duel_ws import client_frame, read_messages
+
+
+@pytest.fixture
+def server(monkeypatch):
+    import simple_web_games
+    monkeypatch.chdir(ROOT)
+    monkeypatch.setattr(simple_web_games, 'characters', character_store.CharacterStore())
+    monkeypatch.setattr(simple_web_games, 'ratings', rating.RatingBoard())
+    monkeypatch.setattr(simple_web_games, 'games', {})
+    monkeypatch.setattr(simple_web_games, 'game_states', character_store.BucketIndex())
+    monkeypatch.setattr(simple_web_games, 'snapshots', None)
+    monkeypatch.setattr(simple_web_games, 'journal', None)
+    monkeypatch.setattr(simple_web_games, 'analytics', None)
+    monkeypatch.setattr(simple_web_games, 'static_site', None)
+    monkeypatch.setattr(simple_web_games, '_duel_hub', None)
+    monkeypatch.setattr(simple_web_games, '_seed_issuer', None)
+    monkeypatch.setattr(simple_web_games, 'limiter', rate_limit.TokenBucketLimiter(rate=0, burst=0))
+    monkeypatch.setattr(simple_web_games, 'idempotent_results', idempotency.IdempotencyCache())
+    monkeypatch.setattr(simple_web_games.GameHandler, 'log_message', lambda *args: None)
+    httpd = simple_web_games.GameServer(('127.0.0.1', 0), simple_web_games.GameHandler)
+    thread = threading.Thread(target=httpd.serve_forever, kwargs={'poll_interval': 0.05})
+    thread.start()
+    httpd.module = simple_web_games
+    httpd.port = httpd.server_address[1]
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+    thread.join()
+
+
+def request(server, method, path, body=None, headers=None, connection=None):
+    conn = connection or http.client.HTTPConnection('127.0.0.1', server.port, timeout=5)
+    data = None if body is None else json.dumps(body).encode('utf-8')
+    conn.request(method, path, data, dict(headers or {}))
+    response = conn.getresponse()
+    payload = response.read()
+    if connection is None:
+        conn.close()
+    return response, payload
+
+
+def post_json(server, path, body, headers=None):
+    response, payload = request(server, 'POST', path, body, headers)
+    return response.status, json.loads(payload)
+
+
+def fetch_json(server, path, headers=None, body=None):
+    """没有请求体时发 GET，有请求体时发 POST，返回 (状态码, JSON)"""
+    response, payload = request(server, 'GET' if body is None else 'POST', path, body, headers)
+    return response.status, json.loads(payload)
+
+
+def test_create_character_and_battle(server):
+    assert post_json(server, '/api/rpg/create_character', {'name': 'A', 'class': 'warrior'})[0] == 200
+    assert post_json(server, '/api/rpg/create_character', {'name': 'B', 'class': 'mage'})[0] == 200
+    status, result = post_json(server, '/api/rpg/battle', {'player1': 'A', 'player2': 'B'})
+    assert status == 200
+    assert result['player1']['hp'] == server.module.characters.get('public', 'A')[1]
+    status, result = post_json(server, '/api/rpg/battle', {'player1': 'A', 'player2': 'nobody'})
+    assert (status, result) == (400, {'error': 'Character not found'})
+
+
+@pytest.mark.parametrize('name', [5, None, ['a'], {'a': 1}, '', 'x' * 70000, 'alice\0hero'])
+def test_invalid_character_names_are_rejected(server, name):
+    status, result = post_json(server, '/api/rpg/create_character', {'name': name, 'class': 'warrior'})
+    assert status == 400
+    assert 'error' in result
+    assert len(server.module.characters) == 0
+    # 服务器照常工作
+    assert post_json(server, '/api/rpg/create_character', {'name': 'ok', 'class': 'warrior'})[0] == 200
+
+
+def test_players_have_separate_namespaces(server):
+    post_json(server, '/api/rpg/create_character', {'name': 'hero', 'class': 'warrior'}, {'X-Player-Id': 'alice'})
+    status, _ = post_json(server, '/api/rpg/create_character', {'name': 'hero', 'class': 'mage'})
+    assert status == 200
+    assert server.module.characters.get('alice', 'hero')[0] == '战士'
+    assert server.module.characters.get('public', 'hero')[0] == '法师'
+
+
+def test_offline_battle_is_bound_to_stored_characters_and_settled(server):
+    headers = {'X-Player-Id': 'alice'}
+    post_json(server, '/api/rpg/create_character', {'name': 'A', 'class': 'warrior'}, headers)
+    post_json(server, '/api/rpg/create_character', {'name': 'B', 'class': 'mage'}, headers)
+    server.module.characters.set_hp('alice', 'A', 60)
+    body = {'player1': {'name': 'A', 'class': 'mage', 'hp': 80}, 'player2': {'name': 'B', 'class': 'mage'}}
+    status, issued = post_json(server, '/api/rpg/seed', body, headers)
+    assert status == 200
+    # 已保存的角色按服务器上的职业和HP参战，请求里的数值不算
+    assert issued['player1'] == {'name': 'A', 'class': 'warrior', 'hp': 60}
+    assert post_json(server, '/api/rpg/seed', body, headers) == (400, {'error': 'Battle already pending'})
+
+    truth = offline_battle.simulate(issued['seed'], 'warrior', 'mage', 60, 80)
+    claim = {'seed': issued['seed'], 'ticket': issued['ticket'],
+             'player1': issued['player1'], 'player2': issued['player2'],
+             'result': {'winner': 2, 'rounds': 1, 'hp': [0, 80]}}
+    status, verdict = post_json(server, '/api/rpg/verify', claim, headers)
+    assert (status, verdict['valid']) == (200, truth['winner'] == 2 and truth['rounds'] == 1)
+    # 按服务器的结果写回HP并更新积分，票据不能再用
+    characters = server.module.characters
+    assert [characters.get('alice', 'A')[1], characters.get('alice', 'B')[1]] == truth['hp']
+    winner, loser = ('A', 'B') if truth['winner'] == 1 else ('B', 'A')
+    assert server.module.ratings.rating(character_store.qualify('alice', winner)) > 1500
+    assert server.module.ratings.rating(character_store.qualify('alice', loser)) < 1500
+    assert post_json(server, '/api/rpg/verify', claim, headers)[0] == 400
+
+
+def test_idempotent_battle_is_replayed(server):
+    for name in ('A', 'B'):
+        post_json(server, '/api/rpg/create_character', {'name': name, 'class': 'warrior'})
+    headers = {'Idempotency-Key': 'round-1', 'Content-Type': 'application/json'}
+    body = {'player1': 'A', 'player2': 'B'}
+    first, first_body = request(server, 'POST', '/api/rpg/battle', body, headers)
+    again, again_body = request(server, 'POST', '/api/rpg/battle', body, headers)
+    assert first.status == again.status == 200
+    assert again_body == first_body
+    assert again.getheader(idempotency.REPLAYED_HEADER) == 'true'
+    assert first.getheader(idempotency.REPLAYED_HEADER) is None
+    status, _ = post_json(server, '/api/rpg/battle', {'player1': 'B', 'player2': 'A'}, headers)
+    assert status == 422
+
+
+def test_rate_limit_returns_429(server, monkeypatch):
+    monkeypatch.setattr(server.module, 'limiter', rate_limit.TokenBucketLimiter(rate=0.001, burst=1))
+    assert request(server, 'GET', '/api/rpg/leaderboard')[0].status == 200
+    response, _ = request(server, 'GET', '/api/rpg/leaderboard')
+    assert response.status == 429
+    assert int(response.getheader('Retry-After')) > 0
+
+
+def test_leaderboard_rank_and_paging(server):
+    ratings = server.module.ratings
+    keys = [f'c{i}' for i in range(30)] + [character_store.qualify('p1', 'c0')]
+    ratings.add_many(keys)
+    for i in range(200):
+        ratings.record_result(keys[(i * 7) % len(keys)], keys[(i * 11 + 3) % len(keys)])
+    order = sorted(keys, key=lambda key: (-ratings.rating(key), key))
+
+    def names(entries):
+        return [character_store.qualify(entry['owner'], entry['name']) for entry in entries]
+
+    status, board = fetch_json(server, '/api/rpg/leaderboard?top=5&start=3')
+    assert status == 200 and board['total'] == len(keys)
+    assert names(board['top']) == order[2:7]
+    assert [entry['rank'] for entry in board['top']] == [3, 4, 5, 6, 7]
+    # 分页拼起来就是完整的排名，最后一页不足 count 个
+    pages = []
+    for start in range(1, len(keys) + 1, 8):
+        pages += names(fetch_json(server, f'/api/rpg/leaderboard?top=8&start={start}')[1]['top'])
+    assert pages == order
+    assert fetch_json(server, f'/api/rpg/leaderboard?start={len(keys) + 1}')[1]['top'] == []
+
+    # 同名角色按玩家ID区分
+    key = character_store.qualify('p1', 'c0')
+    status, board = fetch_json(server, '/api/rpg/leaderboard?name=c0&around=1', {'X-Player-Id': 'p1'})
+    assert board['rank'] == order.index(key) + 1
+    assert key in names(board['around']) and len(board['around']) <= 3
+    assert fetch_json(server, '/api/rpg/leaderboard?name=c0')[1]['rank'] == order.index('c0') + 1
+    assert fetch_json(server, '/api/rpg/leaderboard?name=nobody')[1]['rank'] is None
+    assert fetch_json(server, '/api/rpg/leaderboard?top=x')[0] == 400
+
+
+def test_admin_snapshot_create_list_and_restore(server, monkeypatch, tmp_path):
+    import state_snapshot
+    module = server.module
+    monkeypatch.setattr(module, 'snapshots', state_snapshot.Snapshotter(
+        str(tmp_path), module.snapshot_state, module.characters_frozen, timeout=10))
+    assert fetch_json(server, '/api/admin/snapshots')[0] == 404
+    monkeypatch.setenv('ADMIN_TOKEN', 'secret')
+    assert fetch_json(server, '/api/admin/snapshots', {'Authorization': 'Bearer wrong'})[0] == 401
+    auth = {'Authorization': 'Bearer secret'}
+
+    post_json(server, '/api/rpg/create_character', {'name': 'A', 'class': 'warrior'})
+    post_json(server, '/api/rpg/create_character', {'name': 'B', 'class': 'mage'}, {'X-Player-Id': 'p1'})
+    status, job = fetch_json(server, '/api/admin/snapshot', auth, {})
+    assert status == 202 and job['pause_ms'] >= 0
+    deadline = time.monotonic() + 10
+    while module.snapshots.jobs[job['name']] == 'running' and time.monotonic() < deadline:
+        time.sleep(0.01)
+    listing = fetch_json(server, '/api/admin/snapshots', auth)[1]['snapshots']
+    assert [(entry['name'], entry['status']) for entry in listing] == [(job['name'], 'done')]
+
+    # 拍快照之后的修改在回滚时丢弃
+    post_json(server, '/api/rpg/create_character', {'name': 'C', 'class': 'warrior'})
+    assert fetch_json(server, '/api/admin/stats', auth)[1]['characters']['total'] == 3
+    status, restored = fetch_json(server, '/api/admin/restore', auth, {'name': job['name']})
+    assert status == 200 and restored['characters'] == 2 and restored['backup'] != job['name']
+    stats = fetch_json(server, '/api/admin/stats', auth)[1]['characters']
+    assert stats['total'] == 2 and stats['by_class'] == {'战士': 1, '法师': 1}
+    characters = fetch_json(server, '/api/admin/characters?class=mage', auth)[1]
+    assert [(entry['owner'], entry['name']) for entry in characters['characters']] == [('p1', 'B')]
+
+    assert fetch_json(server, '/api/admin/restore', auth, {'name': 'missing.snap'})[0] == 404
+    assert fetch_json(server, '/api/admin/restore', auth, {'name': '../state.snap'})[0] == 400
+
+
+def test_only_pages_and_public_files_are_served(server):
+    for path in ('/', '/rpg', '/rpg?x=1', '/cave.html'):
+        assert request(server, 'GET', path)[0].status == 200, path
+    for path in ('/simple_web_games.py', '/templates/', '/tests/', '/requests.jsonl', '/../etc/passwd',
+                 '/%2e%2e/simple_web_games.py', '/..%2fsimple_web_games.py', '/public/', '/README.md'):
+        assert request(server, 'GET', path)[0].status == 404, path
+
+
+def test_public_directory_is_served_with_ranges(server):
+    name = '生成网页版好看界面的游戏.md'
+    with open(os.path.join(ROOT, 'public', name), 'rb') as f:
+        document = f.read()
+    path = '/' + urllib.parse.quote(name)
+    response, body = request(server, 'GET', path)
+    assert (response.status, body) == (200, document)
+    assert response.getheader('Content-Type') == 'text/markdown; charset=utf-8'
+    response, body = request(server, 'GET', path, headers={'Range': 'bytes=100-199'})
+    assert (response.status, body) == (206, document[100:200])
+
+
+def test_range_requests(server):
+    with open(os.path.join(ROOT, 'templates', 'simple_rpg.html'), 'rb') as f:
+        page = f.read()
+    response, body = request(server, 'GET', '/rpg', headers={'Range': 'bytes=0-9'})
+    assert response.status == 206
+    assert body == page[:10]
+    assert response.getheader('Content-Range') == f'bytes 0-9/{len(page)}'
+    response, body = request(server, 'GET', '/rpg', headers={'Range': 'bytes=-5'})
+    assert (response.status, body) == (206, page[-5:])
+    # 无效的范围忽略，发送完整文件；无法满足的范围返回 416
+    response, body = request(server, 'GET', '/rpg', headers={'Range': 'bytes=5-3'})
+    assert (response.status, body) == (200, page)
+    response, body = request(server, 'GET', '/rpg', headers={'Range': f'bytes={len(page)}-'})
+    assert response.status == 416
+    assert response.getheader('Content-Range') == f'bytes */{len(page)}'
+    # If-Range 对不上时发送完整的新版本
+    response, body = request(server, 'GET', '/rpg', headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert (response.status, body) == (200, page)
+    etag = response.getheader('ETag')
+    assert request(server, 'GET', '/rpg', headers={'If-None-Match': etag})[0].status == 304
+
+
+def test_keep_alive_connection_serves_several_requests(server):
+    conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=5)
+    for _ in range(3):
+        response, _ = request(server, 'GET', '/api/rpg/leaderboard', connection=conn)
+        assert response.status == 200
+        assert not response.will_close
+    conn.close()
+
+
+def test_shutdown_closes_idle_keep_alive_connections(server):
+    conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=5)
+    request(server, 'GET', '/api/rpg/leaderboard', connection=conn)
+    started = time.monotonic()
+    server.shutdown()
+    server.server_close()
+    # 不用等长连接的空闲超时（KEEP_ALIVE_TIMEOUT）
+    assert time.monotonic() - started < 2
+    assert conn.sock.recv(1) == b''
+    conn.close()
+
+
+def test_websocket_duel_over_http(server):
+    sockets = []
+    for name in ('Alice', 'Bob'):
+        sock = socket.create_connection(('127.0.0.1', server.port), timeout=5)
+        key = base64.b64encode(os.urandom(16)).decode('ascii')
+        sock.sendall((f'GET /ws/duel?room=r&name={name}&class=warrior HTTP/1.1\r\n'
+                      f'Host: localhost\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                      f'Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n').encode('ascii'))
+        response = b''
+        while b'\r\n\r\n' not in response:
+            response += sock.recv(1)
+        assert response.startswith(b'HTTP/1.1 101')
+        assert f'Sec-WebSocket-Accept: {duel_ws.accept_key(key)}'.encode('ascii') in response
+        sockets.append(sock)
+
+    read_messages(sockets[0], lambda m: m['type'] == 'start')
+    read_messages(sockets[1], lambda m: m['type'] == 'start')
+    sockets[0].sendall(client_frame(duel_ws.OP_TEXT, b'{"type": "forfeit"}'))
+    messages, close_code = read_messages(sockets[1], lambda m: False)
+    assert messages[-1] == {'type': 'end', 'winner': 2, 'reason': 'forfeit'}
+    assert close_code == duel_ws.CLOSE_NORMAL
+    for sock in sockets:
+        sock.close()
@@ -0,0 +1,94 @@
+"""
+幂等键：重试返回第一次的结果，并发的重复请求只执行一次，出错的请求不缓存
+"""
+
+import threading
+import time
+
+import pytest
+
+import idempotency
+
+
+def test_replay_returns_first_result():
+    cache = idempotency.IdempotencyCache(ttl=60)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {'round': len(calls)}
+    fp = idempotency.fingerprint('/api/rpg/battle', b'{}')
+    assert cache.run('k', fp, compute) == ({'round': 1}, False)
+    assert cache.run('k', fp, compute) == ({'round': 1}, True)
+    assert cache.run('other', fp, compute) == ({'round': 2}, False)
+    assert cache.hits == 1
+    with pytest.raises(idempotency.KeyReused):
+        cache.run('k', idempotency.fingerprint('/api/rpg/battle', b'{"x": 1}'), compute)
+
+
+def test_concurrent_duplicates_are_coalesced():
+    cache = idempotency.IdempotencyCache(ttl=60)
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'done'
+    results = []
+    leader = threading.Thread(target=lambda: results.append(cache.run('k', b'fp', compute)))
+    leader.start()
+    assert started.wait(5)
+    follower = threading.Thread(target=lambda: results.append(cache.run('k', b'fp', compute)))
+    follower.start()
+    deadline = time.monotonic() + 5
+    while cache.coalesced == 0 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert len(calls) == 1
+    assert sorted(results) == [('done', False), ('done', True)]
+
+
+def test_errors_are_not_cached_and_waiters_time_out():
+    cache = idempotency.IdempotencyCache(ttl=60, wait_timeout=0.05)
+
+    def fail():
+        raise ValueError('boom')
+    with pytest.raises(ValueError):
+        cache.run('k', b'fp', fail)
+    assert cache.run('k', b'fp', lambda: 'retried') == ('retried', False)
+
+    release = threading.Event()
+    leader = threading.Thread(target=cache.run, args=('slow', b'fp', lambda: release.wait(5)))
+    leader.start()
+    deadline = time.monotonic() + 5
+    while 'slow' not in cache._running and time.monotonic() < deadline:
+        time.sleep(0.001)
+    with pytest.raises(idempotency.StillRunning):
+        cache.run('slow', b'fp', lambda: 'duplicate')
+    release.set()
+    leader.join(5)
+
+
+def test_results_expire_and_are_bounded():
+    cache = idempotency.IdempotencyCache(ttl=0.01, max_entries=2)
+    for key in ('a', 'b', 'c'):
+        cache.run(key, b'fp', lambda: key)
+    assert len(cache) == 2
+    time.sleep(0.02)
+    assert cache.run('c', b'fp', lambda: 'again') == ('again', False)
+    assert len(cache) == 1
+
+
+def test_keys_and_fingerprints():
+    assert idempotency.validate_key(None) is None
+    assert idempotency.validate_key('  ') is None
+    assert idempotency.validate_key(' abc ') == 'abc'
+    with pytest.raises(ValueError):
+        idempotency.validate_key('x' * (idempotency.MAX_KEY_LENGTH + 1))
+    # 每一段都带长度前缀，拼接方式不同的请求不会撞在一起
+    assert idempotency.fingerprint('ab', 'c') != idempotency.fingerprint('a', 'bc')
+    assert idempotency.fingerprint('a', b'b') == idempotency.fingerprint(b'a', 'b')
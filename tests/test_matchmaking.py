@@ -0,0 +1,117 @@
+"""
+匹配队列：配对规则和空分数段的回收
+"""
+
+import threading
+
+import matchmaking
+
+
+def make_queue(**kwargs):
+    matches = []
+
+    def on_match(name1, name2):
+        matches.append((name1, name2))
+        return {'players': [name1, name2]}
+    return matchmaking.MatchQueue(on_match, **kwargs), matches
+
+
+def test_empty_buckets_are_removed():
+    queue, matches = make_queue(bucket_size=10, widen_every=1.0, max_wait=5.0)
+    for i in range(200):
+        assert queue.enqueue(f'p{i}', '战士', i * 100, now=0.0) is None
+    for i in range(100):
+        queue.leave(f'p{i}')
+    # 超过 max_wait 后不限分数：离开的玩家所在的分数段在查找时被清掉，剩下的两两配对
+    queue.sweep(now=10.0)
+    assert len(queue) == 0
+    assert len(matches) == 50
+    assert queue._buckets == {}
+
+
+def test_unlimited_width_picks_nearest_bucket_first():
+    queue, matches = make_queue(bucket_size=10, widen_every=1.0, max_wait=5.0)
+    queue.enqueue('far', '战士', 900, now=0.0)
+    queue.enqueue('near', '战士', 300, now=0.0)
+    queue.enqueue('old', '战士', 0, now=-10.0)
+    assert queue.sweep(now=10.0) == 1
+    assert matches == [('near', 'old')]
+    assert queue.is_waiting('far')
+    assert list(queue._buckets) == [('战士', 90)]
+
+
+def test_enqueue_pairs_only_with_adjacent_buckets():
+    queue, matches = make_queue(bucket_size=10)
+    assert queue.enqueue('mage', '法师', 1000, now=0.0) is None
+    assert queue.enqueue('warrior', '战士', 1030, now=0.0) is None
+    # 刚入队时只看自己和相邻的分数段
+    result = queue.enqueue('newcomer', '战士', 1025, now=0.0)
+    assert result == {'players': ['warrior', 'newcomer']}
+    assert queue.result('warrior') == queue.result('newcomer') == result
+    assert queue.enqueue('far', '战士', 1100, now=0.0) is None
+    assert len(queue) == 2
+
+
+def test_waiting_players_widen_their_range_over_time():
+    queue, matches = make_queue(bucket_size=10, widen_every=1.0, max_wait=5.0)
+    queue.enqueue('a', '战士', 1000, now=0.0)
+    queue.enqueue('b', '战士', 1030, now=0.0)
+    # 等了 t 秒可以跨 1 + t 个分数段：1.5 秒时还差一段，2.5 秒时相差3段的两人配对
+    assert queue.sweep(now=0.5) == 0
+    assert queue.sweep(now=1.5) == 0
+    assert queue.sweep(now=2.5) == 1
+    assert matches == [('b', 'a')]
+
+
+def test_leave_and_rejoin():
+    queue, matches = make_queue()
+    queue.enqueue('a', '战士', 1000, now=0.0)
+    assert queue.enqueue('a', '战士', 1000, now=0.0) is None  # 已在队列里：不能和自己配对
+    assert queue.leave('a')
+    assert not queue.leave('a')
+    assert queue.enqueue('b', '战士', 1000, now=0.0) is None
+    queue.enqueue('a', '战士', 1000, now=1.0)
+    assert matches == [('b', 'a')]
+    assert not queue.is_waiting('a') and not queue.is_waiting('b')
+
+
+def test_sweep_pairs_a_capped_batch_and_plays_it_in_the_background():
+    started = threading.Event()
+    release = threading.Event()
+    played = []
+
+    def on_match(name1, name2):
+        started.set()
+        release.wait(5)
+        played.append((name1, name2))
+        return {'players': [name1, name2]}
+
+    queue = matchmaking.MatchQueue(on_match, background=True, max_pairs=3)
+    for i in range(10):
+        queue.enqueue(f'p{i}', '战士', i * 1000, now=0.0)
+    # 调用 sweep 的线程不等对局打完；每次最多配出 max_pairs 对
+    assert queue.sweep(now=10.0) == 3
+    assert started.wait(5)
+    assert queue.sweep(now=10.0) == 2
+    assert len(queue) == 0
+    # 后台还没打完的玩家仍算在等待中，不能重复入队
+    assert queue.is_waiting('p0') and queue.result('p0') is None
+    assert queue.enqueue('p0', '战士', 0, now=11.0) is None and len(queue) == 0
+    release.set()
+    queue.close(timeout=5)
+    assert len(played) == 5
+    assert not any(queue.is_waiting(f'p{i}') for i in range(10))
+    assert queue.result('p0') in [{'players': list(pair)} for pair in played]
+
+
+def test_failed_background_match_frees_the_players(capsys):
+    def on_match(name1, name2):
+        raise RuntimeError('boom')
+
+    queue = matchmaking.MatchQueue(on_match, background=True)
+    queue.enqueue('a', '战士', 0, now=0.0)
+    queue.enqueue('b', '战士', 5000, now=0.0)
+    assert queue.sweep(now=10.0) == 1
+    queue.close(timeout=5)
+    assert not queue.is_waiting('a') and queue.result('a') is None
+    assert 'boom' in capsys.readouterr().err
@@ -0,0 +1,173 @@
+"""
+离线战斗：Python 的 Mulberry32 / simulate 和 rpg.html 里的 JavaScript 版本逐位一致，校验逻辑正确
+
+JavaScript 部分从 rpg.html 里截取 CLASS_PROFILES、mulberry32、randint、fightOffline，
+用 node 执行；没有安装 node 时跳过。
+"""
+
+import json
+import os
+import shutil
+import subprocess
+
+import pytest
+
+import offline_battle
+from conftest import ROOT
+
+SEEDS = [0, 1, 42, 2 ** 31 - 1, 2 ** 32 - 1, 123456789]
+
+
+def extract_script(path, start_marker, end_marker):
+    with open(path, encoding='utf-8') as f:
+        html = f.read()
+    start = html.index(start_marker)
+    return html[start:html.index(end_marker, start)]
+
+
+@pytest.fixture(scope='module')
+def node_fight():
+    node = shutil.which('node')
+    if node is None:
+        pytest.skip('需要 node 才能运行页面里的 JavaScript')
+    script = extract_script(os.path.join(ROOT, 'rpg.html'), 'const CLASS_PROFILES', '// Tickets are bound')
+
+    def run(expression):
+        program = script + f'\nprocess.stdout.write(JSON.stringify({expression}));\n'
+        result = subprocess.run([node, '-e', program], capture_output=True, text=True, check=True)
+        return json.loads(result.stdout)
+    return run
+
+
+def test_random_stream_matches_javascript(node_fight):
+    streams = node_fight('Object.fromEntries(%s.map(s => { const r = mulberry32(s); '
+                         'return [String(s), Array.from({length: 200}, () => r())]; }))' % json.dumps(SEEDS))
+    for seed in SEEDS:
+        rng = offline_battle.Mulberry32(seed)
+        assert streams[str(seed)] == [rng.random() for _ in range(200)]
+
+
+@pytest.mark.parametrize('class1,class2', [('warrior', 'mage'), ('mage', 'mage'), ('warrior', 'warrior')])
+def test_fight_matches_javascript(node_fight, class1, class2):
+    seeds = list(range(50)) + SEEDS
+    hp1 = offline_battle.ATTACK_PROFILES[offline_battle.normalize_class(class1)]['hp']
+    hp2 = offline_battle.ATTACK_PROFILES[offline_battle.normalize_class(class2)]['hp']
+    results = node_fight('%s.map(s => fightOffline(s, %s, %s, %d, %d))'
+                         % (json.dumps(seeds), json.dumps(class1), json.dumps(class2), hp1, hp2))
+    for seed, js in zip(seeds, results):
+        expected = offline_battle.simulate(seed, class1, class2)
+        assert (js['winner'], js['rounds'], js['hp']) == (expected['winner'], expected['rounds'], expected['hp'])
+        events = [[event['attacker'] + 1, event['damage'], event['special']]
+                  for round_events in js['log'] for event in round_events]
+        assert events == expected['events']
+
+
+def test_randint_covers_range_uniformly():
+    rng = offline_battle.Mulberry32(99)
+    counts = {}
+    for _ in range(22000):
+        value = rng.randint(20, 30)
+        counts[value] = counts.get(value, 0) + 1
+    assert sorted(counts) == list(range(20, 31))
+    assert max(counts.values()) - min(counts.values()) < 300
+
+
+def request(name1='w', name2='m', class2_hp=50):
+    return {'player1': {'name': name1, 'class': 'warrior'},
+            'player2': {'name': name2, 'class': 'mage', 'hp': class2_hp}}
+
+
+def issued_claim(seeds, class2_hp=50, names=('w', 'm')):
+    """像浏览器一样：为两个角色要一个种子，按返回的数值打完，上传结果"""
+    pair = offline_battle.fighters(request(*names, class2_hp=class2_hp), 'p1')
+    issued = seeds.issue(pair)
+    issued.update(offline_battle.fighters_json(pair))
+    truth = offline_battle.simulate(issued['seed'], issued['player1']['class'], issued['player2']['class'],
+                                    issued['player1']['hp'], issued['player2']['hp'])
+    return {'seed': issued['seed'], 'ticket': issued['ticket'],
+            'player1': issued['player1'], 'player2': issued['player2'],
+            'result': {'winner': truth['winner'], 'rounds': truth['rounds'], 'hp': truth['hp']}}
+
+
+def test_fighters_prefer_stored_characters():
+    stored = {'w': ('战士', 30)}
+    pair = offline_battle.fighters(request(), 'p1', stored.get)
+    assert pair == (('p1\0w', '战士', 30), ('p1\0m', '法师', 50))
+    assert offline_battle.fighters_json(pair)['player1'] == {'name': 'w', 'class': 'warrior', 'hp': 30}
+    for bad in (request(class2_hp=81), request(class2_hp=0), request('w', 'w'), request(''), {'player1': 'w'}):
+        with pytest.raises(ValueError):
+            offline_battle.fighters(bad, 'p1')
+    with pytest.raises(ValueError, match='Invalid hp'):
+        offline_battle.fighters(request(), 'p1', {'w': ('战士', 0)}.get)
+
+
+def test_verify_claim_accepts_only_the_replayed_result():
+    cache = offline_battle.VerificationCache(max_entries=2)
+    seeds = offline_battle.SeedIssuer(secret='test')
+    settled = []
+    first = issued_claim(seeds)
+    assert offline_battle.verify_claim(first, cache, seeds, 'p1', lambda *args: settled.append(args))['valid']
+
+    claim = issued_claim(seeds)
+    truth = claim['result']
+    forged = dict(claim, result=dict(truth, winner=3 - (truth['winner'] or 1)))
+    verdict = offline_battle.verify_claim(forged, cache, seeds, 'p1', lambda *args: settled.append(args))
+    assert not verdict['valid']
+    # 声称的结果不对也按服务器算出的结果结算
+    assert [result for _, result in settled] == [first['result'], truth]
+    with pytest.raises(ValueError):
+        offline_battle.verify_claim({'seed': 'x'}, cache, seeds, 'p1')
+
+
+def test_seed_tickets_are_single_use_and_bound_to_the_fighters():
+    cache = offline_battle.VerificationCache()
+    seeds = offline_battle.SeedIssuer(secret='test', ttl=60)
+    claim = issued_claim(seeds)
+    offline_battle.verify_claim(claim, cache, seeds, 'p1')
+    with pytest.raises(ValueError, match='already used'):
+        offline_battle.verify_claim(claim, cache, seeds, 'p1')
+
+    # 客户端自选的种子、改过的种子或参战角色、别的玩家、别的密钥签的票据都不认
+    fresh = issued_claim(seeds)
+    other = offline_battle.SeedIssuer(secret='other').issue(offline_battle.fighters(request(), 'p1'))
+    for bad, owner in ((dict(fresh, ticket=None), 'p1'), (dict(fresh, seed=fresh['seed'] ^ 1), 'p1'),
+                       (dict(fresh, player2=dict(fresh['player2'], hp=1)), 'p1'),
+                       (dict(fresh, player2=dict(fresh['player2'], name='x')), 'p1'),
+                       (fresh, 'p2'), (dict(fresh, ticket=other['ticket'], seed=other['seed']), 'p1')):
+        with pytest.raises(ValueError, match='Invalid seed ticket'):
+            offline_battle.verify_claim(bad, cache, seeds, owner)
+    offline_battle.verify_claim(fresh, cache, seeds, 'p1')
+
+    pair = offline_battle.fighters(request(), 'p1')
+    issued = seeds.issue(pair, now=1000)
+    with pytest.raises(ValueError, match='expired'):
+        seeds.redeem(issued['ticket'], issued['seed'], pair, now=1061)
+    # 多个实例共用密钥时互相认可
+    seeds.redeem(issued['ticket'], issued['seed'], pair, now=1001)
+    with pytest.raises(ValueError, match='Invalid seed ticket'):
+        offline_battle.SeedIssuer(secret='other').redeem(issued['ticket'], issued['seed'], pair, now=1001)
+    offline_battle.SeedIssuer(secret='test').redeem(issued['ticket'], issued['seed'], pair, now=1001)
+
+
+def test_one_pending_ticket_per_pair_and_expired_tickets_are_settled():
+    cache = offline_battle.VerificationCache()
+    seeds = offline_battle.SeedIssuer(secret='test', ttl=60)
+    pair = offline_battle.fighters(request(), 'p1')
+    first = seeds.issue(pair, now=1000)
+    # 同一对角色（不论顺序）在第一张票据校验或过期之前不能再要种子，别的组合不受影响
+    for again in (pair, offline_battle.fighters(request('m', 'w'), 'p1')):
+        with pytest.raises(ValueError, match='already pending'):
+            seeds.issue(again, now=1010)
+    seeds.issue(offline_battle.fighters(request('w', 'x'), 'p1'), now=1010)
+
+    settled = []
+    offline_battle.settle_expired(cache, seeds, lambda *args: settled.append(args), now=1030)
+    assert settled == []
+    # 过期没有校验的票据按服务器算出的结果结算，然后这一对角色可以再要种子
+    offline_battle.settle_expired(cache, seeds, lambda *args: settled.append(args), now=1061)
+    assert settled == [(pair, offline_battle.outcome(cache, first['seed'], pair))]
+    second = seeds.issue(pair, now=1061)
+    seeds.redeem(second['ticket'], second['seed'], pair, now=1062)
+    seeds.issue(pair, now=1062)
+    offline_battle.settle_expired(cache, seeds, lambda *args: settled.append(args), now=1075)
+    assert len(settled) == 2  # 已经校验过的票据不会再结算
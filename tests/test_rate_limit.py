@@ -0,0 +1,103 @@
+"""
+限流和准入控制：令牌桶的速率和突发、客户端识别（反向代理）、过载时拒绝新请求
+"""
+
+import pytest
+
+import rate_limit
+
+
+def test_token_bucket_allows_burst_then_refills():
+    limiter = rate_limit.TokenBucketLimiter(rate=2.0, burst=3.0)
+    assert [limiter.allow('a', now=0.0)[0] for _ in range(3)] == [True] * 3
+    allowed, retry_after = limiter.allow('a', now=0.0)
+    assert not allowed
+    assert retry_after == pytest.approx(0.5)
+    # 其他客户端不受影响
+    assert limiter.allow('b', now=0.0)[0]
+    # 0.5 秒补充一个令牌，桶不会超过容量
+    assert limiter.allow('a', now=0.5)[0]
+    assert not limiter.allow('a', now=0.5)[0]
+    assert [limiter.allow('a', now=100.0)[0] for _ in range(4)] == [True, True, True, False]
+
+
+def test_zero_rate_disables_limiting():
+    limiter = rate_limit.TokenBucketLimiter(rate=0, burst=1)
+    assert all(limiter.allow('a', now=0.0)[0] for _ in range(1000))
+    assert len(limiter) == 0
+
+
+def test_least_recently_seen_clients_are_evicted():
+    limiter = rate_limit.TokenBucketLimiter(rate=1.0, burst=1.0, max_clients=2)
+    limiter.allow('a', now=0.0)
+    limiter.allow('b', now=0.0)
+    limiter.allow('a', now=0.0)
+    limiter.allow('c', now=0.0)
+    assert len(limiter) == 2
+    # b 被淘汰，重新拿到满桶；a 还在，桶是空的
+    assert limiter.allow('b', now=0.0)[0]
+    assert not limiter.allow('c', now=0.0)[0]
+
+
+@pytest.mark.parametrize('env,forwarded,expected', [
+    ({}, '1.1.1.1', '10.0.0.1'),
+    ({'TRUST_PROXY': '1'}, '6.6.6.6, 1.1.1.1', '1.1.1.1'),
+    ({'TRUST_PROXY': '2'}, '6.6.6.6, 1.1.1.1, 10.0.0.2', '1.1.1.1'),
+    ({'TRUST_PROXY': '3'}, '1.1.1.1', '1.1.1.1'),
+    # Heroku：路由把客户端地址追加在末尾，伪造的第一个地址不起作用
+    ({'DYNO': 'web.1'}, '6.6.6.6,1.1.1.1', '1.1.1.1'),
+    ({'DYNO': 'web.1', 'TRUST_PROXY': '0'}, '1.1.1.1', '10.0.0.1'),
+    ({'DYNO': 'web.1'}, None, '10.0.0.1'),
+    ({'TRUST_PROXY': '1'}, ' , ', '10.0.0.1'),
+])
+def test_client_key(monkeypatch, env, forwarded, expected):
+    monkeypatch.delenv('TRUST_PROXY', raising=False)
+    monkeypatch.delenv('DYNO', raising=False)
+    for key, value in env.items():
+        monkeypatch.setenv(key, value)
+    assert rate_limit.client_key('10.0.0.1', forwarded, rate_limit.trusted_proxies()) == expected
+
+
+@pytest.mark.parametrize('value', ['yes', '-1', '1.5', '0x1'])
+def test_invalid_trust_proxy_is_rejected(monkeypatch, value):
+    monkeypatch.setenv('TRUST_PROXY', value)
+    with pytest.raises(ValueError, match='TRUST_PROXY'):
+        rate_limit.trusted_proxies()
+
+
+def test_vercel_handler_uses_the_trusted_hop(monkeypatch):
+    """Vercel 把客户端IP追加到 x-forwarded-for 末尾：伪造的第一个地址换了也还是同一个令牌桶"""
+    import api.index as api
+    monkeypatch.setattr(rate_limit, 'TRUSTED_PROXIES', 1)
+    monkeypatch.setattr(api, 'limiter', rate_limit.TokenBucketLimiter(rate=1.0, burst=1.0))
+    statuses = []
+    for spoofed in ('6.6.6.1', '6.6.6.2'):
+        response = api.handler({'url': '/api/rpg/roster', 'method': 'GET',
+                                'headers': {'X-Forwarded-For': f'{spoofed}, 1.1.1.1'}})
+        statuses.append(response['statusCode'])
+    assert statuses == [200, 429]
+
+
+def test_admission_sheds_load():
+    state = {'size': 0}
+    admission = rate_limit.AdmissionController(lambda: state['size'], max_in_flight=2,
+                                               max_state=10, max_memory_mb=0)
+    assert admission.enter() is None
+    assert admission.enter() is None
+    assert admission.enter() == 'Server busy'
+    admission.leave()
+    # 状态过多时只拒绝会新增状态的请求
+    state['size'] = 10
+    assert admission.enter(allocates=True) == 'Too many active games'
+    assert admission.enter() is None
+    assert admission.in_flight == 2
+    assert admission.shed == 2
+
+
+def test_memory_limit_is_checked_at_most_once_per_interval(monkeypatch):
+    readings = iter([100.0, 10.0])
+    monkeypatch.setattr(rate_limit, 'current_memory_mb', lambda: next(readings))
+    admission = rate_limit.AdmissionController(lambda: 0, max_in_flight=0, max_state=0, max_memory_mb=50)
+    assert admission.enter(allocates=True, now=10.0) == 'Server out of memory'
+    assert admission.enter(allocates=True, now=10.5) == 'Server out of memory'
+    assert admission.enter(allocates=True, now=11.0) is None
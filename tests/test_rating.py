@@ -0,0 +1,61 @@
+"""
+Elo积分排行榜：跳表的排名、翻页和批量重建都和直接排序的结果一致
+"""
+
+import random
+
+import pytest
+
+import rating
+
+
+def expected_order(board):
+    return sorted(board._stats, key=lambda name: (-board._stats[name][0], name))
+
+
+def assert_consistent(board):
+    order = expected_order(board)
+    assert list(board._index) == [(-board._stats[name][0], name) for name in order]
+    assert [entry['name'] for entry in board.top(len(order) + 5)] == order
+    for position, name in enumerate(order, 1):
+        assert board.rank(name) == position
+    for start in (1, 2, len(order) // 2, len(order)):
+        assert [entry['name'] for entry in board.top(7, start)] == order[start - 1:start + 6]
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_add_many_matches_incremental_adds(seed):
+    rng = random.Random(seed)
+    names = [f'p{rng.randrange(10 ** 6)}' for _ in range(500)]
+    one_by_one = rating.RatingBoard()
+    for name in names:
+        one_by_one.add(name)
+    bulk = rating.RatingBoard()
+    bulk.add_many(names)
+    assert list(bulk._index) == list(one_by_one._index)
+    assert_consistent(bulk)
+
+
+def test_add_many_keeps_existing_ratings_and_stays_updatable():
+    rng = random.Random(7)
+    board = rating.RatingBoard()
+    for _ in range(200):
+        board.record_result(f'p{rng.randrange(50)}', f'p{rng.randrange(50)}')
+    before = {name: board.rating(name) for name in board._stats}
+    board.add_many(f'p{i}' for i in range(100))
+    assert len(board) == 100
+    assert all(board.rating(name) == value for name, value in before.items())
+    assert_consistent(board)
+    # 重建后的跳表继续支持增量插入和删除
+    for _ in range(300):
+        board.record_result(f'p{rng.randrange(120)}', f'p{rng.randrange(120)}')
+    assert_consistent(board)
+
+
+def test_add_many_with_nothing_new_leaves_board_alone():
+    board = rating.RatingBoard()
+    board.add_many([])
+    assert len(board) == 0 and board.top(5) == []
+    board.add('a')
+    board.add_many(['a'])
+    assert board.top(5) == [{'rank': 1, 'name': 'a', 'rating': 1500.0, 'wins': 0, 'losses': 0}]
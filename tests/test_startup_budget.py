@@ -0,0 +1,77 @@
+"""
+启动时间预算：解析 -X importtime 的输出，检查线程、延迟导入的模块和耗时
+"""
+
+import pytest
+
+import startup_budget
+
+IMPORTTIME = """\
+import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   _io
+import time:       300 |       2500 |     json.decoder
+import time:       900 |       4100 |   json
+import time:      1500 |      12000 | simple_web_games
+some other output
+"""
+
+
+def test_parse_importtime():
+    assert startup_budget.parse_importtime(IMPORTTIME) == {
+        '_io': 120, 'json.decoder': 2500, 'json': 4100, 'simple_web_games': 12000}
+
+
+def fake_probe(times, threads=1, modules=()):
+    def probe(module, env=None):
+        return dict(times), threads, set(modules)
+    return probe
+
+
+def test_check_passes_within_budget(monkeypatch):
+    monkeypatch.setattr(startup_budget, 'probe', fake_probe({'simple_web_games': 12000, 'json': 4100}))
+    passed, message = startup_budget.check('simple_web_games', 120, runs=3)
+    assert passed and message.startswith('✅') and '12.0ms' in message
+
+
+def test_check_reports_every_problem(monkeypatch):
+    monkeypatch.setattr(startup_budget, 'probe', fake_probe(
+        {'simple_web_games': 150000, 'json': 4100, 'duel_ws': 90000}, threads=2, modules=('duel_ws', 'json')))
+    passed, message = startup_budget.check('simple_web_games', 120, runs=1)
+    assert not passed
+    assert '1 个线程' in message
+    assert 'duel_ws' in message.split('延迟导入的模块')[1]
+    # 列出最慢的导入，最慢的排在前面
+    assert '超出预算 30.0ms' in message and message.index('duel_ws 90.0ms') < message.index('json 4.1ms')
+
+
+def test_check_keeps_the_fastest_run(monkeypatch):
+    totals = iter([200000, 90000, 150000])
+    monkeypatch.setattr(startup_budget, 'probe',
+                        lambda module, env=None: ({module: next(totals)}, 1, set()))
+    assert startup_budget.check('api.index', 100, runs=3)[0]
+
+
+@pytest.mark.parametrize('module', ['api.index', 'simple_web_games', '20linegame'])
+def test_real_entries_start_no_threads_and_defer_lazy_modules(module):
+    """真实导入一次：预算放得很宽，只检查和机器速度无关的两项"""
+    passed, message = startup_budget.check(module, 10 ** 6, runs=1)
+    assert passed, message
+
+
+def test_main_exit_codes(monkeypatch, capsys):
+    monkeypatch.setenv('STARTUP_BUDGET_SCALE', '1000')
+    assert startup_budget.main(['--only', 'api.index', '--runs', '1']) == 0
+    monkeypatch.setattr(startup_budget, 'probe', fake_probe({'api.index': 10 ** 9}))
+    assert startup_budget.main(['--only', 'api.index', '--runs', '1']) == 1
+
+    def broken_probe(module, env=None):
+        raise RuntimeError('boom')
+
+    monkeypatch.setattr(startup_budget, 'probe', broken_probe)
+    assert startup_budget.main(['--only', '20linegame']) == 1
+    assert '导入失败: boom' in capsys.readouterr().out
+
+
+def test_probe_reports_import_errors():
+    with pytest.raises(RuntimeError, match='no_such_module'):
+        startup_budget.probe('no_such_module')
@@ -0,0 +1,119 @@
+"""
+静态文件：Range 解析符合 RFC 9110，预构建页面按 Accept-Encoding 选择版本，打开文件的缓存
+"""
+
+import gzip
+import json
+import os
+
+import pytest
+
+import build_static
+import static_files
+
+
+@pytest.mark.parametrize('header,expected', [
+    ('bytes=0-4', (0, 4)),
+    ('bytes=5-', (5, 9)),
+    ('bytes=-3', (7, 9)),
+    ('bytes=-30', (0, 9)),
+    ('bytes=8-100', (8, 9)),
+    # 不按范围发送：没有、格式不对、多个范围、结束位置小于起始位置（无效范围直接忽略）
+    (None, None),
+    ('items=0-4', None),
+    ('bytes=0-1,3-4', None),
+    ('bytes=abc', None),
+    ('bytes=5-3', None),
+    # 无法满足：返回 416
+    ('bytes=10-', False),
+    ('bytes=-0', False),
+])
+def test_parse_range(header, expected):
+    assert static_files.parse_range(header, 10) == expected
+
+
+@pytest.mark.parametrize('header,coding,expected', [
+    ('gzip, deflate, br', 'br', True),
+    ('gzip;q=0, br', 'gzip', False),
+    ('GZIP;q=0.5', 'gzip', True),
+    ('*', 'br', True),
+    ('identity', 'gzip', False),
+    (None, 'gzip', False),
+])
+def test_accepts_encoding(header, coding, expected):
+    assert static_files.accepts_encoding(header, coding) is expected
+
+
+@pytest.mark.parametrize('url_path,expected', [
+    ('/robots.txt', os.path.join('public', 'robots.txt')),
+    ('/docs//guide%20v2.md', os.path.join('public', 'docs', 'guide v2.md')),
+    ('/%E6%B8%B8%E6%88%8F.md', os.path.join('public', '游戏.md')),
+    # 走出目录、隐藏文件、Windows 的分隔符和盘符、目录本身
+    ('/../secret', None),
+    ('/%2e%2e/secret', None),
+    ('/a/..%2f..%2fsecret', None),
+    ('/.git/config', None),
+    ('/..%5csecret', None),
+    ('/C:%5cWindows', None),
+    ('/a%00.md', None),
+    ('/', None),
+])
+def test_public_path(url_path, expected):
+    assert static_files.public_path('public', url_path) == expected
+
+
+def test_built_site_lookup_and_variants(tmp_path):
+    manifest = build_static.build(str(tmp_path))
+    (tmp_path / static_files.MANIFEST_NAME).write_text(json.dumps(manifest), encoding='utf-8')
+    site = static_files.StaticSite.load(str(tmp_path))
+    name, entry, immutable = site.lookup('/rpg?x=1')
+    assert not immutable and site.lookup('/rpg.html')[0] == name
+    assert site.lookup(static_files.STATIC_PREFIX + name) == (name, entry, True)
+    assert site.lookup('/static/../manifest.json') is None
+    assert site.lookup('/missing') is None
+
+    plain, encoding, etag = site.variant(name, None)
+    assert encoding is None and etag == f'"{entry["hash"]}"'
+    path, encoding, gzip_etag = site.variant(name, 'gzip')
+    assert encoding == 'gzip' and gzip_etag != etag
+    with open(path, 'rb') as f, open(plain, 'rb') as original:
+        assert gzip.decompress(f.read()) == original.read()
+    assert static_files.StaticSite.load(str(tmp_path / 'missing')) is None
+
+
+def test_fd_cache_reuses_and_reopens_files(tmp_path):
+    path = str(tmp_path / 'a.txt')
+    with open(path, 'wb') as f:
+        f.write(b'one')
+    cache = static_files.FdCache(max_entries=1)
+    with cache.open(path) as first:
+        pass
+    with cache.open(path) as again:
+        assert again is first and again.size == 3
+    # 文件变化后重新打开，旧的文件对象被关闭
+    with open(path, 'wb') as f:
+        f.write(b'three')
+    os.utime(path, ns=(1, 1))
+    with cache.open(path) as changed:
+        assert changed is not first and changed.size == 5
+    assert first.file.closed
+    with pytest.raises(OSError):
+        cache.open(str(tmp_path))
+
+
+def test_fd_cache_keeps_evicted_files_open_while_in_use(tmp_path):
+    paths = []
+    for name in ('a', 'b'):
+        paths.append(str(tmp_path / name))
+        with open(paths[-1], 'wb') as f:
+            f.write(name.encode())
+    cache = static_files.FdCache(max_entries=1)
+    held = cache.open(paths[0])
+    with cache.open(paths[1]):
+        pass
+    # a 已经被淘汰，但还有人在用，要等释放后才关闭
+    assert len(cache) == 1 and not held.file.closed
+    assert held.file.read(1) == b'a'
+    with held:
+        pass
+    assert held.file.closed
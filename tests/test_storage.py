@@ -0,0 +1,286 @@
+"""
+紧凑记录和存储结构：持久化日志/快照往返不丢信息，角色存储的二级索引和逐条遍历的结果一致
+"""
+
+import os
+import random
+import threading
+import time
+
+import pytest
+
+import character_store
+import persistence
+import state_snapshot
+
+NAMES = ['a', '战士甲', 'x' * 300, 'owner\0name', '🙂', '']
+
+
+def random_state(rng, characters=300, games=50):
+    character_state = {}
+    for i in range(characters):
+        owner = rng.choice([character_store.PUBLIC_OWNER, 'p1', '玩家2'])
+        name = rng.choice(NAMES).replace(character_store.KEY_SEPARATOR, '') + str(i)
+        key = character_store.qualify(owner, name)
+        character_state[key] = (rng.choice(persistence.CHARACTER_CLASSES), rng.randrange(0, 121))
+    game_state = {}
+    for i in range(games):
+        state = rng.choice(persistence.CAVE_STATES)
+        game_state[f'w0-{i}'] = (state, None if state == 'start' else rng.choice(['left', 'right']))
+    return character_state, game_state
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_record_round_trip(seed):
+    rng = random.Random(seed)
+    for _ in range(200):
+        name = rng.choice(NAMES) * rng.randrange(1, 3)
+        character_class = rng.choice(persistence.CHARACTER_CLASSES)
+        hp = rng.randrange(-50, 10 ** 6)
+        decoded = []
+        for payload in (persistence.encode_character_created(name, character_class, hp),
+                        persistence.encode_character_hp(name, hp),
+                        persistence.encode_cave_state(name, 'room', rng.choice(['left', 'right', None]))):
+            framed = persistence.frame(payload)
+            (unframed,) = list(persistence.iter_records(framed))
+            persistence.apply_record(unframed, lambda *args: decoded.append(('created',) + args),
+                                     lambda *args: decoded.append(('hp',) + args),
+                                     lambda *args: decoded.append(('cave',) + args))
+        assert decoded[0] == ('created', name, character_class, hp)
+        assert decoded[1] == ('hp', name, hp)
+        assert decoded[2][:3] == ('cave', name, 'room')
+
+
+def test_truncated_or_corrupt_records_are_dropped():
+    records = [persistence.frame(persistence.encode_character_hp(f'c{i}', i)) for i in range(10)]
+    data = b''.join(records)
+    assert len(list(persistence.iter_records(data))) == 10
+    assert len(list(persistence.iter_records(data[:-3]))) == 9
+    corrupt = bytearray(data)
+    corrupt[len(records[0]) * 5 + 9] ^= 0xFF
+    assert len(list(persistence.iter_records(bytes(corrupt)))) == 5
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_snapshot_round_trip(tmp_path, seed):
+    characters, games = random_state(random.Random(seed))
+    path = str(tmp_path / 'state.snap')
+    persistence.write_snapshot(path, characters, games)
+    assert persistence.load_snapshot(path) == (characters, games)
+
+
+def test_journal_recovers_log_and_snapshot(tmp_path):
+    rng = random.Random(1)
+    characters, games = random_state(rng, characters=100, games=10)
+    journal = persistence.Journal(str(tmp_path), commit_interval=0.001, snapshot_every=150)
+    journal.recover(None, None, None)
+    journal.start(lambda: (dict(characters), dict(games)))
+    for key, (character_class, hp) in characters.items():
+        journal.record_character_created(key, character_class, 120)
+        journal.record_character_hp(key, hp)
+    for game_id, (state, previous_choice) in games.items():
+        journal.record_cave_state(game_id, state, previous_choice)
+    journal.close()
+
+    recovered_characters, recovered_games = {}, {}
+    restored = persistence.Journal(str(tmp_path))
+    restored.recover(
+        lambda key, character_class, hp: recovered_characters.__setitem__(key, (character_class, hp)),
+        lambda key, hp: recovered_characters.__setitem__(key, (recovered_characters[key][0], hp)),
+        lambda game_id, state, previous_choice: recovered_games.__setitem__(game_id, (state, previous_choice)))
+    assert recovered_characters == characters
+    assert recovered_games == games
+
+
+def test_snapshotter_writes_loadable_snapshots(tmp_path):
+    characters, games = random_state(random.Random(2))
+    snapshots = state_snapshot.Snapshotter(str(tmp_path), lambda: (characters, games))
+    job = snapshots.create()
+    assert job['pause_ms'] >= 0
+    deadline = time.monotonic() + 10
+    while snapshots.jobs[job['name']] == 'running' and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert snapshots.jobs[job['name']] == 'done'
+    assert snapshots.load(job['name']) == (characters, games)
+    with pytest.raises(ValueError):
+        snapshots.load('../state.snap')
+
+
+def wait_for_job(snapshots, name, seconds=10):
+    deadline = time.monotonic() + seconds
+    while snapshots.jobs[name] == 'running' and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return snapshots.jobs[name]
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='需要 fork')
+def test_snapshot_fork_does_not_inherit_held_locks(tmp_path):
+    store = character_store.CharacterStore()
+    store.put('p1', '阿强', '战士', 100)
+    # 另一个线程正拿着角色的分段锁；fork 时如果不等它，子进程里这把锁永远不会被释放
+    holding = threading.Event()
+
+    def hold_character():
+        with store.locked(('p1', '阿强')):
+            holding.set()
+            time.sleep(0.2)
+            store.set_hp('p1', '阿强', 90)
+
+    def get_state():
+        with store.locked(('p1', '阿强')):
+            return {character_store.qualify(owner, name): (character_class, hp)
+                    for owner, name, character_class, hp in store.items()}, {}
+
+    worker = threading.Thread(target=hold_character)
+    worker.start()
+    holding.wait()
+    snapshots = state_snapshot.Snapshotter(str(tmp_path), get_state, store.frozen, timeout=10)
+    job = snapshots.create()
+    worker.join()
+    assert wait_for_job(snapshots, job['name']) == 'done'
+    # fork 等到修改完成才发生，快照里是改完之后的血量
+    assert snapshots.load(job['name']) == ({character_store.qualify('p1', '阿强'): ('战士', 90)}, {})
+    with store.locked(('p1', '阿强')):
+        pass
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='需要 fork')
+def test_snapshot_child_is_killed_after_timeout(tmp_path):
+    def get_state():
+        time.sleep(60)
+        return {}, {}
+
+    snapshots = state_snapshot.Snapshotter(str(tmp_path), get_state, timeout=0.3)
+    started = time.monotonic()
+    job = snapshots.create()
+    assert wait_for_job(snapshots, job['name']) == 'failed'
+    assert time.monotonic() - started < 10
+    assert os.listdir(tmp_path) == []
+    assert snapshots.list() == [{'name': job['name'], 'size': None, 'status': 'failed'}]
+
+
+def brute_force(store, character_class=None, min_hp=None, max_hp=None, alive=None):
+    return sorted(entry for entry in store.items()
+                  if (character_class is None or entry[2] == character_class)
+                  and (min_hp is None or entry[3] >= min_hp)
+                  and (max_hp is None or entry[3] <= max_hp)
+                  and (alive is None or (entry[3] > 0) == alive))
+
+
+QUERIES = [{}, {'character_class': '战士'}, {'min_hp': 10, 'max_hp': 60}, {'alive': False},
+           {'character_class': '法师', 'alive': True, 'max_hp': 40}]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_index_matches_full_scan(seed):
+    rng = random.Random(seed)
+    store = character_store.CharacterStore()
+    for _ in range(3000):
+        owner = f'o{rng.randrange(5)}'
+        name = f'n{rng.randrange(300)}'
+        operation = rng.random()
+        if operation < 0.4:
+            store.put(owner, name, rng.choice(persistence.CHARACTER_CLASSES), rng.randrange(0, 121))
+        elif operation < 0.9:
+            if store.get(owner, name) is not None:
+                store.set_hp(owner, name, rng.randrange(0, 121))
+        else:
+            store.remove(owner, name)
+
+    assert len(store.index) == len(store)
+    for query in QUERIES:
+        expected = brute_force(store, **query)
+        total, entries = store.query(**query, start=0, count=10 ** 6)
+        assert total == len(expected)
+        assert sorted(entries) == expected
+        # 逐页翻完的结果不重不漏
+        pages = []
+        for start in range(0, total, 17):
+            page_total, page = store.query(**query, start=start, count=17)
+            assert page_total == total
+            pages.extend(page)
+        assert sorted(pages) == expected
+
+
+def test_replace_all_rebuilds_index():
+    store = character_store.CharacterStore()
+    store.put('p', 'old', '战士', 10)
+    store.replace_all([('p', 'a', '法师', 0), ('q', 'b', '战士', 50), ('p', 'a', '法师', 30)])
+    assert len(store) == 2
+    # 按 (职业, HP) 排列
+    assert store.query() == (2, [('q', 'b', '战士', 50), ('p', 'a', '法师', 30)])
+    assert store.query(alive=False) == (0, [])
+    assert store.get('p', 'old') is None
+
+
+def test_qualify_and_split_key_round_trip():
+    for owner in (character_store.PUBLIC_OWNER, 'p1', '玩家'):
+        for name in ('a', 'b c', '战士'):
+            assert character_store.split_key(character_store.qualify(owner, name)) == (owner, name)
+    with pytest.raises(ValueError):
+        character_store.normalize_owner('a\0b')
+    # public 的角色名带分隔符会和 alice 的 hero 撞key，必须拒绝
+    assert character_store.qualify('alice', 'hero') == 'alice\0hero'
+    for owner in (character_store.PUBLIC_OWNER, 'alice'):
+        for name in ('alice\0hero', None, 5):
+            with pytest.raises(ValueError):
+                character_store.qualify(owner, name)
+
+
+def test_journal_survives_failed_compaction(tmp_path, capsys):
+    state = {'fail': True}
+
+    def get_state():
+        if state['fail']:
+            raise ValueError('boom')
+        return {'a': ('战士', 10)}, {}
+
+    journal = persistence.Journal(str(tmp_path), commit_interval=0.001)
+    journal.recover(None, None, None)
+    journal.start(get_state)
+    journal.record_character_created('a', '战士', 120)
+    assert journal.checkpoint(timeout=5) is False
+    assert journal.failures == 1
+    assert '状态日志写入失败' in capsys.readouterr().err
+    assert not list(tmp_path.glob('*.tmp'))
+
+    # 写盘线程还活着：之后的记录照常写入，下一次压缩成功
+    journal.record_character_hp('a', 10)
+    state['fail'] = False
+    assert journal.checkpoint(timeout=5) is True
+    journal.close()
+    recovered = {}
+    persistence.Journal(str(tmp_path)).recover(
+        lambda key, character_class, hp: recovered.__setitem__(key, (character_class, hp)),
+        lambda key, hp: recovered.__setitem__(key, (recovered[key][0], hp)),
+        None)
+    assert recovered == {'a': ('战士', 10)}
+
+
+def test_oversized_strings_are_rejected_before_encoding():
+    with pytest.raises(ValueError):
+        persistence.encode_character_hp('x' * 70000, 1)
+
+
+@pytest.mark.parametrize('name', [5, None, '', '   ', 'x' * 65, 'a\0b', ['a']])
+def test_invalid_character_names(name):
+    with pytest.raises(ValueError):
+        character_store.normalize_name(name)
+
+
+def test_journal_waits_for_previous_owner_of_directory(tmp_path):
+    """重启时新进程要等旧进程关闭日志之后才能重放同一个目录"""
+    pytest.importorskip('fcntl')
+    import threading
+    first = persistence.Journal(str(tmp_path), commit_interval=0.001)
+    first.recover(None, None, None)
+    first.start(lambda: ({}, {}))
+    recovered = threading.Event()
+    second = persistence.Journal(str(tmp_path))
+    waiter = threading.Thread(target=lambda: (second.recover(None, None, None), recovered.set()))
+    waiter.start()
+    assert not recovered.wait(0.2)
+    first.close()
+    assert recovered.wait(5)
+    waiter.join()
+    second._release_lock()